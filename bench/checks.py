@@ -0,0 +1,197 @@
+"""
+Checks that the different ways of cutting an edit agree with a plain generate run.
+
+Usage:
+  checks.py [--checks=<list>] [--seed=<n>] [--speed=<x>] [--beats=<beat_cache>] [--eeg=<csv>] [--emotions=<file>] [--clips=<clip_description>]
+  checks.py (-h | --help)
+
+Options:
+  -h --help                    Show this screen.
+  --checks=<list>              Comma separated checks to run, all of them by default.
+  --seed=<n>                   The seed every edit is cut with [default: 1].
+  --speed=<x>                  How many times faster than real time to replay a session [default: 50].
+  --beats=<beat_cache>         The beat cache to cut to [default: m82_beat.json].
+  --eeg=<csv>                  The Muse csv to cut from [default: casey_eyesclosed_nosinging_2016-05-10--18-16-59_1494157843.csv].
+  --emotions=<file>            The Affdex export to cut from [default: data/MaiLanGo.mp4-metrics.json].
+  --clips=<clip_description>   The footage description to cut [default: footage_description.json].
+
+Run from the top of the repo with: python -m bench.checks
+
+Each check cuts an edit some other way and compares it line by line with the EDL generate cuts from the same inputs
+and seed, apart from the title:
+  live_replay  plays the session back through a live session at speed.
+  resume       picks up from a checkpoint with the inputs unchanged, with a scene's clips edited and with eeg rows
+               appended to a recording that was cut short.
+"""
+from __future__ import print_function
+
+__author__ = 'bjarrett'
+
+import csv
+import json
+import os
+import shutil
+import tempfile
+
+from docopt import docopt
+
+
+class Check(object):
+    """
+    One way of cutting an edit to compare with generate. run is given the inputs, a directory to work in and the
+    EDL generate cut, and returns a list of what didn't match.
+    """
+    def __init__(self, name, run):
+        super(Check, self).__init__()
+        self.name = name
+        self.run = run
+
+
+def edlBody(path):
+    """
+    :return: the lines of an EDL without its title, which is taken from the file name.
+    """
+    with open(path, 'r') as f:
+        return [x for x in f.read().splitlines() if not x.startswith('TITLE:')]
+
+
+def compareEdls(path, expectedPath, what):
+    """
+    :return: a list with a description of the first difference between the EDLs, empty when they match.
+    """
+    lines = edlBody(path)
+    expected = edlBody(expectedPath)
+    for i, (line, expectedLine) in enumerate(zip(lines, expected)):
+        if line != expectedLine:
+            return ['%s differs from generate at line %d: %r against %r' % (what, i + 2, line, expectedLine)]
+    if len(lines) != len(expected):
+        return ['%s has %d lines where generate has %d' % (what, len(lines) + 1, len(expected) + 1)]
+    return []
+
+
+def generate(inputs, outputPath, **kwargs):
+    from cli import generateEdl
+    generateEdl(inputs['beats'], inputs['clips'], inputs['eeg'], inputs['emotions'], outputPath,
+                seed=inputs['seed'], **kwargs)
+
+
+def _editScene(inputs, directory):
+    """
+    :return: inputs with a clip dropped from a scene part way through the song.
+    """
+    with open(inputs['clips'], 'r') as f:
+        description = json.load(f)
+    scenes = [x for x in description['scenes'] if len(x['clips']) > 1]
+    if not scenes:
+        raise ValueError('There is no scene in %s with a clip to drop' % inputs['clips'])
+    scenes[len(scenes) // 2]['clips'].pop()
+    edited = dict(inputs, clips=os.path.join(directory, 'edited_scene.json'))
+    with open(edited['clips'], 'w') as f:
+        json.dump(description, f, indent=2)
+    return edited
+
+
+def _shortenEeg(inputs, directory, keep=0.75):
+    """
+    :return: inputs with only the first keep of the eeg rows, as if the recording had been cut from part way
+        through. Resuming from these with the whole recording is resuming with rows appended.
+    """
+    with open(inputs['eeg'], 'r') as f:
+        lines = list(csv.reader(f))
+    shortened = dict(inputs, eeg=os.path.join(directory, 'shortened.csv'))
+    with open(shortened['eeg'], 'wb') as f:
+        csv.writer(f).writerows(lines[:1 + int((len(lines) - 1) * keep)])
+    return shortened
+
+
+def _checkResume(inputs, directory, expectedPath):
+    from moodlib.stats import RunStats
+
+    checkpointPath = os.path.join(directory, 'resume.checkpoint')
+    editedScene = _editScene(inputs, directory)
+    editedScenePath = os.path.join(directory, 'edited_scene.edl')
+    generate(editedScene, editedScenePath)
+    # What each run is checkpointed from, what it is resumed with and the edit cut from those without a checkpoint.
+    cases = [
+        ('unchanged inputs', inputs, inputs, expectedPath),
+        ('an edited scene', inputs, editedScene, editedScenePath),
+        ('appended eeg rows', _shortenEeg(inputs, directory), inputs, expectedPath),
+    ]
+    problems = []
+    for what, original, edited, fullPath in cases:
+        if os.path.exists(checkpointPath):
+            os.remove(checkpointPath)
+        generate(original, os.path.join(directory, 'checkpointed.edl'), checkpointPath=checkpointPath)
+        stats = RunStats()
+        resumedPath = os.path.join(directory, 'resumed.edl')
+        generate(edited, resumedPath, checkpointPath=checkpointPath, stats=stats)
+        recomputed = stats.counters['recomputed_beats']
+        if edited is original and recomputed:
+            problems.append('Resuming with %s recomputed %d beats' % (what, recomputed))
+        elif edited is not original and not 0 < recomputed < stats.counters['beats']:
+            problems.append('Resuming with %s recomputed %d of %d beats, it should pick up part way'
+                            % (what, recomputed, stats.counters['beats']))
+        problems.extend(compareEdls(resumedPath, fullPath, 'Resuming with %s' % what))
+    return problems
+
+
+def _checkLiveReplay(inputs, directory, expectedPath):
+    from cli import liveEdl
+    from moodlib.live import ReplaySource
+
+    outputPath = os.path.join(directory, 'live.edl')
+    # No grace so every beat waits for exactly the samples its window needs, however busy the machine is.
+    liveEdl(inputs['beats'], inputs['clips'], outputPath, [ReplaySource(inputs['eeg'], inputs['emotions'])],
+            seed=inputs['seed'], speed=inputs['speed'], grace=0.)
+    return compareEdls(outputPath, expectedPath, 'The live replay')
+
+
+CHECKS = [
+    Check('live_replay', _checkLiveReplay),
+    Check('resume', _checkResume),
+]
+
+
+def main():
+    arguments = docopt(__doc__)
+    checks = CHECKS
+    if arguments['--checks']:
+        names = arguments['--checks'].split(',')
+        unknown = set(names).difference(x.name for x in CHECKS)
+        if unknown:
+            raise ValueError('Unknown checks: %s' % ', '.join(sorted(unknown)))
+        checks = [x for x in CHECKS if x.name in names]
+
+    inputs = {
+        'seed': int(arguments['--seed']),
+        'speed': float(arguments['--speed']),
+        'beats': arguments['--beats'],
+        'eeg': arguments['--eeg'],
+        'emotions': arguments['--emotions'],
+        'clips': arguments['--clips'],
+    }
+    for key in ('beats', 'eeg', 'emotions', 'clips'):
+        if not os.path.exists(inputs[key]):
+            raise ValueError('%s does not exist' % inputs[key])
+
+    directory = tempfile.mkdtemp(prefix='auto_editor_checks_')
+    failed = []
+    try:
+        expectedPath = os.path.join(directory, 'generate.edl')
+        generate(inputs, expectedPath)
+        for check in checks:
+            problems = check.run(inputs, directory, expectedPath)
+            for problem in problems:
+                print('FAILED %s: %s' % (check.name, problem))
+            if problems:
+                failed.append(check.name)
+            else:
+                print('ok %s' % check.name)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+__author__ = 'bjarrett'
+
+import datetime
+import json
+import numpy
+
+from edllib import TimeCode
+from moodlib.emotions import EMOTION_METRICS, JSON_TIME_METRIC
+
+# The band columns of a Muse export, written out so the readers have realistic rows to skip over.
+MUSE_BANDS = ('Alpha', 'Beta', 'Delta', 'Gamma', 'Theta')
+MUSE_SENSORS = ('TP9', 'FP1', 'FP2', 'TP10')
+MUSE_START = datetime.datetime(2016, 5, 10, 18, 16, 59)
+
+# Affdex columns that aren't emotions, again only there to be skipped.
+AFFDEX_EXTRA_COLUMNS = ('attentionct_unfiltered', 'smilect_nonlinear_causal', 'eye_closurect_nonlinear_causal',
+                        'expressivenessct_nonlinear_causal', 'HeadAngleLeftRight', 'HeadAngleRoll', 'HeadAngleUpDown',
+                        'InterOcularDistance', 'MeanFaceLuminance')
+AFFDEX_SAMPLE_RATE = 14
+
+SHOT_TAGS = ('girl', 'boy', 'band', 'crowd', 'city', 'night')
+
+
+def smoothSignal(random, count, low=-1., high=1., smoothing=20):
+    """
+    A random walk kept between low and high, which looks more like a mood signal than white noise does.
+    """
+    steps = random.normal(0., (high - low) / float(smoothing), size=count)
+    walk = numpy.cumsum(steps)
+    # Fold the walk back into [low, high].
+    span = high - low
+    folded = numpy.abs(numpy.mod(walk, 2 * span) - span)
+    return low + folded
+
+
+def affdexColumn(metric):
+    return metric + ('ct_nonlinear_causal' if metric == 'valence' else 'ct_emotion_nonlinear_causal')
+
+
+def writeMuseCsv(path, seconds, seed=0, sampleRate=1):
+    """
+    Writes a Muse csv with sampleRate rows per second for seconds seconds.
+    :return: the number of rows written.
+    """
+    random = numpy.random.RandomState(seed)
+    count = int(seconds * sampleRate)
+    bandColumns = ['%s_%s' % (band, sensor) for band in MUSE_BANDS for sensor in MUSE_SENSORS]
+    rawColumns = ['RAW_%s' % sensor for sensor in MUSE_SENSORS]
+    headers = ['TimeStamp'] + bandColumns + ['Mellow', 'Concentration'] + rawColumns
+
+    bands = random.uniform(-1., 1., size=(count, len(bandColumns)))
+    mellow = smoothSignal(random, count)
+    concentration = smoothSignal(random, count)
+    raw = random.uniform(700., 900., size=(count, len(rawColumns)))
+    with open(path, 'w') as f:
+        f.write(','.join(headers) + '\n')
+        for i in range(count):
+            stamp = MUSE_START + datetime.timedelta(seconds=i / float(sampleRate))
+            cells = [stamp.strftime('%Y-%m-%d %H:%M:%S')]
+            cells.extend('%.8g' % x for x in bands[i])
+            cells.append('%.8g' % mellow[i])
+            cells.append('%.8g' % concentration[i])
+            cells.extend('%.8g' % x for x in raw[i])
+            f.write(','.join(cells) + '\n')
+    return count
+
+
+def _affdexColumns(random, count):
+    """
+    :return: millisecond timestamps and an ordered list of (column, values).
+    """
+    timeStamps = numpy.arange(count) * (1000. / AFFDEX_SAMPLE_RATE)
+    columns = [(x, random.uniform(0., 100., size=count)) for x in AFFDEX_EXTRA_COLUMNS[:4]]
+    for metric in EMOTION_METRICS:
+        low = -100. if metric == 'valence' else 0.
+        columns.append((affdexColumn(metric), smoothSignal(random, count, low=low, high=100.)))
+    columns.extend((x, random.uniform(-10., 10., size=count)) for x in AFFDEX_EXTRA_COLUMNS[4:])
+    return timeStamps, columns
+
+
+def writeAffdexCsv(path, seconds, seed=0):
+    """
+    Writes an Affdex metrics csv at the Affdex sample rate.
+    :return: the number of rows written.
+    """
+    random = numpy.random.RandomState(seed)
+    count = int(seconds * AFFDEX_SAMPLE_RATE)
+    timeStamps, columns = _affdexColumns(random, count)
+    with open(path, 'w') as f:
+        f.write(','.join(['timestamp'] + [x[0] for x in columns]) + '\n')
+        for i in range(count):
+            cells = ['%.8g' % timeStamps[i]]
+            cells.extend('%.8g' % values[i] for name, values in columns)
+            f.write(','.join(cells) + '\n')
+    return count
+
+
+def writeAffdexJson(path, seconds, seed=0):
+    """
+    Writes an Affdex metrics json, {"metrics": {name: [...]}, "metric_map": {...}}.
+    :return: the number of samples per metric.
+    """
+    random = numpy.random.RandomState(seed)
+    count = int(seconds * AFFDEX_SAMPLE_RATE)
+    timeStamps, columns = _affdexColumns(random, count)
+    metrics = [(JSON_TIME_METRIC, timeStamps)]
+    for name, values in columns:
+        metric = name.split('ct_')[0]
+        metrics.append((metric, values))
+    with open(path, 'w') as f:
+        f.write('{"metrics":{')
+        for i, (name, values) in enumerate(metrics):
+            if i:
+                f.write(',')
+            f.write('"%s":[%s]' % (name, ','.join('%.9g' % x for x in values)))
+        f.write('},"metric_map":%s}' % json.dumps(dict((x[0], i) for i, x in enumerate(metrics))))
+    return count
+
+
+def beatTimes(count, seed=0, tempo=90., start=6.):
+    """
+    Beat times that drift a little around tempo, the way a tracked tempo does.
+    """
+    random = numpy.random.RandomState(seed)
+    intervals = (60. / tempo) * (1. + random.normal(0., 0.03, size=count))
+    return start + numpy.concatenate([[0.], numpy.cumsum(intervals[:-1])])
+
+
+def writeBeatCache(path, count, seed=0, tempo=90.):
+    """
+    Writes a json beat cache like the ones the cache command exports.
+    :return: the beat times.
+    """
+    beats = beatTimes(count, seed=seed, tempo=tempo)
+    with open(path, 'w') as f:
+        json.dump(beats.tolist(), f, indent=4)
+    return beats
+
+
+def writeFootageDescription(path, clipCount, songSeconds, seed=0, sceneCount=8, clipsPerScene=None,
+                            frameRate=TimeCode.DEFAULT_FRAME_RATE):
+    """
+    Writes a footage description with clipCount clips spread over sceneCount scenes that together cover
+    songSeconds. Clips get enough footage that a long song doesn't run every scene dry.
+    :return: the number of clips written.
+    """
+    random = numpy.random.RandomState(seed)
+    clipsPerScene = clipsPerScene or max(2, min(clipCount, 2 * clipCount // sceneCount))
+
+    clips = {}
+    names = []
+    for i in range(clipCount):
+        name = 'B%03d_C%03dV%06X0001.mov' % (i // 100, i % 100, random.randint(0, 1 << 24))
+        names.append(name)
+        startFrame = int(random.randint(0, 20 * 60 * 60 * 24))
+        clip = {
+            'start_tc': str(TimeCode.fromFrame(startFrame, frameRate=frameRate)),
+            'duration': int(random.randint(100, 2000)),
+            'mellow': round(float(random.uniform(-1., 1.)), 2),
+            'concentrate': round(float(random.uniform(-1., 1.)), 2),
+            'tags': sorted(set(random.choice(SHOT_TAGS, size=random.randint(1, 3)).tolist())),
+        }
+        for metric in EMOTION_METRICS:
+            if metric != 'valence' and random.uniform() < 0.5:
+                clip[metric] = round(float(random.uniform(0., 100.)), 1)
+        clips[name] = clip
+
+    scenes = []
+    ends = numpy.linspace(0., songSeconds + 60., sceneCount + 1)[1:]
+    for i, end in enumerate(ends):
+        sceneClips = random.choice(len(names), size=min(clipsPerScene, len(names)), replace=False)
+        scenes.append({
+            'label': 'scene%d' % i,
+            'end_time': str(TimeCode.fromSeconds(end, frameRate=frameRate)),
+            'clips': [names[x] for x in sorted(sceneClips)],
+        })
+
+    with open(path, 'w') as f:
+        json.dump({'clips': clips, 'scenes': scenes}, f, indent=4, sort_keys=True)
+    return clipCount
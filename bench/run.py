@@ -0,0 +1,425 @@
+"""
+Times each stage of the pipeline on generated data and compares the results with a stored baseline.
+
+Usage:
+  run.py [--scale=<name>] [--seconds=<n>] [--beats=<n>] [--clips=<n>] [--seed=<n>] [--repeat=<n>] [--stages=<list>] [--data-dir=<dir>] [--baseline=<file>] [--tolerance=<x>] [--save-baseline] [--json=<file>]
+  run.py (-h | --help)
+
+Options:
+  -h --help            Show this screen.
+  --scale=<name>       A preset size, small or large [default: small].
+  --seconds=<n>        Length of the generated viewer session in seconds.
+  --beats=<n>          Number of beats in the generated song.
+  --clips=<n>          Number of clips in the generated footage description.
+  --seed=<n>           Seed for the generated data [default: 0].
+  --repeat=<n>         Time each stage this many times and keep the best, at least 3 to compare or save [default: 3].
+  --stages=<list>      Comma separated stages to run, all of them by default.
+  --data-dir=<dir>     Keep the generated data here instead of a temporary directory.
+  --baseline=<file>    The baseline to compare with [default: bench/baseline.json].
+  --tolerance=<x>      How much slower or bigger than the baseline a stage can be before it is a regression [default: 0.25].
+  --save-baseline      Store these results as the baseline for this scale instead of comparing.
+  --json=<file>        Also write the results out as json.
+
+Run from the top of the repo with: python -m bench.run
+
+Each stage runs in its own process so its peak memory isn't muddied by the stages before it.
+
+Timings are compared relative to a fixed calibration workload timed in the same run, so a baseline saved on one
+machine still means something on a slower or busier one.
+"""
+from __future__ import print_function
+
+__author__ = 'bjarrett'
+
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import numpy
+
+from docopt import docopt
+
+from bench import generators
+from moodlib.stats import peakMegabytes
+
+SCALES = {
+    'small': {'seconds': 1800, 'beats': 2000, 'clips': 500},
+    # A two hour session cut to a long set.
+    'large': {'seconds': 2 * 60 * 60, 'beats': 10000, 'clips': 5000},
+}
+
+# Slowdowns smaller than this many seconds are timer noise however large they are as a fraction.
+NOISE_SECONDS = 0.005
+# A best of fewer runs than this is too noisy to judge against the baseline or to save as one.
+MIN_REPEAT = 3
+
+
+class Stage(object):
+    """
+    One thing to time. setup loads whatever the stage needs and returns the arguments for run, which is what gets
+    timed. count is how many units of work one run does, for throughput.
+    """
+    def __init__(self, name, unit, setup, run):
+        super(Stage, self).__init__()
+        self.name = name
+        self.unit = unit
+        self.setup = setup
+        self.run = run
+
+
+def _setupEeg(data):
+    return (data['eeg'],), data['eegRows']
+
+
+def _runEeg(path):
+    from moodlib import readEegData
+    readEegData(path, useCache=False)
+
+
+def _setupEegCached(data):
+    from moodlib import readEegData
+    readEegData(data['eeg'])
+    return (data['eeg'],), data['eegRows']
+
+
+def _runEegCached(path):
+    from moodlib import readEegData
+    readEegData(path)
+
+
+def _setupEmotionCsv(data):
+    return (data['emotionCsv'],), data['emotionRows']
+
+
+def _setupEmotionJson(data):
+    return (data['emotionJson'],), data['emotionRows']
+
+
+def _runEmotion(path):
+    from moodlib import readEmotionData, EMOTION_METRICS
+    readEmotionData(path, EMOTION_METRICS, useCache=False)
+
+
+def _loadBeats(data):
+    with open(data['beats'], 'r') as f:
+        return numpy.array(json.load(f), dtype=numpy.float64)
+
+
+def _setupTimeCode(data):
+    return (_loadBeats(data),), data['beatCount']
+
+
+def _runTimeCodeArray(beats):
+    from cli import FRAME_RATE
+    from edllib import TimeCodeArray
+    TimeCodeArray.fromSeconds(beats, frameRate=FRAME_RATE).toStrings()
+
+
+def _runTimeCodeScalar(beats):
+    from cli import FRAME_RATE
+    from edllib import TimeCode
+    [str(TimeCode.fromSeconds(x, frameRate=FRAME_RATE)) for x in beats]
+
+
+def _setupChooseClip(data):
+    from cli import loadClips, FRAME_RATE
+    from moodlib import SceneTimeline, ClipScorer
+    scenes, clips = loadClips(data['footage'])
+    timeline = SceneTimeline(scenes, clips, frameRate=FRAME_RATE)
+    beats = _loadBeats(data)
+    scorer = ClipScorer(clips, seed=0)
+    random = numpy.random.RandomState(0)
+    targets = scorer.targets({'mellow': random.uniform(-1., 1., size=len(beats)),
+                              'concentrate': random.uniform(-1., 1., size=len(beats))})
+    candidates = [timeline.sceneClips[x] for x in timeline.sceneIndices(beats)]
+    return (scorer, targets, candidates), len(beats)
+
+
+def _runChooseClip(scorer, targets, candidates):
+    from moodlib.cuts import chooseClip
+    lastClip = -1
+    for beatTargets, beatCandidates in zip(targets, candidates):
+        lastClip = chooseClip(scorer, beatTargets, beatCandidates, lastClip, 0)[0]
+
+
+def _setupCreateCuts(data):
+    from cli import loadClips
+    from moodlib import readEegData, readEmotionData, EMOTION_METRICS
+    scenes, clips = loadClips(data['footage'])
+    eeg = readEegData(data['eeg'], useCache=False)
+    emotions = readEmotionData(data['emotionCsv'], EMOTION_METRICS, useCache=False)
+    return (scenes, clips, eeg, emotions, _loadBeats(data)), data['beatCount']
+
+
+def _runCreateCuts(scenes, clips, eeg, emotions, beats):
+    import copy
+    from cli import createCuts
+    from edllib import EDL
+    # Clips remember where they were last used, so every run needs fresh ones.
+    clips = copy.deepcopy(clips)
+    createCuts(scenes, clips, eeg, emotions, beats, EDL('bench'), seed=0)
+
+
+def _cutArguments(data):
+    """
+    :return: the arguments of a cut for every beat, for the EDL stages.
+    """
+    from cli import FRAME_RATE
+    from edllib import Clip, TimeCodeArray
+    beats = _loadBeats(data)
+    frames = TimeCodeArray.fromSeconds(beats, frameRate=FRAME_RATE)
+    starts = TimeCodeArray(numpy.concatenate([[1], frames.frames[:-1]]), frameRate=FRAME_RATE)
+    clip = Clip('B001_C001V018FF30001.mov')
+    cuts = []
+    for i in range(len(beats)):
+        cuts.append((clip, starts[i], frames[i], starts[i], frames[i]))
+    return cuts
+
+
+def _setupEdlWrite(data):
+    from edllib import EDL
+    edl = EDL('bench')
+    for cut in _cutArguments(data):
+        edl.addCut(*cut)
+    return (edl, os.path.join(data['directory'], 'bench.edl')), data['beatCount']
+
+
+def _runEdlWrite(edl, path):
+    with open(path, 'w') as f:
+        edl.write(f)
+
+
+def _setupEdlWriter(data):
+    return (_cutArguments(data), os.path.join(data['directory'], 'bench.edl')), data['beatCount']
+
+
+def _runEdlWriter(cuts, path):
+    from edllib import EDLWriter
+    with EDLWriter.open(path, 'bench') as writer:
+        for cut in cuts:
+            writer.addCut(*cut)
+
+
+def _setupCalibration(data):
+    random = numpy.random.RandomState(0)
+    return (random.uniform(size=200000), 200000), 200000
+
+
+def _runCalibration(values, loops):
+    # A bit of interpreter work and a bit of numpy work, roughly the mix of the real stages.
+    total = 0
+    for i in range(loops):
+        total += i % 7
+    numpy.sort(values)
+    numpy.cumsum(values)
+
+
+# Not a stage of the pipeline, it is timed alongside them to scale the baseline to this machine.
+CALIBRATION = Stage('calibration', 'loops', _setupCalibration, _runCalibration)
+
+STAGES = [
+    Stage('eeg_read', 'rows', _setupEeg, _runEeg),
+    Stage('eeg_read_cached', 'rows', _setupEegCached, _runEegCached),
+    Stage('emotion_csv_read', 'rows', _setupEmotionCsv, _runEmotion),
+    Stage('emotion_json_read', 'rows', _setupEmotionJson, _runEmotion),
+    Stage('timecode_array', 'beats', _setupTimeCode, _runTimeCodeArray),
+    Stage('timecode_scalar', 'beats', _setupTimeCode, _runTimeCodeScalar),
+    Stage('choose_clip', 'beats', _setupChooseClip, _runChooseClip),
+    Stage('create_cuts', 'beats', _setupCreateCuts, _runCreateCuts),
+    Stage('edl_write', 'events', _setupEdlWrite, _runEdlWrite),
+    Stage('edl_writer', 'events', _setupEdlWriter, _runEdlWriter),
+]
+
+
+def generateData(directory, seconds, beats, clips, seed=0):
+    """
+    Writes a full set of generated inputs into directory.
+    :return: a dict of the paths and sizes.
+    """
+    from cli import FRAME_RATE
+    data = {'directory': directory}
+    data['eeg'] = os.path.join(directory, 'muse.csv')
+    data['eegRows'] = generators.writeMuseCsv(data['eeg'], seconds, seed=seed)
+    data['emotionCsv'] = os.path.join(directory, 'affdex-metrics.csv')
+    data['emotionRows'] = generators.writeAffdexCsv(data['emotionCsv'], seconds, seed=seed + 1)
+    data['emotionJson'] = os.path.join(directory, 'affdex-metrics.json')
+    generators.writeAffdexJson(data['emotionJson'], seconds, seed=seed + 1)
+    data['beats'] = os.path.join(directory, 'beats.json')
+    beatTimes = generators.writeBeatCache(data['beats'], beats, seed=seed + 2)
+    data['beatCount'] = beats
+    data['footage'] = os.path.join(directory, 'footage_description.json')
+    generators.writeFootageDescription(data['footage'], clips, songSeconds=beatTimes[-1], seed=seed + 3,
+                                       frameRate=FRAME_RATE)
+    return data
+
+
+def _measure(stage, data, repeat, connection):
+    """
+    Runs in a child process: sets the stage up, times it and reports back through connection.
+    """
+    try:
+        args, count = stage.setup(data)
+        setupPeak = peakMegabytes()
+        best = None
+        for i in range(repeat):
+            start = time.time()
+            stage.run(*args)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        peak = peakMegabytes()
+        connection.send({
+            'seconds': best,
+            'count': count,
+            'unit': stage.unit,
+            'throughput': count / best if best else float('inf'),
+            'peak_mb': peak,
+            'growth_mb': peak - setupPeak,
+        })
+    except Exception as e:
+        connection.send({'error': '%s: %s' % (type(e).__name__, e)})
+    finally:
+        connection.close()
+
+
+def measureStage(stage, data, repeat):
+    parent, child = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_measure, args=(stage, data, repeat, child))
+    process.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = {'error': 'the stage process died with exit code %s' % process.exitcode}
+    process.join()
+    return result
+
+
+def machineSpeed(results, baseline):
+    """
+    :return: how much slower this run's calibration was than the baseline's, 1 when either is missing.
+    """
+    current = results.get(CALIBRATION.name)
+    expected = baseline.get(CALIBRATION.name)
+    if not current or not expected or 'error' in current:
+        return 1.
+    return current['seconds'] / expected['seconds']
+
+
+def compare(results, baseline, tolerance, noiseSeconds=NOISE_SECONDS):
+    """
+    :param noiseSeconds: slowdowns under this many seconds are never regressions.
+    :return: a list of (stage, what, current, baseline) for each measure more than tolerance worse than baseline.
+        Baseline seconds are scaled by the calibration stage to this machine.
+    """
+    speed = machineSpeed(results, baseline)
+    regressions = []
+    for name, result in sorted(results.items()):
+        expected = baseline.get(name)
+        if expected is None or 'error' in result or name == CALIBRATION.name:
+            continue
+        expectedSeconds = expected['seconds'] * speed
+        if result['seconds'] > expectedSeconds * (1. + tolerance) and \
+                result['seconds'] - expectedSeconds > noiseSeconds:
+            regressions.append((name, 'seconds', result['seconds'], expectedSeconds))
+        # Small growths are mostly allocator noise, only flag ones over a megabyte.
+        if result['growth_mb'] > max(expected['growth_mb'] * (1. + tolerance), expected['growth_mb'] + 1.):
+            regressions.append((name, 'growth_mb', result['growth_mb'], expected['growth_mb']))
+    return regressions
+
+
+def report(results, baseline):
+    speed = machineSpeed(results, baseline)
+    if speed != 1.:
+        print('This machine ran the calibration at %.2fx the baseline time' % speed)
+    print('%-20s %10s %14s %10s %10s %10s' % ('stage', 'seconds', 'throughput', 'peak MB', 'growth MB', 'vs base'))
+    for stage in [CALIBRATION] + STAGES:
+        result = results.get(stage.name)
+        if result is None:
+            continue
+        if 'error' in result:
+            print('%-20s failed: %s' % (stage.name, result['error']))
+            continue
+        expected = baseline.get(stage.name)
+        change = '-'
+        if expected and stage is not CALIBRATION:
+            change = '%+.0f%%' % (100. * (result['seconds'] / (expected['seconds'] * speed) - 1.))
+        print('%-20s %10.4f %9.0f %-4s %10.1f %10.1f %10s' % (stage.name, result['seconds'], result['throughput'],
+                                                             result['unit'], result['peak_mb'], result['growth_mb'],
+                                                             change))
+
+
+def main():
+    arguments = docopt(__doc__)
+    scaleName = arguments['--scale']
+    if scaleName not in SCALES:
+        raise ValueError('Unknown scale %s, use one of %s' % (scaleName, ', '.join(sorted(SCALES))))
+    scale = dict(SCALES[scaleName])
+    for key in ('seconds', 'beats', 'clips'):
+        if arguments['--' + key]:
+            scale[key] = int(arguments['--' + key])
+            scaleName = 'custom'
+
+    stages = STAGES
+    if arguments['--stages']:
+        names = arguments['--stages'].split(',')
+        unknown = set(names).difference(x.name for x in STAGES)
+        if unknown:
+            raise ValueError('Unknown stages: %s' % ', '.join(sorted(unknown)))
+        stages = [x for x in STAGES if x.name in names]
+
+    repeat = int(arguments['--repeat'])
+    if arguments['--save-baseline'] and repeat < MIN_REPEAT:
+        raise ValueError('A baseline needs at least %d repeats' % MIN_REPEAT)
+
+    directory = arguments['--data-dir'] or tempfile.mkdtemp(prefix='auto_editor_bench_')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    try:
+        print('Generating %(seconds)d second session, %(beats)d beats and %(clips)d clips' % scale)
+        data = generateData(directory, seed=int(arguments['--seed']), **scale)
+        results = {}
+        for stage in [CALIBRATION] + stages:
+            results[stage.name] = measureStage(stage, data, repeat)
+    finally:
+        if not arguments['--data-dir']:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    baselinePath = arguments['--baseline']
+    baselines = {}
+    if os.path.exists(baselinePath):
+        with open(baselinePath, 'r') as f:
+            baselines = json.load(f)
+    baseline = baselines.get(scaleName, {})
+    report(results, baseline)
+
+    if arguments['--json']:
+        with open(arguments['--json'], 'w') as f:
+            json.dump({'scale': scale, 'results': results}, f, indent=4, sort_keys=True)
+
+    failed = [name for name, result in results.items() if 'error' in result]
+    if arguments['--save-baseline']:
+        if failed:
+            raise SystemExit('Not saving a baseline with failed stages: %s' % ', '.join(sorted(failed)))
+        baselines[scaleName] = dict((name, dict((k, result[k]) for k in ('seconds', 'growth_mb', 'peak_mb')))
+                                    for name, result in results.items())
+        with open(baselinePath, 'w') as f:
+            json.dump(baselines, f, indent=4, sort_keys=True)
+        print('Saved the %s baseline to %s' % (scaleName, baselinePath))
+        return
+
+    if repeat < MIN_REPEAT:
+        print('Not comparing with the baseline, that takes at least %d repeats' % MIN_REPEAT)
+        if failed:
+            raise SystemExit(1)
+        return
+    regressions = compare(results, baseline, float(arguments['--tolerance']))
+    for name, what, current, expected in regressions:
+        print('REGRESSION %s %s: %.4f against a baseline of %.4f' % (name, what, current, expected))
+    if failed or regressions:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
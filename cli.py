@@ -2,329 +2,835 @@
 A tool which generates an EDL file from some kind of input.
 
 Usage:
-  cli.py cache <audio_file> <output_beat_cache>
-  cli.py generate <beat_cache> <muse_eeg_csv> <clip_description> <output_edl>
-  cli.py graph <muse_eeg_csv>
+  cli.py cache ls [--cache-dir=<dir>]
+  cli.py cache prune [--max-size=<mb>] [--cache-dir=<dir>]
+  cli.py cache <audio_file> [<output_beat_cache>] [--cache-dir=<dir>] [--sr=<hz>] [--block=<seconds>]
+  cli.py generate [--seed=<n>] [--planner=<name>] [--beam=<n>] [--profile] [--stats=<file>] [--checkpoint=<file>] [--server=<address>] [--raw-eeg] [--workers=<n>] [--cache-dir=<dir>] [--sr=<hz>] [--block=<seconds>] <beat_cache> <muse_eeg_csv> <emotion_file> <clip_description> <output_edl>
+  cli.py variants [--count=<n>] [--seed=<n>] [--randomness=<list>] [--planner=<name>] [--beam=<n>] [--profile] [--stats=<file>] [--raw-eeg] [--workers=<n>] [--cache-dir=<dir>] [--sr=<hz>] [--block=<seconds>] <beat_cache> <muse_eeg_csv> <emotion_file> <clip_description> <output_dir>
+  cli.py batch [--workers=<n>] [--seed=<n>] [--cache-dir=<dir>] [--sr=<hz>] [--block=<seconds>] <beat_cache> <clip_description> <manifest>
+  cli.py live [--seed=<n>] [--cache-dir=<dir>] [--sr=<hz>] [--block=<seconds>] [--udp=<port>] [--tail-eeg=<csv>] [--tail-emotion=<csv>] [--replay-eeg=<csv>] [--replay-emotion=<file>] [--speed=<x>] [--grace=<seconds>] [--json] <beat_cache> <clip_description> <output_edl>
+  cli.py serve [--socket=<path>] [--port=<n>] [--max-memory=<mb>] [--cache-dir=<dir>] [--sr=<hz>] [--block=<seconds>]
+  cli.py scan [--workers=<n>] [--index=<file>] [--ffprobe=<path>] <clip_description> <footage_dir>...
+  cli.py edl at <edl> <timecode>...
+  cli.py edl diff <edl> <other_edl>
+  cli.py edl usage <edl>
+  cli.py graph [--output=<file>] [--width=<px>] [--height=<px>] [--decimate=<method>] [--emotions=<file>] [--beats=<beat_cache>] [--clips=<clip_description>] [--edl=<file>] <muse_eeg_csv>
   cli.py (-h | --help)
 
 Options:
   -h --help             Show this screen.
+  --seed=<n>            Seed the randomness in choosing clips so an edit can be reproduced.
+  --planner=<name>      How cuts are chosen: greedy, beat by beat, or viterbi, planning the whole song at once [default: greedy].
+  --beam=<n>            With the viterbi planner, only carry this many candidate states between beats.
+  --count=<n>           How many variants to cut for each amount of randomness, always one for 0 [default: 4].
+  --randomness=<list>   Comma separated amounts of randomness to cut variants with, 0 for none [default: 1.0].
+  --profile             Log the time and memory each stage of the run took and the cut loop's counters.
+  --stats=<file>        Write the stage timings and cut loop counters out as json.
+  --checkpoint=<file>   Keep the cutting state after every beat here, and when an earlier run left one, only recut from the first beat whose inputs changed.
+  --server=<address>    Have a serve daemon, at a Unix socket path or http://host:port, generate the edit instead.
+  --raw-eeg             Work mellow and concentration out from the Muse csv's raw channels instead of taking the headband's own scores.
+  --socket=<path>       Serve requests on this Unix socket.
+  --port=<n>            Serve requests over HTTP on this local port instead.
+  --max-memory=<mb>     How much loaded data serve keeps before dropping the least recently used [default: 2048].
+  --cache-dir=<dir>     Where beat analyses are kept, $AUTO_EDITOR_CACHE or ~/.auto_editor/beats by default.
+  --max-size=<mb>       How big the beat cache can get before old entries are removed [default: 1024].
+  --sr=<hz>             Sample rate to analyse audio at, the file's own rate by default.
+  --block=<seconds>     Analyse audio this many seconds at a time to bound memory on long recordings.
+  --workers=<n>         Processes to generate a batch with, one per core by default, threads to probe clips with when scanning, or processes to work out raw EEG features with.
+  --index=<file>        Where scan remembers what it probed, <clip_description>.scan.json by default.
+  --ffprobe=<path>      The ffprobe to read clip timecodes and durations with [default: ffprobe].
+  --udp=<port>          Listen for Muse and Affdex OSC messages on this local UDP port.
+  --tail-eeg=<csv>      Follow a Muse csv as it is being written.
+  --tail-emotion=<csv>  Follow an Affdex csv as it is being written.
+  --replay-eeg=<csv>    Play back a recorded Muse csv as if it were arriving live.
+  --replay-emotion=<file>  Play back a recorded Affdex csv or json as if it were arriving live.
+  --speed=<x>           How fast the session clock runs, to replay quicker than real time [default: 1].
+  --grace=<seconds>     How long to wait for stragglers after a beat's section closes [default: 0.25].
+  --json                Also print each cut as a line of json on stdout.
+  --output=<file>       Render the graph to a .png or .svg without a display instead of opening a window.
+  --width=<px>          Width of the graph, series are thinned out to about this many points [default: 1600].
+  --height=<px>         Height of the graph [default: 600].
+  --decimate=<method>   How series are thinned out: minmax keeps every spike, lttb keeps the shape [default: minmax].
+  --emotions=<file>     Also plot the emotions from an Affdex csv or json.
+  --beats=<beat_cache>  Mark the beats along the bottom of the graph.
+  --clips=<clip_description>  Mark the scene boundaries of a clip description.
+  --edl=<file>          Mark the cuts of an EDL along the top of the graph.
+
+<beat_cache> can be an exported .json/.npz beat cache or the audio file itself.
+serve keeps beats, clips and sessions loaded between requests: POST /generate a json object of the generate
+arguments (beat_cache, muse_eeg_csv, emotion_file, clip_description, output_edl, seed, planner, beam, raw_eeg), and
+GET /stats for its cache hits and misses.
+scan probes the clips under each <footage_dir> and writes or updates <clip_description>, keeping its scenes and ratings.
+With --raw-eeg the csv's raw channels are converted once to memory mapped files next to it and band power is worked
+out over fixed size chunks of them, so memory stays the same however long the recording.
+variants writes variant_NN.edl for each variant and a summary.json comparing them to <output_dir>.
+A batch <manifest> is a csv with eeg, emotion and output columns and an optional seed column.
+edl reads an existing EDL, gzipped or not, to show the clip at some record timecodes, where it differs from another,
+or how much of each clip it uses.
 
 """
 
+# numpy, edllib and moodlib are imported where they are used, so a subcommand only loads what it needs and
+# generate --server answers without loading them at all.
 from docopt import docopt
 from zoic_api.logger import LOG
 from pprint import pformat, pprint
-from edllib import EDL, Clip, TimeCode
 import random
+import contextlib
+import copy
+import csv
 import json
+import multiprocessing
 import os
-import datetime
+import socket
+import sys
 import time
-import csv
-import numpy
-import math
+from fractions import Fraction
 
 __author__ = 'bjarrett'
 
-FRAME_RATE = 24/1.001
+FRAME_RATE = Fraction(24000, 1001)
+# How many beat scores variants share rather than each working them out again, 16M of them is 128MB.
+VARIANT_KEEP_SCORES = 16 * 1024 * 1024
 
 
-class MoodyClip(Clip):
-    def __init__(self, name):
-        super(MoodyClip, self).__init__(name)
-        self.concentrate = 0
-        self.mellow = 0
-        self.tags = set()
-        self.lastUsedEnd = None
+def saveAudioCache(audioPath, cachePath=None, cacheDir=None, analysisParams=None):
+    """
+    Analyses the beats of an audio file into the beat cache, optionally exporting them to cachePath as well.
+    :param analysisParams: overrides for the analysis, e.g. sr or block.
+    """
+    import numpy
+    from moodlib.beats import BeatCache
 
-def convertTimeStamp(ts):
-    dt = datetime.datetime.strptime(ts, '%Y-%m-%d %H:%M:%S')
-    return time.mktime(dt.timetuple())
+    entry = BeatCache(cacheDir).analysis(audioPath, **(analysisParams or {}))
+    if cachePath is not None:
+        if cachePath.endswith('.npz'):
+            numpy.savez(cachePath, beats=entry['beats'], tempo=entry['tempo'], onset_envelope=entry['onset_envelope'])
+        else:
+            with open(cachePath, 'wb') as f:
+                json.dump(entry['beats'].tolist(), f)
+    return entry
 
-def readEegData(eegPath):
-    headers = []
-    rows = []
-    with open(eegPath, 'rb') as f:
-        reader = csv.reader(f)
+def loadAudioCache(cachePath, cacheDir=None, analysisParams=None):
+    """
+    Loads beat times from an exported .json or .npz beat cache. Given an audio file instead, the beats come from the
+    beat cache, analysing the audio first if it has never been seen.
+    """
+    import numpy
+    from moodlib.beats import BeatCache
 
-        firstTimeStamp = None
-        for i, row in enumerate(reader):
-            if i == 0:
-                headers = [x.strip() for x in row]
-                continue
+    extension = os.path.splitext(cachePath)[1].lower()
+    if extension == '.json':
+        with open(cachePath, 'rb') as f:
+            return json.load(f)
+    if extension == '.npz':
+        with numpy.load(cachePath) as data:
+            return data['beats']
+    return BeatCache(cacheDir).analysis(cachePath, **(analysisParams or {}))['beats']
 
-            d = dict([(header, value) for header, value in zip(headers, row)])
-            d['TimeStamp'] = convertTimeStamp(d['TimeStamp'])
+def listAudioCache(cacheDir=None):
+    from moodlib.beats import BeatCache
 
-            if firstTimeStamp is None:
-                firstTimeStamp = d['TimeStamp']
-                d['Seconds'] = 0
-            else:
-                d['Seconds'] = d['TimeStamp'] - firstTimeStamp
-
-            for k in d.keys():
-                if k in ('TimeStamp', 'Seconds'):
-                    continue
-                v = d[k]
-                if v.strip() == '':
-                    v = None
-                else:
-                    v = float(v)
-                d[k] = v
-            rows.append(d)
-
-    seconds = numpy.array([x['Seconds'] for x in rows])
-    mellow = numpy.array([x['Mellow'] for x in rows])
-    concentration = numpy.array([x['Concentration'] for x in rows])
-    return seconds, mellow, concentration
-
-def readEmotionData(filepath, metrics):
-    headers = []
-    rows = []
-    with open(filepath, 'rb') as f:
-        reader = csv.reader(f)
-
-        firstTimeStamp = None
-        for i, row in enumerate(reader):
-            if i == 0:
-                headers = [x.strip() for x in row]
-                continue
-
-            d = dict([(header, value) for header, value in zip(headers, row)])
-
-            if firstTimeStamp is None:
-                firstTimeStamp = d['timestamp'] / 1000
-                d['Seconds'] = 0
-            else:
-                d['Seconds'] = d['timestamp'] / 1000 - firstTimeStamp
-
-            for k in d.keys():
-                if k in ('timestamp', 'Seconds'):
-                    continue
-                v = d[k]
-                if v.strip() == '':
-                    v = None
-                else:
-                    v = float(v)
-                d[k] = v
-            rows.append(d)
-
-    seconds = numpy.array([x['Seconds'] for x in rows])
-
-    metricsDict = dict()
-    for metric in metrics:
-        metricsDict[metric] = numpy.array([x[metric + 'ct_emotion_nonlinear_causal'] for x in rows])
-
-    return seconds, metricsDict
-
-def saveAudioCache(audioPath, cachePath):
-    import librosa
-    y, sr = librosa.load(audioPath, sr=None)
-    y_harmonic, y_percussive = librosa.effects.hpss(y)
-    tempo, beats = librosa.beat.beat_track(y=y_percussive, sr=sr)
-    beatTimes = librosa.frames_to_time(beats, sr=sr)
-
-    beatTimes = list(beatTimes)
-    with open(cachePath, 'wb') as f:
-        json.dump(beatTimes, f, indent=4)
-
-def loadAudioCache(cachePath):
-    with open(cachePath, 'rb') as f:
-        return json.load(f)
-
-def chooseClip(targetMellow, targetConcentrate, targetEmotions, targetValence, clips, lastClip, reusedCounter):
-    """
-    Determines ideal camera angle and shot content based on source data:
-    1) Sums all targetEmotions to compute emotional intensity of shot as deviation from neutral camera angle (MS-MWS)
-    2) Compares targetMellow vs targetConcentrate to choose which direction to select on camera angle spectrum (XCU-CU-MS-MWS-WS-XWS)
-    3) OPTION: We can implement targetValence as control over frames per second (slow motion)
-    4) TODO: Integrate Watson JSON data to incorporate lyrical emotional data
-    """
-    # Control randomness factor in choosing clip for iteration (0 = no randomness, 1.0 = highly random)
-    randomness = 1.0
-
-    def score(target, value):
-        scoreDiff = target - value
-        if scoreDiff == 0:
-            # Cannot divide by zero
-            scoreDiff = 0.01
-        return 1. / scoreDiff
-
-    # Compute the score for each and then pick the highest score.
-    scores = []
-    for clip in clips:
-        trackScores = []
-        for metric in metrics:
-            trackScores.append(score(metric, clip[metric])
-        averageScore = numpy.mean(trackScores)
-        if clip == lastClip:
-            averageScore = averageScore * (1 / (math.log(reusedCounter + 1) + 1))
-        if randomness > 0:
-            averageScore = averageScore + randomnessFactor * numpy.random.uniform(-1 * averageScore, averageScore)
-        scores.append(
-            (clip, averageScore)
-        )
-
-    sortedByScores = sorted(scores, key=lambda x: x[1], reverse=True)
-    return sortedByScores[0][0]
-
-def generateEdl(beatCachePath, clipDescriptionPath, musePath, affdexPath, outputPath):
-    beats = loadAudioCache(beatCachePath)
+    cache = BeatCache(cacheDir)
+    entries = cache.entries()
+    for key, size, lastUsed, meta in entries:
+        print '%s  %8.1fK  %s  %s' % (key[:12], size / 1024., time.strftime('%Y-%m-%d %H:%M', time.localtime(lastUsed)),
+                                    meta.get('audio', '?'))
+    print '%d entries, %.1fM in %s' % (len(entries), sum(x[1] for x in entries) / 1024. ** 2,
+                                         cache.directory)
+
+def pruneAudioCache(maxMegabytes, cacheDir=None):
+    from moodlib.beats import BeatCache
+
+    removed = BeatCache(cacheDir).prune(int(maxMegabytes * 1024 * 1024))
+    print 'Removed %d entries' % len(removed)
+
+def loadBeats(beatCachePath, cacheDir=None, analysisParams=None):
+    beats = loadAudioCache(beatCachePath, cacheDir=cacheDir, analysisParams=analysisParams)
     if len(beats) <= 0:
         raise ValueError('There are no beats!')
+    return beats
+
+def loadClips(clipDescriptionPath):
+    """
+    :return: the scenes of a clip description and a MoodyClip for each of its clips.
+    """
+    from moodlib.library import ClipLibrary, MoodyClip
+
+    library = ClipLibrary.load(clipDescriptionPath, frameRate=FRAME_RATE)
+    return library.scenes(), library.clips(MoodyClip)
 
-    # Load up the clip description.
-    f = open(clipDescriptionPath, 'rb')
-    clipDescriptionBlob = json.load(f)
-    f.close()
+def edlTitle(outputPath):
+    title = os.path.splitext(os.path.basename(outputPath))[0]
+    if outputPath.endswith('.gz'):
+        title = os.path.splitext(title)[0]
+    return title
 
-    # Get our clip objects.
-    clips = []
-    for clip, clipInfo in clipDescriptionBlob['clips'].iteritems():
-        c = MoodyClip(clip)
-        c.startTc = TimeCode.fromString(clipInfo['start_tc'], frameRate=FRAME_RATE)
-        c.duration = clipInfo['duration']
-        c.concentrate = clipInfo['concentrate']
-        c.mellow = clipInfo['mellow']
-        clips.append(c)
+@contextlib.contextmanager
+def openEdl(outputPath):
+    """
+    Opens an EDLWriter on a temporary file next to outputPath that is only moved into place once the writer is
+    closed without an error, so a cut that fails part way never leaves a truncated EDL behind.
+    """
+    from edllib import EDLWriter
+    from moodlib.cache import replaceFile
+
+    # Keep the extension so a .gz output is still gzipped.
+    tmpPath = '%s.tmp%s' % os.path.splitext(outputPath)
+    edlFile = EDLWriter.open(tmpPath, edlTitle(outputPath))
+    written = False
+    try:
+        yield edlFile
+        edlFile.close()
+        written = True
+    finally:
+        if not written:
+            # What was cut before the failure is thrown away, so there is no need to write out the buffer.
+            edlFile.f.close()
+            os.remove(tmpPath)
+    replaceFile(tmpPath, outputPath)
+
+def writeEdl(outputPath, scenes, clips, eeg, emotions, beats, seed=None, stats=None, planner='greedy', beam=None,
+             checkpointPath=None):
+    from moodlib.stats import RunStats
+
+    stats = stats or RunStats()
+    # Cuts are written out as they are made, the last of them when the writer is closed.
+    with stats.stage('cut_loop'):
+        with openEdl(outputPath) as edlFile:
+            createCuts(scenes=scenes, clips=clips, eeg=eeg, emotions=emotions, beats=beats, edl=edlFile, seed=seed,
+                       stats=stats, planner=planner, beam=beam, checkpointPath=checkpointPath)
+    return edlFile.eventCount
+
+def loadSession(beatCachePath, clipDescriptionPath, musePath, affdexPath, cacheDir=None, analysisParams=None,
+                stats=None, rawEeg=False, workers=None):
+    """
+    :param rawEeg: work the eeg out from the csv's raw channels, see readRawEegData.
+    :param workers: how many processes to work raw eeg out with.
+    :return: the beats, scenes, clips, eeg and emotions of a session.
+    """
+    from moodlib import readEegData, readRawEegData, readEmotionData, EMOTION_METRICS
+    from moodlib.stats import RunStats
 
-    emotionMetrics = ['joy', 'disgust', 'sadness', 'anger', 'surprise', 'contempt', 'fear', 'valence']
+    stats = stats or RunStats()
+    with stats.stage('load_beats'):
+        beats = loadBeats(beatCachePath, cacheDir=cacheDir, analysisParams=analysisParams)
+    with stats.stage('load_clips'):
+        scenes, clips = loadClips(clipDescriptionPath)
 
     # Read key data points
-    eeg = readEegData(musePath)
-    emotions = readEmotionData(affdexPath, emotionMetrics)
-    edlFile = EDL(os.path.splitext(os.path.basename(outputPath))[0])
+    with stats.stage('eeg_parse'):
+        eeg = readRawEegData(musePath, workers=workers) if rawEeg else readEegData(musePath)
+    with stats.stage('emotion_parse'):
+        emotions = readEmotionData(affdexPath, EMOTION_METRICS)
+    return beats, scenes, clips, eeg, emotions
+
+def generateEdl(beatCachePath, clipDescriptionPath, musePath, affdexPath, outputPath, seed=None, cacheDir=None,
+                analysisParams=None, stats=None, planner='greedy', beam=None, checkpointPath=None, rawEeg=False,
+                workers=None):
+    from moodlib.stats import RunStats
+
+    stats = stats or RunStats()
+    beats, scenes, clips, eeg, emotions = loadSession(beatCachePath, clipDescriptionPath, musePath, affdexPath,
+                                                      cacheDir=cacheDir, analysisParams=analysisParams, stats=stats,
+                                                      rawEeg=rawEeg, workers=workers)
+    writeEdl(outputPath, scenes, clips, eeg, emotions, beats, seed=seed, stats=stats, planner=planner, beam=beam,
+             checkpointPath=checkpointPath)
+    return stats
+
+def generateVariants(beatCachePath, clipDescriptionPath, musePath, affdexPath, outputDir, count=4, seed=0,
+                     randomness=(1.0,), cacheDir=None, analysisParams=None, stats=None, planner='greedy',
+                     beam=None, rawEeg=False, workers=None):
+    """
+    Cuts several edits of one session, count for each amount of randomness with seeds counting up from seed. With
+    no randomness every seed cuts the same edit, so only one is cut for it. The session is loaded, aligned and
+    scored once and every variant is cut from that, keeping the footage it uses to itself. Writes variant_NN.edl
+    for each and a summary.json comparing them to outputDir.
+    :return: the summary.
+    """
+    import numpy
+    from moodlib.stats import RunStats
+
+    stats = stats or RunStats()
+    beats, scenes, clips, eeg, emotions = loadSession(beatCachePath, clipDescriptionPath, musePath, affdexPath,
+                                                      cacheDir=cacheDir, analysisParams=analysisParams, stats=stats,
+                                                      rawEeg=rawEeg, workers=workers)
+    with stats.stage('prepare'):
+        inputs = CutInputs(scenes, clips, eeg, emotions, beats, stats=stats, keepScores=VARIANT_KEEP_SCORES)
+    if not os.path.isdir(outputDir):
+        os.makedirs(outputDir)
+
+    settings = []
+    for amount in randomness:
+        if not amount and count > 1:
+            LOG.info('Cutting one variant rather than %d with no randomness, they would all be the same', count)
+        settings.extend((seed + i, amount) for i in range(count if amount else 1))
+    variants = []
+    firstClips = None
+    for index, (variantSeed, amount) in enumerate(settings):
+        outputPath = os.path.join(outputDir, 'variant_%02d.edl' % index)
+        with stats.stage('variants'):
+            with openEdl(outputPath) as edlFile:
+                beatClips = cutEdit(inputs, edlFile, seed=variantSeed, randomness=amount, stats=stats,
+                                    planner=planner, beam=beam, markClips=False)
+
+        # How well each beat's clip matches the beat's own section, and how much of the edit the first shares.
+        # A beat the planner had to give to a clip from outside its scene has no score and is left out.
+        positions = inputs.timeline.clipPositions
+        scores = [inputs.beatScores.candidates(i, x) for i, x in enumerate(beatClips.tolist())
+                  if positions[inputs.beatScenes[i]][x] >= 0]
+        if firstClips is None:
+            firstClips = beatClips
+        variants.append({
+            'path': outputPath,
+            'seed': variantSeed,
+            'randomness': amount,
+            'cuts': edlFile.eventCount,
+            'clips_used': len(numpy.unique(beatClips)),
+            'mean_score': float(numpy.mean(scores)) if scores else 0.,
+            'same_as_first': float(numpy.mean(beatClips == firstClips)) if len(beatClips) else 1.,
+        })
+        LOG.info('%s: seed %d, randomness %g, %d cuts', outputPath, variantSeed, amount, edlFile.eventCount)
+
+    summary = {
+        'planner': planner,
+        'beats': len(inputs.beats),
+        'variants': variants,
+        'best': max(range(len(variants)), key=lambda i: variants[i]['mean_score']) if variants else None,
+    }
+    with open(os.path.join(outputDir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2, sort_keys=True)
+    return summary
+
+def edlTimecodes(edl, frames):
+    from edllib import TimeCodeArray
+
+    return TimeCodeArray(frames, frameRate=edl.frameRate, dropFrame=edl.dropFrame).toStrings()
+
+def edlClipNames(edl, events):
+    """
+    :return: the clip name of each event, - for no event or an event without a clip.
+    """
+    import numpy
+
+    names = edl.clipNames.tolist()
+    return [names[x] if x >= 0 else '-' for x in numpy.append(edl.clipIds, -1)[events].tolist()]
+
+def showEdlAt(edlPath, timecodes):
+    """
+    Prints the event and clip on the record timeline at each timecode, and the source timecode it is showing.
+    """
+    import numpy
+    from edllib import EDLIndex, TimeCodeArray
+
+    edl = EDLIndex.read(edlPath, frameRate=FRAME_RATE)
+    frames = TimeCodeArray.fromStrings(timecodes, frameRate=FRAME_RATE, dropFrame=edl.dropFrame).frames
+    events = edl.eventsAt(frames)
+    found = numpy.flatnonzero(events >= 0)
+    sources = edlTimecodes(edl, edl.sourceIns[events[found]] + frames[found] - edl.recordIns[events[found]])
+    names = edlClipNames(edl, events[found])
+    rows = dict((i, (edl.eventNumbers[events[i]], name, source)) for i, name, source in zip(found, names, sources))
+    for i, timecode in enumerate(timecodes):
+        if i in rows:
+            print '%s  %03d  %s  %s' % ((timecode,) + rows[i])
+        else:
+            print '%s  no event' % timecode
+
+def showEdlDiff(edlPath, otherPath):
+    """
+    Prints each stretch of the record timeline where two EDLs show something different.
+    """
+    from edllib import EDLIndex
+
+    edl = EDLIndex.read(edlPath, frameRate=FRAME_RATE)
+    other = EDLIndex.read(otherPath, frameRate=FRAME_RATE)
+    starts, ends, events, otherEvents = edl.diff(other)
+    names = edlClipNames(edl, events)
+    otherNames = edlClipNames(other, otherEvents)
+    for row in zip(edlTimecodes(edl, starts), edlTimecodes(edl, ends), names, otherNames):
+        print '%s %s  %s -> %s' % row
+    length = max(edl.recordOuts.max() if len(edl) else 0, other.recordOuts.max() if len(other) else 0)
+    print '%d stretches, %d of %d frames differ' % (len(starts), (ends - starts).sum(), length)
+
+def showEdlUsage(edlPath):
+    """
+    Prints how much of each clip an EDL uses, the clips on screen longest first.
+    """
+    import numpy
+    from edllib import EDLIndex
+
+    edl = EDLIndex.read(edlPath, frameRate=FRAME_RATE)
+    usage = edl.clipUsage()
+    order = numpy.argsort(-usage['recordFrames'], kind='mergesort')
+    firsts = edlTimecodes(edl, usage['sourceFirsts'][order])
+    lasts = edlTimecodes(edl, usage['sourceLasts'][order])
+    for i, clipIndex in enumerate(order.tolist()):
+        print '%s  %4d events  %8.1fs on screen  %8.1fs of footage  %s - %s' % (
+            edl.clipNames[clipIndex], usage['events'][clipIndex], usage['recordFrames'][clipIndex] / float(FRAME_RATE),
+            usage['sourceFrames'][clipIndex] / float(FRAME_RATE), firsts[i], lasts[i])
+    print '%d events, %d clips' % (len(edl), len(edl.clipNames))
+
+def liveEdl(beatCachePath, clipDescriptionPath, outputPath, sources, seed=None, speed=1.0, grace=0.25,
+            printJson=False, cacheDir=None, analysisParams=None):
+    """
+    Cuts an edit as the viewer's data arrives from the given live sources.
+    :return: the session's metrics summary.
+    """
+    from edllib import EDLWriter
+    from moodlib.live import LiveSession, SessionClock, EdlSink, JsonSink
+
+    beats = loadBeats(beatCachePath, cacheDir=cacheDir, analysisParams=analysisParams)
+    scenes, clips = loadClips(clipDescriptionPath)
+    session = LiveSession(scenes, clips, beats, frameRate=FRAME_RATE, seed=seed, grace=grace,
+                          clock=SessionClock(speed))
+    for source in sources:
+        session.addSource(source)
+
+    with EDLWriter.open(outputPath, edlTitle(outputPath)) as edlFile:
+        sinks = [EdlSink(edlFile)]
+        if printJson:
+            sinks.append(JsonSink(sys.stdout))
+        return session.run(sinks)
+
+def readBatchManifest(manifestPath):
+    """
+    Reads a csv of sessions with eeg, emotion and output columns, and optionally a seed column. Relative paths are
+    taken from the manifest's directory.
+    :return: a list of (eeg path, emotion path, output path, seed).
+    """
+    root = os.path.dirname(os.path.abspath(manifestPath))
+    sessions = []
+    with open(manifestPath, 'rb') as f:
+        for row in csv.DictReader(f):
+            row = dict((k.strip(), v.strip()) for k, v in row.items() if k)
+            paths = [os.path.join(root, row[x]) for x in ('eeg', 'emotion', 'output')]
+            seed = int(row['seed']) if row.get('seed') else None
+            sessions.append(tuple(paths) + (seed,))
+    return sessions
+
+# What every batch worker shares: the beats, scenes and clips. Set once per worker process.
+_batchShared = None
+
+def _initBatchWorker(beats, scenes, clips):
+    global _batchShared
+    _batchShared = (beats, scenes, clips)
+
+def _runBatchSession(session):
+    from moodlib import readEegData, readEmotionData, EMOTION_METRICS
+
+    eegPath, emotionPath, outputPath, seed = session
+    beats, scenes, clips = _batchShared
+    started = time.time()
+    try:
+        # Using a clip changes it, so every session starts from its own copy.
+        sessionClips = copy.deepcopy(clips)
+        eeg = readEegData(eegPath)
+        emotions = readEmotionData(emotionPath, EMOTION_METRICS)
+        cuts = writeEdl(outputPath, scenes, sessionClips, eeg, emotions, beats, seed=seed)
+    except Exception as e:
+        return outputPath, None, time.time() - started, '%s: %s' % (e.__class__.__name__, e)
+    return outputPath, cuts, time.time() - started, None
 
-    createCuts(scenes=clipDescriptionBlob['scenes'], clips=clips, eeg=eeg, emotions=emotions, beats=beats, edl=edlFile)
+def batchGenerate(beatCachePath, clipDescriptionPath, manifestPath, workers=None, seed=None, cacheDir=None,
+                  analysisParams=None):
+    """
+    Generates an EDL for every session in a manifest against the same song and footage. The beats and clips are
+    loaded once and the sessions are shared out over a pool of processes.
+    :return: the sessions that failed.
+    """
+    beats = loadBeats(beatCachePath, cacheDir=cacheDir, analysisParams=analysisParams)
+    scenes, clips = loadClips(clipDescriptionPath)
+    sessions = readBatchManifest(manifestPath)
+    # Sessions without their own seed get one from the batch seed so the whole batch can be reproduced.
+    sessions = [x if x[3] is not None or seed is None else x[:3] + (seed + i,) for i, x in enumerate(sessions)]
+
+    workers = workers or multiprocessing.cpu_count()
+    LOG.info('Generating %d sessions on %d workers', len(sessions), workers)
+    started = time.time()
+    failures = []
+    pool = multiprocessing.Pool(workers, initializer=_initBatchWorker, initargs=(beats, scenes, clips))
+    try:
+        for outputPath, cuts, seconds, error in pool.imap_unordered(_runBatchSession, sessions):
+            if error is not None:
+                LOG.error('%s failed after %.1fs: %s', outputPath, seconds, error)
+                failures.append((outputPath, error))
+            else:
+                LOG.info('%s: %d cuts in %.1fs', outputPath, cuts, seconds)
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+    elapsed = time.time() - started
+    LOG.info('%d sessions in %.1fs (%.2f sessions/s), %d failed', len(sessions), elapsed,
+             len(sessions) / elapsed if elapsed else 0, len(failures))
+    return failures
+
+class CutInputs(object):
+    """
+    Everything an edit is cut from that doesn't depend on the choices made while cutting: the beats and their
+    scenes, the signals aligned onto one grid, each beat's section averages and the scores of every scene's clips
+    against them, and the footage the clips start with. It is worked out once and shared by every variant cut from
+    the same session.
+    """
+    def __init__(self, scenes, clips, eeg, emotions, beats, stats=None, keepScores=0):
+        """
+        :param scenes: A list of dicts representing the allowed clips for a duration
+        :param clips: a list of Clip objects
+        :param eeg: (seconds, mellow, concentration) arrays, seconds being each sample's time from the first.
+        :param emotions: (seconds, dict of emotion -> array), likewise.
+        :param beats: a list of floating point seconds for each beat time
+        :param stats: a RunStats to time the alignment in.
+        :param keepScores: how many beat scores to keep for the next edit cut from these inputs, see BeatScores.
+        """
+        import numpy
+        from edllib import TimeCodeArray
+        from moodlib import AlignedSignals, SceneTimeline, ClipScorer, BeatScores, FootageIndex, CutDecider
+        from moodlib.stats import RunStats
 
-    with open(outputPath, 'wb') as f:
-        edlFile.write(f)
+        super(CutInputs, self).__init__()
+        stats = stats or RunStats()
+        self.clips = clips
 
-def createCuts(scenes, clips, eeg, emotions, beats, edl):
+        seconds, mellow, concentration = eeg
+        emotionTime, emotionData = emotions
+        streams = {
+            'mellow': (seconds, mellow),
+            'concentrate': (seconds, concentration),
+        }
+        for emotion, values in emotionData.items():
+            streams[emotion] = (emotionTime, values)
+
+        # The section for each beat runs from the previous beat's second through its own.
+        self.beats = numpy.asarray(beats, dtype=numpy.float64)
+        self.beatFrames = TimeCodeArray.fromSeconds(self.beats, frameRate=FRAME_RATE).frames
+        self.beatLasts = numpy.floor(self.beats + 0.5).astype(numpy.int64)
+        self.beatFirsts = numpy.concatenate([[0], self.beatLasts[:-1]])
+
+        # Resample every signal from its own timestamps onto one grid, whatever rate each device ran at, then keep
+        # running sums over the grid so a beat section average is a slice that doesn't depend on its length. Work
+        # the averages out for all of them at once, they only need redoing for sections that are stretched over
+        # beats without a cut.
+        with stats.stage('align'):
+            aligned = AlignedSignals.fixed(streams, self.beatLasts[-1] + 1 if len(self.beatLasts) else 0)
+            self.signals = aligned.indexes()
+        for name in sorted(self.signals):
+            if aligned.coverage(name) < 0.5:
+                LOG.warning('Only %d%% of the song has %s readings', 100 * aligned.coverage(name), name)
+        self.beatAverages = dict((name, index.mean(self.beatFirsts, self.beatLasts + 1))
+                                 for name, index in self.signals.items())
+
+        self.timeline = SceneTimeline(scenes, clips, frameRate=FRAME_RATE)
+        self.beatScenes = self.timeline.sceneIndices(self.beats)
+
+        # Variants take their own randomness from this scorer, see ClipScorer.variant.
+        self.scorer = ClipScorer(clips)
+        self.targets = self.scorer.targets(self.beatAverages)
+        self.beatScores = BeatScores(self.scorer, self.timeline, self.beatScenes, self.targets,
+                                     keepScores=keepScores)
+        self.footage = FootageIndex(clips, self.timeline.sceneClips, slateFrames=CutDecider.SLATE_FRAMES)
+
+    def fingerprints(self):
+        """
+        :return: a crc per beat of the inputs its decision depends on, see beatFingerprints.
+        """
+        from moodlib.checkpoint import sceneFingerprints, beatFingerprints
+
+        sceneCrcs = sceneFingerprints(self.timeline, self.clips, self.scorer.features)
+        return beatFingerprints(self.beatFrames, self.beatFirsts, self.beatLasts, self.beatScenes, sceneCrcs,
+                                self.signals)
+
+def createCuts(scenes, clips, eeg, emotions, beats, edl, seed=None, stats=None, planner='greedy', beam=None,
+               checkpointPath=None):
     """
 
     :param scenes: A list of dicts representing the allowed clips for a duration
     :param clips: a list of Clip objects
-    :param eeg: a list of dicts for each eeg frame.
-    :param emotions: a list of dicts for each emotion frame.
+    :param eeg: (seconds, mellow, concentration) arrays, seconds being each sample's time from the first.
+    :param emotions: (seconds, dict of emotion -> array), likewise.
     :param beats: a list of floating point seconds for each beat time
-    :param edl: the EDL object to write cuts to.
-    :return:
+    :param edl: the EDL or EDLWriter to add cuts to.
+    :param seed: seeds the randomness in choosing clips so a run can be reproduced.
+    :param stats: a RunStats to add the cut loop's counters to.
+    :param planner: greedy to choose each beat in turn, or viterbi to plan the whole song at once.
+    :param beam: how many states the viterbi planner carries between beats, None for all of them.
+    :param checkpointPath: see cutEdit.
+    :return: the clip index playing on each beat.
+    """
+    from moodlib.stats import RunStats
+
+    stats = stats or RunStats()
+    inputs = CutInputs(scenes, clips, eeg, emotions, beats, stats=stats)
+    return cutEdit(inputs, edl, seed=seed, stats=stats, planner=planner, beam=beam, checkpointPath=checkpointPath)
+
+def cutEdit(inputs, edl, seed=None, randomness=1.0, stats=None, planner='greedy', beam=None, markClips=True,
+            checkpointPath=None):
     """
+    Cuts one edit from prepared inputs.
+    :param inputs: the CutInputs to cut from.
+    :param edl: the EDL or EDLWriter to add cuts to.
+    :param seed: seeds the randomness in choosing clips so a run can be reproduced.
+    :param randomness: how much each clip's score is jittered, see ClipScorer.
+    :param stats: a RunStats to add the cut loop's counters to.
+    :param planner: greedy to choose each beat in turn, or viterbi to plan the whole song at once.
+    :param beam: how many states the viterbi planner carries between beats, None for all of them.
+    :param markClips: whether to set lastUsedEnd on the clips used, leave it off when the inputs are shared.
+    :param checkpointPath: where the greedy planner keeps its state after every beat. When a checkpoint from an
+        earlier run is there, the beats up to the first one whose inputs have changed are taken from it rather than
+        cut again. Without a seed the earlier run's seed is used.
+    :return: the clip index playing on each beat.
+    """
+    import numpy
+    from edllib import TimeCode
+    from moodlib import CutDecider, CutPlanner
+    from moodlib.stats import RunStats
+
+    stats = stats or RunStats()
+    clips = inputs.clips
+    beats = inputs.beats
+    beatFrames = inputs.beatFrames
+    beatScenes = inputs.beatScenes
 
-    seconds, mellow, concentration = eeg
-    emotionTime, emotionData = emotions
-    emotionSampleRate = 14  # samples per second
+    checkpoint = None
+    if checkpointPath is not None:
+        from moodlib.checkpoint import CutCheckpoint, CheckpointRecorder, CHECKPOINT_VERSION
 
-    slateFrames = 20
-    firstTime = 0
-    lastClip = None
-    lastCut = 1
+        if planner != 'greedy':
+            raise ValueError('Only the greedy planner can pick up from a checkpoint')
+        checkpoint = CutCheckpoint.load(checkpointPath)
+        if seed is None:
+            seed = checkpoint.seed if checkpoint is not None else random.randint(0, 2 ** 31 - 1)
+    scorer = inputs.scorer.variant(seed=seed, randomness=randomness)
 
-    sameClipBeatLimit = 20
-    sameClipBeatCounter = 0
+    if planner == 'viterbi':
+        cutPlanner = CutPlanner(clips, inputs.timeline, scorer, frameRate=FRAME_RATE, beam=beam,
+                                footage=inputs.footage, markClips=markClips)
+        plan = cutPlanner.plan(beatFrames, beatScenes, inputs.targets, beatScores=inputs.beatScores)
+        cuts = cutPlanner.cuts(beatFrames, beatScenes, inputs.targets, plan)
+        for cut in cuts:
+            LOG.debug('cut! %s', cut.clip)
+            edl.addCut(cut.clip,
+                       clipStart=cut.clipStart,
+                       clipEnd=cut.clipEnd,
+                       timeLineStart=cut.timeLineStart,
+                       timeLineEnd=cut.timeLineEnd)
+        stats.count('beats', len(beats))
+        stats.count('cuts', len(cuts))
+        stats.count('planner_replans', cutPlanner.replans)
+        LOG.info('Planned %d cuts at a cost of %.1f, replanning %d times for clips that ran out of footage',
+                 len(cuts), cutPlanner.cost, cutPlanner.replans)
+        return cutPlanner.beatClips
+    if planner != 'greedy':
+        raise ValueError('Unknown planner %s' % planner)
 
-    for beatTime in beats:
+    decider = CutDecider(clips, inputs.timeline, scorer, frameRate=FRAME_RATE, footage=inputs.footage,
+                         markClips=markClips)
+    beatClips = numpy.empty(len(beats), dtype=numpy.int64)
+
+    recorder = None
+    startBeat = 0
+    if checkpointPath is not None:
+        key = '%d|%r|%r|%d|%d|%s|%s' % (CHECKPOINT_VERSION, seed, randomness, CutDecider.SLATE_FRAMES,
+                                        decider.sameClipBeatLimit, FRAME_RATE, ','.join(sorted(inputs.signals)))
+        fingerprints = inputs.fingerprints()
+        recorder = CheckpointRecorder(len(beats), clips)
+        if checkpoint is not None:
+            startBeat = checkpoint.resumeBeat(key, fingerprints)
+        if startBeat:
+            # Replay the earlier run's cuts to use up the same footage and put them back in the edit.
+            clipIds = dict((clip.name, i) for i, clip in enumerate(clips))
+            for cutBeat, clipIndex, clipStart, clipEnd, timeLineStart, timeLineEnd in \
+                    recorder.resume(checkpoint, startBeat, clipIds):
+                decider.footage.use(clipIndex, clipEnd)
+                clipEnd = TimeCode.fromFrame(clipEnd, frameRate=FRAME_RATE)
+                if markClips:
+                    clips[clipIndex].lastUsedEnd = clipEnd
+                edl.addCut(clips[clipIndex],
+                           clipStart=TimeCode.fromFrame(clipStart, frameRate=FRAME_RATE),
+                           clipEnd=clipEnd,
+                           timeLineStart=TimeCode.fromFrame(timeLineStart, frameRate=FRAME_RATE),
+                           timeLineEnd=TimeCode.fromFrame(timeLineEnd, frameRate=FRAME_RATE))
+            last = startBeat - 1
+            decider.restore(int(recorder.lastClips[last]), int(recorder.lastCuts[last]),
+                            int(recorder.sameClipBeatCounters[last]), int(recorder.sectionStarts[last]))
+            # The clip picked on a beat is the one playing after it.
+            beatClips[:startBeat] = recorder.lastClips[:startBeat]
+
+    for beatIndex in range(startBeat, len(beats)):
+        beatTime = beats[beatIndex]
+        if seed is not None:
+            scorer.seedBeat(seed, beatIndex)
         # Time in seconds.
         # Find the averages for this beat section.
-        first = firstTime
-        last = int(round(beatTime))
-
-        mellowSegment = mellow[first:last + 1]
-        # The amount of mellow for this beat section
-        mellowAvg = numpy.mean(mellowSegment)
-
-        concentrateSegment = concentration[first:last + 1]
-        # The amount of concentration for this beat section
-        concentrateAvg = numpy.mean(concentrateSegment)
-
-        # The averages of each emotion in this segment
-        emotionAverages = {}
-        for emotion in emotionData:
-            emotionSegment = emotion[first*emotionSampleRate:last*emotionSampleRate + emotionSampleRate]
-            emotionAvg = numpy.mean(emotionSegment)
-            # Separate valence from dictionary to use as separate metric control
-            if emotion != 'valence':
-                emotionAverages[emotion] = emotionAvg
-            else:
-                valenceAvg = emotionAvg
+        first = decider.sectionStart
+        last = int(inputs.beatLasts[beatIndex])
+
+        # The beat's own section was scored up front, only a stretched section needs its averages.
+        averages = sceneScores = None
+        if first == inputs.beatFirsts[beatIndex]:
+            sceneScores = inputs.beatScores.beat(beatIndex)
+        else:
+            averages = dict((name, index.mean(first, last + 1)) for name, index in inputs.signals.items())
+            stats.count('stretched_sections')
 
         # What clips are we choosing from in this beat segment?
-        chosenScene = None
-        sceneStartT = 0
-        for scene in scenes:
-            endTime = TimeCode.fromString(scene['end_time'], frameRate=FRAME_RATE).toSeconds()
-            if beatTime > sceneStartT and beatTime < endTime:
-                chosenScene = scene
-                break
-            sceneStartT = endTime
-
-        clipsByName = dict([(x.name, x) for x in clips])
-        clipSelection = [clipsByName[x] for x in chosenScene['clips']]
-
-        skipToNextBeat = False
-        while True:
-            clip = chooseClip(mellowAvg, concentrateAvg, emotionAverages, valenceAvg, clipSelection, lastClip, sameClipBeatCounter)
-            print clip, first, last
-            if clip == lastClip:
-                if sameClipBeatCounter > sameClipBeatLimit:
-                    clipSelection.remove(clip)
-                    continue
-                skipToNextBeat = True
-                break
-
-            beatFrame = beatTime * FRAME_RATE
-
-            if clip.lastUsedEnd is not None:
-                clipStart = clip.lastUsedEnd
-            else:
-                clipStart = TimeCode.fromFrame(clip.startTc.toFrames() + slateFrames, frameRate=FRAME_RATE)
-                print 'clipStart = ' + str(clipStart)
-            # Length in frames.
-            length = beatFrame - lastCut
-            clipEndFrame = clipStart.toFrames() + length
-            # Check if this is past the end of the clip. If it is we have to choose another one.
-            clipsActualEndFrame = clip.startTc.toFrames() + clip.duration
-            if clipEndFrame > clipsActualEndFrame:
-                # We must chose another one. There isn't enough clip here!
-                print 'clip isn\'t long enough!'
-                clipSelection.remove(clip)
-                if len(clipSelection) == 0:
-                    raise ValueError('Uh oh, no possible clips for this cut.')
-                continue
-
-            clipEnd = TimeCode.fromFrame(clipEndFrame, frameRate=FRAME_RATE)
-            clip.lastUsedEnd = clipEnd
-            break
-
-        if skipToNextBeat:
-            sameClipBeatCounter += 1
+        sceneIndex = beatScenes[beatIndex]
+        if sceneIndex < 0:
+            raise ValueError('There is no scene for the beat at %.2f seconds' % beatTime)
+
+        cut = decider.decide(beatFrames[beatIndex], sceneIndex, averages, sectionEnd=last, sceneScores=sceneScores)
+        beatClips[beatIndex] = decider.chosenIndex
+        LOG.debug('%s %s %s', clips[decider.chosenIndex], first, last)
+        if recorder is not None:
+            recorder.beat(beatIndex, decider)
+        if cut is None:
             continue
-        sameClipBeatCounter = 0
+        if recorder is not None:
+            recorder.cut(beatIndex, decider.lastClipIndex, cut)
+
+        LOG.debug('cut! %s', cut.clip)
+        edl.addCut(cut.clip,
+                 clipStart=cut.clipStart,
+                 clipEnd=cut.clipEnd,
+                 timeLineStart=cut.timeLineStart,
+                 timeLineEnd=cut.timeLineEnd)
+
+    stats.count('beats', len(beats))
+    stats.count('choose_clip_calls', decider.decisions)
+    stats.count('cuts', decider.cuts)
+    stats.count('same_clip_holds', decider.holds)
+    stats.count('hold_limit_hits', decider.holdLimitHits)
+    stats.count('short_clip_fallbacks', decider.footage.fallbacks)
+    stats.count('short_clips_removed', decider.footage.exhaustedClips)
+    LOG.info('%d cuts were chosen without clips that had run out of footage (%d clips left out in all)',
+             decider.footage.fallbacks, decider.footage.exhaustedClips)
+    if recorder is not None:
+        recorder.checkpoint(key, seed, fingerprints).save(checkpointPath)
+        stats.count('recomputed_beats', len(beats) - startBeat)
+        LOG.info('Picked up from beat %d of %d, %d beats recomputed', startBeat, len(beats), len(beats) - startBeat)
+    return beatClips
+
+class GenerateService(object):
+    """
+    What serve keeps warm between requests: beats, clip libraries, parsed sessions and the CutInputs cut from them,
+    all in one DatasetCache. Edits are cut with markClips off so the clips stay as they were loaded.
+    """
+    def __init__(self, maxBytes, cacheDir=None, analysisParams=None):
+        from moodlib.server import DatasetCache
+
+        super(GenerateService, self).__init__()
+        self.datasets = DatasetCache(maxBytes)
+        self.cacheDir = cacheDir
+        self.analysisParams = dict(analysisParams or {})
+        self.requests = 0
 
-        print 'cut!', clip
-        edl.addCut(clip,
-                 clipStart=clipStart,
-                 clipEnd=clipEnd,
-                 timeLineStart=TimeCode.fromFrame(lastCut, frameRate=FRAME_RATE),
-                 timeLineEnd=TimeCode.fromFrame(beatFrame, frameRate=FRAME_RATE))
-        lastCut = beatFrame
+    def generate(self, request):
+        """
+        :param request: a dict with beat_cache, muse_eeg_csv, emotion_file, clip_description and output_edl paths,
+            and optionally seed, planner, beam, checkpoint, raw_eeg, sr and block.
+        :return: how many cuts were written and the request's stats.
+        """
+        from moodlib import readEegData, readRawEegData, readEmotionData, EMOTION_METRICS
+        from moodlib.server import fileKey
+        from moodlib.stats import RunStats
 
-        firstTime = last
-        lastClip = clip
+        self.requests += 1
+        stats = RunStats()
+        paths = dict((x, request[x]) for x in ('beat_cache', 'muse_eeg_csv', 'emotion_file', 'clip_description'))
+        for name, path in paths.items():
+            if not os.path.exists(path):
+                raise ValueError('%s %s does not exist.' % (name, path))
+        analysisParams = dict(self.analysisParams)
+        analysisParams.update((x, request[x]) for x in ('sr', 'block') if request.get(x) is not None)
 
+        beatsKey = ('beats', fileKey(paths['beat_cache']), tuple(sorted(analysisParams.items())))
+        clipsKey = ('clips', fileKey(paths['clip_description']))
+        rawEeg = bool(request.get('raw_eeg'))
+        eegKey = ('eeg', fileKey(paths['muse_eeg_csv']), rawEeg)
+        emotionsKey = ('emotions', fileKey(paths['emotion_file']))
+        with stats.stage('load_beats'):
+            beats = self.datasets.get(beatsKey, lambda: loadBeats(paths['beat_cache'], cacheDir=self.cacheDir,
+                                                                  analysisParams=analysisParams))
+        with stats.stage('load_clips'):
+            scenes, clips = self.datasets.get(clipsKey, lambda: loadClips(paths['clip_description']))
+        with stats.stage('eeg_parse'):
+            eeg = self.datasets.get(eegKey, lambda: readRawEegData(paths['muse_eeg_csv']) if rawEeg
+                                    else readEegData(paths['muse_eeg_csv']))
+        with stats.stage('emotion_parse'):
+            emotions = self.datasets.get(emotionsKey,
+                                         lambda: readEmotionData(paths['emotion_file'], EMOTION_METRICS))
+        with stats.stage('prepare'):
+            inputs = self.datasets.get(('inputs', beatsKey, clipsKey, eegKey, emotionsKey),
+                                       lambda: CutInputs(scenes, clips, eeg, emotions, beats, stats=stats))
+
+        outputPath = request['output_edl']
+        with stats.stage('cut_loop'):
+            with openEdl(outputPath) as edlFile:
+                cutEdit(inputs, edlFile, seed=request.get('seed'), stats=stats,
+                        planner=request.get('planner') or 'greedy', beam=request.get('beam'), markClips=False,
+                        checkpointPath=request.get('checkpoint'))
+        LOG.info('%s: %d cuts in %.2fs', outputPath, edlFile.eventCount, stats.summary()['seconds'])
+        return {'output_edl': outputPath, 'cuts': edlFile.eventCount, 'stats': stats.summary()}
+
+    def summary(self, request=None):
+        return {'requests': self.requests, 'datasets': self.datasets.summary()}
+
+def requestServer(address, path, body=None):
+    """
+    Sends a request to a serve daemon and waits for its reply.
+    :param address: the daemon's Unix socket path, or http://host:port.
+    :param body: the json request, None for a GET.
+    :return: the reply.
+    """
+    try:
+        import httplib
+    except ImportError:
+        import http.client as httplib
+
+    if address.startswith('http://'):
+        connection = httplib.HTTPConnection(address[len('http://'):].rstrip('/'))
+    else:
+        connection = httplib.HTTPConnection('localhost')
+        connection.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.sock.connect(address)
+    try:
+        if body is None:
+            connection.request('GET', path)
+        else:
+            connection.request('POST', path, json.dumps(body), {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        reply = json.loads(response.read().decode('utf-8'))
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise ValueError('The server could not %s: %s' % (path, reply.get('error')))
+    return reply
 
 def main():
     arguments = docopt(__doc__)
     LOG.debug('Arguments:\n%s', pformat(arguments))
 
+    cacheDir = arguments['--cache-dir']
+    analysisParams = {
+        'sr': int(arguments['--sr']) if arguments['--sr'] else None,
+        'block': float(arguments['--block']) if arguments['--block'] else None,
+    }
+
+    if arguments['cache'] and arguments['ls']:
+        return listAudioCache(cacheDir)
+
+    if arguments['cache'] and arguments['prune']:
+        return pruneAudioCache(float(arguments['--max-size']), cacheDir)
+
     if arguments['cache']:
         audioPath = arguments['<audio_file>']
         if not os.path.exists(audioPath):
             raise ValueError('Audio file does not exist')
         cachePath = arguments['<output_beat_cache>']
-        return saveAudioCache(audioPath, cachePath)
+        return saveAudioCache(audioPath, cachePath, cacheDir=cacheDir, analysisParams=analysisParams)
 
     if arguments['generate']:
         beatCachePath = arguments['<beat_cache>']
@@ -336,29 +842,212 @@ def main():
         musePath = arguments['<muse_eeg_csv>']
         if not os.path.exists(musePath):
             raise ValueError('EEG Path does not exist.')
-        affdexPath = arguments['<emotion_csv>']
+        affdexPath = arguments['<emotion_file>']
         if not os.path.exists(affdexPath):
             raise ValueError('Emotion Path does not exist.')
         outputEdlPath = arguments['<output_edl>']
-        return generateEdl(beatCachePath=beatCachePath,
-                           clipDescriptionPath=clipDescriptionPath,
-                           musePath=musePath,
-                           affdexPath=affdexPath,
-                           outputPath=outputEdlPath)
+        seed = arguments['--seed']
+        if arguments['--server']:
+            reply = requestServer(arguments['--server'], '/generate', {
+                'beat_cache': os.path.abspath(beatCachePath),
+                'muse_eeg_csv': os.path.abspath(musePath),
+                'emotion_file': os.path.abspath(affdexPath),
+                'clip_description': os.path.abspath(clipDescriptionPath),
+                'output_edl': os.path.abspath(outputEdlPath),
+                'seed': int(seed) if seed is not None else None,
+                'planner': arguments['--planner'],
+                'beam': int(arguments['--beam']) if arguments['--beam'] else None,
+                'checkpoint': os.path.abspath(arguments['--checkpoint']) if arguments['--checkpoint'] else None,
+                'raw_eeg': arguments['--raw-eeg'],
+                'sr': analysisParams['sr'],
+                'block': analysisParams['block'],
+            })
+            LOG.info('%s: %d cuts', reply['output_edl'], reply['cuts'])
+            if arguments['--profile']:
+                LOG.info('Run stats:\n%s', pformat(reply['stats']))
+            if arguments['--stats']:
+                with open(arguments['--stats'], 'w') as f:
+                    json.dump(reply['stats'], f, indent=4)
+            return
+        stats = generateEdl(beatCachePath=beatCachePath,
+                            clipDescriptionPath=clipDescriptionPath,
+                            musePath=musePath,
+                            affdexPath=affdexPath,
+                            outputPath=outputEdlPath,
+                            seed=int(seed) if seed is not None else None,
+                            cacheDir=cacheDir,
+                            analysisParams=analysisParams,
+                            planner=arguments['--planner'],
+                            beam=int(arguments['--beam']) if arguments['--beam'] else None,
+                            checkpointPath=arguments['--checkpoint'],
+                            rawEeg=arguments['--raw-eeg'],
+                            workers=int(arguments['--workers']) if arguments['--workers'] else None)
+        if arguments['--profile']:
+            LOG.info('Run stats:\n%s', stats.describe())
+        if arguments['--stats']:
+            stats.save(arguments['--stats'])
+        return
+
+    if arguments['variants']:
+        for name in ('<beat_cache>', '<muse_eeg_csv>', '<emotion_file>', '<clip_description>'):
+            if not os.path.exists(arguments[name]):
+                raise ValueError('%s %s does not exist.' % (name, arguments[name]))
+        seed = arguments['--seed']
+        from moodlib.stats import RunStats
+
+        stats = RunStats()
+        summary = generateVariants(beatCachePath=arguments['<beat_cache>'],
+                                   clipDescriptionPath=arguments['<clip_description>'],
+                                   musePath=arguments['<muse_eeg_csv>'],
+                                   affdexPath=arguments['<emotion_file>'],
+                                   outputDir=arguments['<output_dir>'],
+                                   count=int(arguments['--count']),
+                                   seed=int(seed) if seed is not None else 0,
+                                   randomness=[float(x) for x in arguments['--randomness'].split(',')],
+                                   cacheDir=cacheDir,
+                                   analysisParams=analysisParams,
+                                   stats=stats,
+                                   planner=arguments['--planner'],
+                                   beam=int(arguments['--beam']) if arguments['--beam'] else None,
+                                   rawEeg=arguments['--raw-eeg'],
+                                   workers=int(arguments['--workers']) if arguments['--workers'] else None)
+        LOG.info('Variant %s matches the viewer best', summary['best'])
+        if arguments['--profile']:
+            LOG.info('Run stats:\n%s', stats.describe())
+        if arguments['--stats']:
+            stats.save(arguments['--stats'])
+        return
+
+    if arguments['batch']:
+        beatCachePath = arguments['<beat_cache>']
+        if not os.path.exists(beatCachePath):
+            raise ValueError('Beat cache file does not exist')
+        clipDescriptionPath = arguments['<clip_description>']
+        if not os.path.exists(clipDescriptionPath):
+            raise ValueError('Clip description does not exist.')
+        manifestPath = arguments['<manifest>']
+        if not os.path.exists(manifestPath):
+            raise ValueError('Manifest does not exist.')
+        seed = arguments['--seed']
+        failures = batchGenerate(beatCachePath=beatCachePath,
+                                 clipDescriptionPath=clipDescriptionPath,
+                                 manifestPath=manifestPath,
+                                 workers=int(arguments['--workers']) if arguments['--workers'] else None,
+                                 seed=int(seed) if seed is not None else None,
+                                 cacheDir=cacheDir,
+                                 analysisParams=analysisParams)
+        if failures:
+            raise SystemExit(1)
+        return
+
+    if arguments['live']:
+        from moodlib.live import UdpSource, TailSource, ReplaySource
+
+        beatCachePath = arguments['<beat_cache>']
+        if not os.path.exists(beatCachePath):
+            raise ValueError('Beat cache file does not exist')
+        clipDescriptionPath = arguments['<clip_description>']
+        if not os.path.exists(clipDescriptionPath):
+            raise ValueError('Clip description does not exist.')
+        sources = []
+        if arguments['--udp']:
+            sources.append(UdpSource(int(arguments['--udp'])))
+        if arguments['--tail-eeg']:
+            sources.append(TailSource(arguments['--tail-eeg'], 'eeg'))
+        if arguments['--tail-emotion']:
+            sources.append(TailSource(arguments['--tail-emotion'], 'emotion'))
+        if arguments['--replay-eeg'] or arguments['--replay-emotion']:
+            for path in (arguments['--replay-eeg'], arguments['--replay-emotion']):
+                if path and not os.path.exists(path):
+                    raise ValueError('Replay file %s does not exist.' % path)
+            sources.append(ReplaySource(arguments['--replay-eeg'], arguments['--replay-emotion']))
+        if not sources:
+            raise ValueError('Live mode needs at least one of --udp, --tail-eeg, --tail-emotion or a replay.')
+        seed = arguments['--seed']
+        summary = liveEdl(beatCachePath=beatCachePath,
+                          clipDescriptionPath=clipDescriptionPath,
+                          outputPath=arguments['<output_edl>'],
+                          sources=sources,
+                          seed=int(seed) if seed is not None else None,
+                          speed=float(arguments['--speed']),
+                          grace=float(arguments['--grace']),
+                          printJson=arguments['--json'],
+                          cacheDir=cacheDir,
+                          analysisParams=analysisParams)
+        LOG.debug('Live metrics:\n%s', pformat(summary))
+        return
+
+    if arguments['serve']:
+        from moodlib.server import RequestServer
+
+        service = GenerateService(int(float(arguments['--max-memory']) * 1024 * 1024), cacheDir=cacheDir,
+                                  analysisParams=analysisParams)
+        server = RequestServer({('POST', '/generate'): service.generate, ('GET', '/stats'): service.summary},
+                               socketPath=arguments['--socket'],
+                               port=int(arguments['--port']) if arguments['--port'] else None)
+        LOG.info('Serving on %s', server.address)
+        return server.serveForever()
+
+    if arguments['scan']:
+        from moodlib.scanner import FootageScanner, updateDescription
+
+        footageDirs = arguments['<footage_dir>']
+        for footageDir in footageDirs:
+            if not os.path.isdir(footageDir):
+                raise ValueError('Footage directory %s does not exist.' % footageDir)
+        descriptionPath = arguments['<clip_description>']
+        scanner = FootageScanner(arguments['--index'] or descriptionPath + '.scan.json',
+                                 workers=int(arguments['--workers']) if arguments['--workers'] else None,
+                                 ffprobe=arguments['--ffprobe'])
+        files, failed = scanner.scan(footageDirs)
+        description = updateDescription(descriptionPath, files, failed=failed)
+        LOG.info('Wrote %d clips to %s', len(description['clips']), descriptionPath)
+        return
+
+    if arguments['edl']:
+        edlPath = arguments['<edl>']
+        for path in (edlPath, arguments['<other_edl>']):
+            if path is not None and not os.path.exists(path):
+                raise ValueError('EDL %s does not exist.' % path)
+        if arguments['at']:
+            return showEdlAt(edlPath, arguments['<timecode>'])
+        if arguments['diff']:
+            return showEdlDiff(edlPath, arguments['<other_edl>'])
+        return showEdlUsage(edlPath)
 
     if arguments['graph']:
-        from matplotlib import pyplot as plt
+        from moodlib import readEegData, readEmotionData, EMOTION_METRICS, SceneTimeline
+        from moodlib.plotting import renderGraph, readCutTimes
 
         musePath = arguments['<muse_eeg_csv>']
         if not os.path.exists(musePath):
             raise ValueError('Muse does not exist.')
-        seconds, mellow, concentration = readEegData(musePath)
-        plt.plot(seconds, mellow, 'y', label='Mellow')
-        plt.plot(seconds, concentration, 'b', label='Concentration')
-        plt.legend()
-        plt.xlabel('Seconds')
-        plt.ylabel('Amount')
-        plt.show()
+        for option in ('--emotions', '--beats', '--clips', '--edl'):
+            if arguments[option] and not os.path.exists(arguments[option]):
+                raise ValueError('%s %s does not exist.' % (option, arguments[option]))
+        emotions = None
+        if arguments['--emotions']:
+            emotions = readEmotionData(arguments['--emotions'], EMOTION_METRICS)
+        beats = None
+        if arguments['--beats']:
+            beats = loadBeats(arguments['--beats'], cacheDir=cacheDir, analysisParams=analysisParams)
+        scenes = None
+        if arguments['--clips']:
+            sceneDicts, clips = loadClips(arguments['--clips'])
+            timeline = SceneTimeline(sceneDicts, clips, frameRate=FRAME_RATE)
+            scenes = (timeline.ends, [x.get('label', '') for x in sceneDicts])
+        cuts = None
+        if arguments['--edl']:
+            cuts = readCutTimes(arguments['--edl'], frameRate=FRAME_RATE)
+        return renderGraph(readEegData(musePath),
+                           outputPath=arguments['--output'],
+                           emotions=emotions,
+                           beats=beats,
+                           scenes=scenes,
+                           cuts=cuts,
+                           width=int(arguments['--width']),
+                           height=int(arguments['--height']),
+                           method=arguments['--decimate'])
 
 if __name__ == '__main__':
     main()
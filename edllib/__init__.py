@@ -1,3 +1,3 @@
 __author__ = 'bjarrett'
 
-from edl import Clip, TimeCode, EDL
+from edl import Clip, TimeCode, TimeCodeArray, EDL, EDLWriter, EDLIndex
@@ -1,57 +1,218 @@
 __author__ = 'bjarrett'
 
+import functools
+import gzip
+import math
+import numbers
+import numpy
+import re
+from fractions import Fraction
 
 NEW_LINE = '\n'
 
+# The NTSC family of rates, matched exactly when a float approximation like 24/1.001 is given.
+NTSC_RATES = (Fraction(24000, 1001), Fraction(30000, 1001), Fraction(48000, 1001), Fraction(60000, 1001))
+
+
+def exactRate(frameRate):
+    """
+    :return: frameRate as a Fraction, e.g. 24000/1001 for 23.976.
+    """
+    if isinstance(frameRate, Fraction):
+        return frameRate
+    if isinstance(frameRate, numbers.Integral):
+        return Fraction(int(frameRate))
+    for rate in NTSC_RATES:
+        if abs(float(rate) - frameRate) < 1e-3:
+            return rate
+    return Fraction(frameRate).limit_denominator(1001)
+
+
+def _roundFrame(frame):
+    # Half up, the same on python 2 and 3.
+    return int(math.floor(frame + 0.5))
+
+
+def _dropFrames(rate):
+    """
+    :return: how many frame numbers are dropped each minute for a drop frame rate.
+    """
+    if rate not in (Fraction(30000, 1001), Fraction(60000, 1001)):
+        raise ValueError('Drop frame is only defined for 29.97 and 59.94, not %s' % float(rate))
+    return 2 if rate == Fraction(30000, 1001) else 4
+
+
+def _frameToFields(frame, rate, dropFrame):
+    """
+    Splits frame counts into hours, minutes, seconds and frames. Works on ints and numpy arrays alike.
+    """
+    base = int(round(rate))
+    if dropFrame:
+        drop = _dropFrames(rate)
+        framesPerMinute = base * 60 - drop
+        framesPerTenMinutes = framesPerMinute * 10 + drop
+        tens = frame // framesPerTenMinutes
+        rest = frame % framesPerTenMinutes
+        # The first minute of every ten keeps all of its frame numbers.
+        skipped = drop * ((rest - drop) // framesPerMinute)
+        frame = frame + 9 * drop * tens + (rest > drop) * skipped
+    frames = frame % base
+    seconds = (frame // base) % 60
+    minutes = (frame // (base * 60)) % 60
+    hours = (frame // (base * 60 ** 2)) % 24
+    return hours, minutes, seconds, frames
+
+
+def _fieldsToFrame(hours, minutes, seconds, frames, rate, dropFrame):
+    base = int(round(rate))
+    frame = ((hours * 60 + minutes) * 60 + seconds) * base + frames
+    if dropFrame:
+        totalMinutes = hours * 60 + minutes
+        frame -= _dropFrames(rate) * (totalMinutes - totalMinutes // 10)
+    return frame
+
+
+@functools.total_ordering
 class TimeCode(object):
+    """
+    A position on a timeline, held as a whole number of frames at an exact frame rate.
+    """
     DEFAULT_FRAME_RATE = 24
 
-    def __init__(self, hours, minutes, seconds, frames, frameRate=DEFAULT_FRAME_RATE):
+    __slots__ = ('_frame', 'frameRate', 'dropFrame')
+
+    def __init__(self, hours, minutes, seconds, frames, frameRate=DEFAULT_FRAME_RATE, dropFrame=False):
         super(TimeCode, self).__init__()
-        self.hours = hours
-        self.minutes = minutes
-        self.seconds = seconds
-        self.frames = frames
-        self.frameRate = frameRate
+        self.frameRate = exactRate(frameRate)
+        self.dropFrame = dropFrame
+        self._frame = _fieldsToFrame(int(hours), int(minutes), int(seconds), int(frames), self.frameRate, dropFrame)
 
     @classmethod
-    def fromFrame(cls, frame, frameRate=DEFAULT_FRAME_RATE):
-        frames = frame % frameRate
-        seconds = (frame / frameRate) % 60
-        minutes = (frame / frameRate / 60) % 60
-        hours = (frame / frameRate / 60**2) % 60
-        return cls(hours, minutes, seconds, frames, frameRate)
+    def fromFrame(cls, frame, frameRate=DEFAULT_FRAME_RATE, dropFrame=False):
+        tc = cls.__new__(cls)
+        tc._frame = _roundFrame(frame)
+        tc.frameRate = exactRate(frameRate)
+        tc.dropFrame = dropFrame
+        return tc
 
     @classmethod
-    def fromString(cls, stringRep, frameRate=DEFAULT_FRAME_RATE):
-        hours, minutes, seconds, frames = [int(x) for x in stringRep.split(':')]
-        return cls(hours, minutes, seconds, frames, frameRate=frameRate)
+    def fromSeconds(cls, seconds, frameRate=DEFAULT_FRAME_RATE, dropFrame=False):
+        frameRate = exactRate(frameRate)
+        return cls.fromFrame(seconds * frameRate.numerator / float(frameRate.denominator), frameRate, dropFrame)
+
+    @classmethod
+    def fromString(cls, stringRep, frameRate=DEFAULT_FRAME_RATE, dropFrame=None):
+        """
+        Parses HH:MM:SS:FF, or HH:MM:SS;FF for drop frame.
+        """
+        if dropFrame is None:
+            dropFrame = ';' in stringRep
+        hours, minutes, seconds, frames = [int(x) for x in stringRep.replace(';', ':').split(':')]
+        return cls(hours, minutes, seconds, frames, frameRate=frameRate, dropFrame=dropFrame)
+
+    @property
+    def hours(self):
+        return _frameToFields(self._frame, self.frameRate, self.dropFrame)[0]
+
+    @property
+    def minutes(self):
+        return _frameToFields(self._frame, self.frameRate, self.dropFrame)[1]
+
+    @property
+    def seconds(self):
+        return _frameToFields(self._frame, self.frameRate, self.dropFrame)[2]
+
+    @property
+    def frames(self):
+        return _frameToFields(self._frame, self.frameRate, self.dropFrame)[3]
 
     def toSeconds(self):
-        frameSecs = self.frames * (1./self.frameRate)
-        secondSecs = self.seconds
-        minuteSecs = self.minutes * 60
-        hourSecs = self.hours * 60 ** 2
-        return frameSecs + secondSecs + minuteSecs + hourSecs
+        return self._frame * self.frameRate.denominator / float(self.frameRate.numerator)
 
     def toFrames(self):
-        frameFrames = self.frames
-        secondFrames = self.seconds * self.frameRate
-        minuteFrames = self.minutes * 60 * self.frameRate
-        hourFrames = self.hours * 60 ** 2 * self.frameRate
-        return frameFrames + secondFrames + minuteFrames + hourFrames
+        return self._frame
+
+    def __eq__(self, other):
+        if not isinstance(other, TimeCode):
+            return NotImplemented
+        return self._frame == other._frame and self.frameRate == other.frameRate
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __lt__(self, other):
+        if not isinstance(other, TimeCode):
+            return NotImplemented
+        return self.toSeconds() < other.toSeconds()
+
+    def __hash__(self):
+        return hash((self._frame, self.frameRate))
 
     def __str__(self):
-        return '%02d:%02d:%02d:%02d' % (
-            self.hours,
-            self.minutes,
-            self.seconds,
-            self.frames,
-        )
+        return ('%02d:%02d:%02d;%02d' if self.dropFrame else '%02d:%02d:%02d:%02d') % \
+            _frameToFields(self._frame, self.frameRate, self.dropFrame)
 
     def __repr__(self):
         return '<%s: %s>'% (self.__class__.__name__, str(self))
 
+
+class TimeCodeArray(object):
+    """
+    Many timecodes at one frame rate held as a single array of frame counts, for converting whole arrays of times
+    without building a TimeCode for each.
+    """
+    def __init__(self, frames, frameRate=TimeCode.DEFAULT_FRAME_RATE, dropFrame=False):
+        super(TimeCodeArray, self).__init__()
+        self.frames = numpy.asarray(frames, dtype=numpy.int64)
+        self.frameRate = exactRate(frameRate)
+        self.dropFrame = dropFrame
+        if dropFrame:
+            _dropFrames(self.frameRate)
+
+    @classmethod
+    def fromSeconds(cls, seconds, frameRate=TimeCode.DEFAULT_FRAME_RATE, dropFrame=False):
+        frameRate = exactRate(frameRate)
+        frames = numpy.asarray(seconds, dtype=numpy.float64) * frameRate.numerator / frameRate.denominator
+        return cls(numpy.floor(frames + 0.5), frameRate, dropFrame)
+
+    @classmethod
+    def fromStrings(cls, stringReps, frameRate=TimeCode.DEFAULT_FRAME_RATE, dropFrame=False):
+        fields = numpy.array([x.replace(';', ':').split(':') for x in stringReps], dtype=numpy.int64)
+        fields = fields.reshape(len(stringReps), 4)
+        frameRate = exactRate(frameRate)
+        return cls(_fieldsToFrame(fields[:, 0], fields[:, 1], fields[:, 2], fields[:, 3], frameRate, dropFrame),
+                   frameRate, dropFrame)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, index):
+        return TimeCode.fromFrame(self.frames[index], self.frameRate, self.dropFrame)
+
+    def toSeconds(self):
+        return self.frames * self.frameRate.denominator / float(self.frameRate.numerator)
+
+    def fields(self):
+        """
+        :return: arrays of hours, minutes, seconds and frames.
+        """
+        return _frameToFields(self.frames, self.frameRate, self.dropFrame)
+
+    def toStrings(self):
+        """
+        :return: an array of HH:MM:SS:FF strings, built digit by digit rather than formatted one at a time.
+        """
+        chars = numpy.empty((len(self.frames), 11), dtype=numpy.uint8)
+        for i, field in enumerate(self.fields()):
+            chars[:, i * 3] = ord('0') + field // 10 % 10
+            chars[:, i * 3 + 1] = ord('0') + field % 10
+        chars[:, 2::3] = ord(':')
+        if self.dropFrame:
+            chars[:, 8] = ord(';')
+        return chars.view('S11').ravel()
+
+
 class Clip(object):
     def __init__(self, name):
         super(Clip, self).__init__()
@@ -89,10 +250,11 @@ class Event(object):
         return NEW_LINE.join(lines) + NEW_LINE
 
 class EDL(object):
-    def __init__(self, title):
+    def __init__(self, title, dropFrame=False):
         super(EDL, self).__init__()
         self._events = []
         self.title = title
+        self.dropFrame = dropFrame
 
     def addCut(self, clip, clipStart, clipEnd, timeLineStart, timeLineEnd):
         event = Event('EdlReel', eventType='C')
@@ -113,7 +275,7 @@ class EDL(object):
         """
         f.write('TITLE: %s' % self.title)
         f.write(NEW_LINE)
-        f.write('FCM: NON-DROP FRAME')
+        f.write('FCM: DROP FRAME' if self.dropFrame else 'FCM: NON-DROP FRAME')
         f.write(NEW_LINE)
         f.write(NEW_LINE)
 
@@ -121,3 +283,299 @@ class EDL(object):
             f.write(event.serialize(i))
             f.write(NEW_LINE)
 
+
+class EDLWriter(object):
+    """
+    Writes an EDL out as cuts are added rather than holding every event until the end. Events are formatted into a
+    fixed size buffer that is flushed to the file whenever it fills, so memory stays the same however long the
+    timeline gets. Takes the same addCut calls as EDL.
+    """
+    BUFFER_SIZE = 1024 * 1024
+
+    CUT_FORMAT = '%03d    EdlReel    V C     %s %s %s %s' + NEW_LINE + '* FROM CLIP NAME: %s' + NEW_LINE + NEW_LINE
+
+    def __init__(self, f, title, dropFrame=False, bufferSize=BUFFER_SIZE):
+        """
+        :param f: a file opened for writing bytes.
+        :param title: the EDL title.
+        :param dropFrame: whether the timecodes are drop frame.
+        :param bufferSize: how many bytes are gathered before each write to f.
+        """
+        super(EDLWriter, self).__init__()
+        self.f = f
+        self.title = title
+        self.dropFrame = dropFrame
+        self.eventCount = 0
+        self._buffer = bytearray(bufferSize)
+        self._used = 0
+        self._ownsFile = False
+
+        self._append('TITLE: %s' % title + NEW_LINE)
+        self._append(('FCM: DROP FRAME' if dropFrame else 'FCM: NON-DROP FRAME') + NEW_LINE + NEW_LINE)
+        # Get the header out straight away.
+        self.flush()
+
+    @classmethod
+    def open(cls, path, title, dropFrame=False, bufferSize=BUFFER_SIZE):
+        """
+        Opens path for writing, gzipped if it ends in .gz. Closing the writer closes the file.
+        """
+        if path.endswith('.gz'):
+            f = gzip.open(path, 'wb')
+        else:
+            f = open(path, 'wb')
+        writer = cls(f, title, dropFrame=dropFrame, bufferSize=bufferSize)
+        writer._ownsFile = True
+        return writer
+
+    def _append(self, text):
+        if not isinstance(text, bytes):
+            text = text.encode('utf-8')
+        size = len(text)
+        if self._used + size > len(self._buffer):
+            self.flush()
+            if size > len(self._buffer):
+                self.f.write(text)
+                return
+        self._buffer[self._used:self._used + size] = text
+        self._used += size
+
+    def addCut(self, clip, clipStart, clipEnd, timeLineStart, timeLineEnd):
+        self._append(self.CUT_FORMAT % (self.eventCount, clipStart, clipEnd, timeLineStart, timeLineEnd, clip.name))
+        self.eventCount += 1
+
+    def flush(self):
+        if self._used:
+            self.f.write(bytes(self._buffer[:self._used]))
+            self._used = 0
+        self.f.flush()
+
+    def close(self):
+        self.flush()
+        if self._ownsFile:
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+# Roughly how many bytes of lines an EDL is read a block at a time in.
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+
+_TIMECODE = br'(\d\d:\d\d:\d\d[:;]\d\d)'
+_CLIP_NAME_NOTE = br'[ \t]*\*[ \t]*FROM CLIP NAME:'
+# An event line: the event number, reel, track, edit type and any transition length, then the source in and out and
+# record in and out. The first clip name note after it, before the next event, comes along with it.
+_EVENT = re.compile(br'^[ \t]*(\d+)[ \t]+\S+[ \t]+\S+[ \t]+\S+(?:[ \t]+\d+)?[ \t]+' +
+                    br'[ \t]+'.join([_TIMECODE] * 4) + br'[^\n]*' +
+                    br'(?:(?:\n(?![ \t]*\d+[ \t])(?!' + _CLIP_NAME_NOTE + br')[^\n]*)*\n' + _CLIP_NAME_NOTE +
+                    br'[ \t]*([^\r\n]*?)[ \t]*\r?$)?', re.MULTILINE)
+_EVENT_START = re.compile(br'[ \t]*\d+[ \t]')
+_TITLE = re.compile(br'^TITLE:[ \t]*([^\r\n]*?)[ \t]*\r?$', re.MULTILINE)
+_FCM = re.compile(br'^FCM:[ \t]*([^\r\n]*?)[ \t]*\r?$', re.MULTILINE)
+
+
+def _timecodeFrames(timecodes, frameRate, dropFrame):
+    """
+    Converts HH:MM:SS:FF byte strings to frames from their characters all at once.
+    """
+    if not timecodes:
+        return numpy.zeros(0, dtype=numpy.int64)
+    chars = numpy.frombuffer(b''.join(timecodes), dtype=numpy.uint8).reshape(len(timecodes), 11)
+    digits = chars[:, [0, 1, 3, 4, 6, 7, 9, 10]].astype(numpy.int64) - ord('0')
+    fields = digits[:, 0::2] * 10 + digits[:, 1::2]
+    return _fieldsToFrame(fields[:, 0], fields[:, 1], fields[:, 2], fields[:, 3], frameRate, dropFrame)
+
+
+class EDLIndex(object):
+    """
+    An EDL read back into one array per column, so questions about a whole edit are answered from the arrays rather
+    than by going over its text again: which event is on the record timeline at a time, where it differs from
+    another edit, and how much of each clip it uses. Times are whole frames. Clip names from the FROM CLIP NAME
+    notes are interned, the clip of event i being clipNames[clipIds[i]], or none where clipIds[i] is -1.
+    """
+    ARRAYS = ('eventNumbers', 'sourceIns', 'sourceOuts', 'recordIns', 'recordOuts', 'clipIds')
+
+    def __init__(self, title, arrays, clipNames, frameRate=TimeCode.DEFAULT_FRAME_RATE, dropFrame=False):
+        super(EDLIndex, self).__init__()
+        self.title = title
+        for name in self.ARRAYS:
+            setattr(self, name, numpy.asarray(arrays[name], dtype=numpy.int64))
+        self.clipNames = numpy.array(clipNames, dtype=numpy.unicode_)
+        self.frameRate = exactRate(frameRate)
+        self.dropFrame = dropFrame
+        # The events in record order, for finding the one at a time with a binary search.
+        self._order = numpy.argsort(self.recordIns, kind='mergesort')
+        self._sortedIns = self.recordIns[self._order]
+
+    def __len__(self):
+        return len(self.recordIns)
+
+    @classmethod
+    def read(cls, path, frameRate=TimeCode.DEFAULT_FRAME_RATE):
+        """
+        Reads an EDL file, gzipped if it ends in .gz.
+        :param frameRate: the frame rate the timecodes are in, EDLs don't say.
+        """
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rb') as f:
+            return cls.parse(f, frameRate=frameRate)
+
+    @classmethod
+    def parse(cls, f, frameRate=TimeCode.DEFAULT_FRAME_RATE, blockSize=READ_BLOCK_SIZE):
+        """
+        Reads the events of an EDL a block of lines at a time, matching every event in a block, with its clip name,
+        in one go. A block is cut before its last event so the event's notes are read along with it.
+        :param f: a file opened for reading bytes.
+        """
+        header = None
+        found = []
+        pending = []
+        while True:
+            lines = f.readlines(blockSize)
+            atEnd = not lines
+            lines = pending + lines
+            pending = []
+            if not atEnd:
+                cut = len(lines) - 1
+                while cut >= 0 and not _EVENT_START.match(lines[cut]):
+                    cut -= 1
+                if cut >= 0:
+                    lines, pending = lines[:cut], lines[cut:]
+            text = b''.join(lines)
+            if header is None and text:
+                header = text
+            found.extend(_EVENT.findall(text))
+            if atEnd:
+                break
+
+        title = _TITLE.search(header or b'')
+        title = title.group(1).decode('utf-8') if title else ''
+        fcm = _FCM.search(header or b'')
+        numbers, sourceIns, sourceOuts, recordIns, recordOuts, names = list(zip(*found)) or [()] * 6
+        if fcm:
+            dropFrame = b'NON' not in fcm.group(1).upper()
+        else:
+            dropFrame = any(b';' in x for x in recordIns)
+        frameRate = exactRate(frameRate)
+
+        uniqueNames, clipIds = numpy.unique(numpy.array(names, dtype=bytes), return_inverse=True)
+        clipNames = [x.decode('utf-8') for x in uniqueNames.tolist()]
+        if clipNames and clipNames[0] == '':
+            # Events without a clip name note.
+            clipNames = clipNames[1:]
+            clipIds = clipIds - 1
+        arrays = {
+            'eventNumbers': numpy.array(numbers, dtype=bytes).astype(numpy.int64),
+            'sourceIns': _timecodeFrames(sourceIns, frameRate, dropFrame),
+            'sourceOuts': _timecodeFrames(sourceOuts, frameRate, dropFrame),
+            'recordIns': _timecodeFrames(recordIns, frameRate, dropFrame),
+            'recordOuts': _timecodeFrames(recordOuts, frameRate, dropFrame),
+            'clipIds': clipIds,
+        }
+        return cls(title, arrays, clipNames, frameRate=frameRate, dropFrame=dropFrame)
+
+    def _frames(self, time):
+        return time.toFrames() if isinstance(time, TimeCode) else int(time)
+
+    def eventsAt(self, frames):
+        """
+        Finds the event on the record timeline at each of many times with a binary search. Where events overlap the
+        one that starts last is taken.
+        :param frames: record times in frames.
+        :return: an array of event indices, -1 for times no event covers.
+        """
+        frames = numpy.asarray(frames, dtype=numpy.int64)
+        positions = numpy.searchsorted(self._sortedIns, frames, side='right') - 1
+        events = numpy.append(self._order, -1)[positions]
+        outs = numpy.append(self.recordOuts, numpy.iinfo(numpy.int64).min)[events]
+        return numpy.where(frames < outs, events, -1)
+
+    def eventAt(self, time):
+        """
+        :param time: a record TimeCode or frame.
+        :return: the index of the event at time, or -1.
+        """
+        return int(self.eventsAt([self._frames(time)])[0])
+
+    def clipAt(self, time):
+        """
+        :return: the name of the clip on the record timeline at time, or None.
+        """
+        event = self.eventAt(time)
+        if event < 0 or self.clipIds[event] < 0:
+            return None
+        return self.clipNames[self.clipIds[event]]
+
+    def _namesOf(self, events):
+        clipIds = numpy.append(self.clipIds, -1)[events]
+        return numpy.append(self.clipNames, [u'']).astype(numpy.unicode_)[clipIds]
+
+    def _sourceFramesAt(self, events, frames):
+        offsets = frames - numpy.append(self.recordIns, 0)[events]
+        return numpy.where(events >= 0, numpy.append(self.sourceIns, 0)[events] + offsets, -1)
+
+    def diff(self, other):
+        """
+        Compares what plays on the record timeline in this edit and another. The timeline is split at every event
+        boundary of either and each stretch is checked for the same clip from the same source frame in both.
+        :return: the record start and end frames of the stretches that differ, and the event of each edit over them,
+        -1 where an edit has nothing there. Neighbouring stretches over the same two events are joined.
+        """
+        bounds = numpy.unique(numpy.concatenate([self.recordIns, self.recordOuts, other.recordIns,
+                                                 other.recordOuts]))
+        starts, ends = bounds[:-1], bounds[1:]
+        events = self.eventsAt(starts)
+        otherEvents = other.eventsAt(starts)
+        same = ((events >= 0) == (otherEvents >= 0)) & \
+            (self._namesOf(events) == other._namesOf(otherEvents)) & \
+            (self._sourceFramesAt(events, starts) == other._sourceFramesAt(otherEvents, starts))
+
+        changed = numpy.flatnonzero(~same)
+        starts, ends, events, otherEvents = starts[changed], ends[changed], events[changed], otherEvents[changed]
+        if not len(changed):
+            return starts, ends, events, otherEvents
+        joins = (starts[1:] == ends[:-1]) & (events[1:] == events[:-1]) & (otherEvents[1:] == otherEvents[:-1])
+        firsts = numpy.flatnonzero(numpy.concatenate([[True], ~joins]))
+        lasts = numpy.concatenate([firsts[1:] - 1, [len(starts) - 1]]).astype(numpy.int64)
+        return starts[firsts], ends[lasts], events[firsts], otherEvents[firsts]
+
+    def clipUsage(self):
+        """
+        How every clip is used over the edit, worked out for all of them at once.
+        :return: a dict of arrays ordered like clipNames: events, how many events use the clip; recordFrames, how long
+        it is on screen; sourceFrames, how much of its footage is used, counting footage shown more than once once;
+        and sourceFirsts and sourceLasts, the first source frame used and the one after the last.
+        """
+        count = len(self.clipNames)
+        named = self.clipIds >= 0
+        clipIds, ins, outs = self.clipIds[named], self.sourceIns[named], self.sourceOuts[named]
+        usage = {
+            'events': numpy.bincount(clipIds, minlength=count).astype(numpy.int64),
+            'recordFrames': numpy.bincount(clipIds, weights=(self.recordOuts - self.recordIns)[named],
+                                           minlength=count).astype(numpy.int64),
+            'sourceFrames': numpy.zeros(count, dtype=numpy.int64),
+            'sourceFirsts': numpy.zeros(count, dtype=numpy.int64),
+            'sourceLasts': numpy.zeros(count, dtype=numpy.int64),
+        }
+        if not len(clipIds):
+            return usage
+
+        order = numpy.lexsort((ins, clipIds))
+        clipIds, ins, outs = clipIds[order], ins[order], outs[order]
+        # How far the footage used by each clip's earlier events reaches. Every clip is offset past the frames of the
+        # one before so one running maximum serves them all.
+        span = max(int(outs.max()), 0) + 1
+        reach = numpy.maximum.accumulate(clipIds * span + outs)
+        previous = numpy.concatenate([[-1], reach[:-1]]) - clipIds * span
+        covered = numpy.maximum(0, outs - numpy.maximum(ins, previous))
+        usage['sourceFrames'] = numpy.bincount(clipIds, weights=covered, minlength=count).astype(numpy.int64)
+
+        firsts = numpy.flatnonzero(numpy.concatenate([[True], clipIds[1:] != clipIds[:-1]]))
+        lasts = numpy.concatenate([firsts[1:] - 1, [len(clipIds) - 1]]).astype(numpy.int64)
+        usage['sourceFirsts'][clipIds[firsts]] = ins[firsts]
+        usage['sourceLasts'][clipIds[lasts]] = reach[lasts] - clipIds[lasts] * span
+        return usage
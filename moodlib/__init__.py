@@ -0,0 +1,15 @@
+__author__ = 'bjarrett'
+
+from moodlib.eeg import readEegData, readEegColumns
+from moodlib.raweeg import readRawEegData, RawEeg
+from moodlib.emotions import readEmotionData, EMOTION_METRICS
+from moodlib.windows import SignalWindowIndex
+from moodlib.align import AlignedSignals
+from moodlib.scenes import SceneTimeline
+from moodlib.scoring import ClipScorer, BeatScores, CLIP_METRICS
+from moodlib.footage import FootageIndex
+from moodlib.beats import BeatCache
+from moodlib.cuts import CutDecider, Cut, chooseClip
+from moodlib.stats import RunStats
+from moodlib.planner import CutPlanner
+from moodlib.library import ClipLibrary, MoodyClip
@@ -0,0 +1,94 @@
+__author__ = 'bjarrett'
+
+import numpy
+
+from moodlib.windows import SignalWindowIndex
+
+# Samples per second of the shared grid signals are resampled onto.
+DEFAULT_GRID_RATE = 10
+# Stretches longer than this with no samples, in seconds, are left as gaps rather than interpolated across.
+DEFAULT_MAX_GAP = 2.0
+
+
+def fixedGrid(end, rate=DEFAULT_GRID_RATE, start=0.):
+    """
+    :return: grid times from start up to, not including, end at rate per second.
+    """
+    count = max(0, int(numpy.ceil((end - start) * rate - 1e-9)))
+    return start + numpy.arange(count, dtype=numpy.float64) / rate
+
+
+def resample(times, values, grid, maxGap=DEFAULT_MAX_GAP):
+    """
+    Linearly interpolates a signal sampled at times onto grid. NaN samples are dropped first. Grid points before
+    the first sample, after the last, or inside a gap between samples longer than maxGap come out as NaN.
+    :return: an array of values at the grid times.
+    """
+    times = numpy.asarray(times, dtype=numpy.float64)
+    values = numpy.asarray(values, dtype=numpy.float64)
+    grid = numpy.asarray(grid, dtype=numpy.float64)
+    if len(times) != len(values):
+        raise ValueError('There are %d times for %d values' % (len(times), len(values)))
+
+    valid = ~(numpy.isnan(values) | numpy.isnan(times))
+    times, values = times[valid], values[valid]
+    if numpy.any(numpy.diff(times) < 0):
+        order = numpy.argsort(times, kind='mergesort')
+        times, values = times[order], values[order]
+    out = numpy.empty(len(grid), dtype=numpy.float64)
+    out.fill(numpy.nan)
+    if not len(times):
+        return out
+
+    inside = (grid >= times[0]) & (grid <= times[-1])
+    out[inside] = numpy.interp(grid[inside], times, values)
+    # The samples either side of each grid point, a grid point on a sample is never in a gap.
+    right = numpy.clip(numpy.searchsorted(times, grid, side='left'), 0, len(times) - 1)
+    left = numpy.maximum(right - 1, 0)
+    gaps = (times[right] - times[left] > maxGap) & (times[right] != grid)
+    out[gaps] = numpy.nan
+    return out
+
+
+class AlignedSignals(object):
+    """
+    Several signals resampled from their own timestamps onto one shared grid, so every signal has a value at the
+    same times however each device sampled it. Averages over a window are then a contiguous slice of the grid for
+    every signal alike.
+    """
+    def __init__(self, streams, grid, maxGap=DEFAULT_MAX_GAP, rate=None):
+        """
+        :param streams: a dict of signal name -> (times in seconds, values).
+        :param grid: the shared grid times, increasing.
+        :param rate: the grid's rate if it is evenly spaced, which lets windows be found without a search.
+        """
+        super(AlignedSignals, self).__init__()
+        self.grid = numpy.asarray(grid, dtype=numpy.float64)
+        self.rate = rate
+        self.values = dict((name, resample(times, values, self.grid, maxGap=maxGap))
+                           for name, (times, values) in streams.items())
+
+    @classmethod
+    def fixed(cls, streams, end, rate=DEFAULT_GRID_RATE, start=0., maxGap=DEFAULT_MAX_GAP):
+        return cls(streams, fixedGrid(end, rate=rate, start=start), maxGap=maxGap, rate=rate)
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    def coverage(self, name):
+        """
+        :return: the fraction of the grid the signal has a value for.
+        """
+        if not len(self.grid):
+            return 0.
+        return float(numpy.count_nonzero(~numpy.isnan(self.values[name]))) / len(self.grid)
+
+    def indexes(self):
+        """
+        :return: a dict of signal name -> SignalWindowIndex over the grid.
+        """
+        if self.rate is not None:
+            start = self.grid[0] if len(self.grid) else 0.
+            return dict((name, SignalWindowIndex(values, sampleRate=self.rate, startTime=start))
+                        for name, values in self.values.items())
+        return dict((name, SignalWindowIndex(values, times=self.grid)) for name, values in self.values.items())
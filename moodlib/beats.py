@@ -0,0 +1,328 @@
+__author__ = 'bjarrett'
+
+import hashlib
+import json
+import os
+import time
+import numpy
+
+from zoic_api.logger import LOG
+from moodlib.cache import replaceFile
+
+DEFAULT_CACHE_DIR = os.environ.get('AUTO_EDITOR_CACHE', os.path.join(os.path.expanduser('~'), '.auto_editor', 'beats'))
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+# Bump this when the analysis changes in a way that makes old results wrong.
+ANALYSIS_VERSION = 1
+
+DEFAULT_PARAMS = {
+    'sr': None,
+    'hop_length': 512,
+    'hpss': True,
+    # Seconds of audio analysed at a time, None for the whole file at once.
+    'block': None,
+    # Seconds of extra audio either side of each block so the STFT and HPSS filters settle before the part kept.
+    'overlap': 2.0,
+}
+
+
+def analysisParams(**overrides):
+    params = dict(DEFAULT_PARAMS)
+    params.update((k, v) for k, v in overrides.items() if v is not None)
+    return params
+
+
+def hashFile(path, blockSize=1024 * 1024):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(blockSize)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def analyzeAudio(audioPath, params):
+    """
+    Finds the beats in an audio file.
+    :return: beat times in seconds, the tempo and the onset strength envelope the beats were tracked on.
+    """
+    import librosa
+    if params['block']:
+        onsetEnvelope, sr = streamOnsetEnvelope(audioPath, params)
+    else:
+        y, sr = librosa.load(audioPath, sr=params['sr'])
+        if params['hpss']:
+            y_harmonic, y = librosa.effects.hpss(y)
+        onsetEnvelope = librosa.onset.onset_strength(y=y, sr=sr, hop_length=params['hop_length'])
+    tempo, beats = librosa.beat.beat_track(onset_envelope=onsetEnvelope, sr=sr, hop_length=params['hop_length'])
+    beatTimes = librosa.frames_to_time(beats, sr=sr, hop_length=params['hop_length'])
+    return beatTimes, tempo, onsetEnvelope
+
+
+def decodeBlocks(audioPath, blockSeconds, overlapSeconds):
+    """
+    Decodes an audio file to mono a piece at a time, yielding overlapping segments. Segment k holds block k, the
+    audio from k * blockSeconds up to (k + 1) * blockSeconds, plus up to overlapSeconds either side of it. Only
+    about one segment of audio is held in memory at once.
+    :return: a generator of (samples, segment start in seconds, sample rate).
+    """
+    import audioread
+    with audioread.audio_open(audioPath) as f:
+        sr = f.samplerate
+        channels = f.channels
+        overlap = int(round(overlapSeconds * sr))
+
+        def blockStart(k):
+            return int(round(k * blockSeconds * sr))
+
+        pieces = []
+        pendingStart = 0
+        pendingEnd = 0
+        k = 0
+        for buf in f:
+            samples = numpy.frombuffer(buf, dtype='<i2').astype(numpy.float32) / 32768.
+            pieces.append(samples.reshape(-1, channels).mean(axis=1))
+            pendingEnd += len(pieces[-1])
+            if pendingEnd < blockStart(k + 1) + overlap:
+                continue
+            pending = numpy.concatenate(pieces)
+            while pendingEnd >= blockStart(k + 1) + overlap:
+                segmentStart = max(0, blockStart(k) - overlap)
+                segmentEnd = blockStart(k + 1) + overlap
+                yield pending[segmentStart - pendingStart:segmentEnd - pendingStart], segmentStart / float(sr), sr
+                k += 1
+            # Keep only what the next segment needs.
+            keepFrom = max(0, blockStart(k) - overlap)
+            pending = pending[keepFrom - pendingStart:]
+            pendingStart = keepFrom
+            pieces = [pending]
+
+        pending = numpy.concatenate(pieces) if pieces else numpy.zeros(0, dtype=numpy.float32)
+        while blockStart(k) < pendingEnd:
+            segmentStart = max(0, blockStart(k) - overlap)
+            yield pending[segmentStart - pendingStart:], segmentStart / float(sr), sr
+            k += 1
+
+
+def streamOnsetEnvelope(audioPath, params):
+    """
+    Builds the onset strength envelope of a file block by block. Each block is analysed with some audio either side
+    of it and only the envelope frames inside the block are kept, so the stitched envelope has no seams and memory
+    depends on the block size rather than the length of the file.
+    :return: the onset envelope and the sample rate it was analysed at.
+    """
+    import audioread
+    import librosa
+    hop = params['hop_length']
+    sr = params['sr']
+    if sr is None:
+        with audioread.audio_open(audioPath) as f:
+            sr = f.samplerate
+    # Blocks are a whole number of envelope frames long so they butt up against each other exactly.
+    blockFrames = max(1, int(round(params['block'] * sr / float(hop))))
+    blockSeconds = blockFrames * hop / float(sr)
+
+    envelopes = []
+    nextFrame = 0
+    for samples, segmentStart, nativeSr in decodeBlocks(audioPath, blockSeconds, params['overlap']):
+        if nativeSr != sr:
+            samples = librosa.resample(samples, nativeSr, sr)
+        if params['hpss']:
+            y_harmonic, samples = librosa.effects.hpss(samples)
+        envelope = librosa.onset.onset_strength(y=samples, sr=sr, hop_length=hop)
+
+        # The frame of the whole file's envelope that this segment's first frame lines up with.
+        firstFrame = int(round(segmentStart * sr / float(hop)))
+        keepFrom = nextFrame - firstFrame
+        keep = envelope[keepFrom:keepFrom + blockFrames]
+        envelopes.append(keep)
+        nextFrame += len(keep)
+    if not envelopes:
+        raise ValueError('There is no audio in %s' % audioPath)
+    return numpy.concatenate(envelopes), sr
+
+
+class BeatCache(object):
+    """
+    A directory of beat analyses, one .npz per audio file and set of analysis parameters. Entries are keyed by a hash
+    of the audio content and the parameters, so renaming or copying audio still hits the cache while changing a
+    parameter doesn't. The least recently used entries are evicted once the directory grows past maxBytes.
+    """
+    INDEX_NAME = 'index.json'
+
+    def __init__(self, directory=None, maxBytes=DEFAULT_MAX_BYTES):
+        """
+        :param directory: where the analyses are kept, DEFAULT_CACHE_DIR when None.
+        """
+        super(BeatCache, self).__init__()
+        self.directory = directory or DEFAULT_CACHE_DIR
+        self.maxBytes = maxBytes
+
+    def _makeDirectory(self):
+        # Only made once something is written, so looking at an empty cache doesn't create it.
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def _loadIndex(self):
+        path = os.path.join(self.directory, self.INDEX_NAME)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            return {}
+
+    def _saveIndex(self, index):
+        self._makeDirectory()
+        path = os.path.join(self.directory, self.INDEX_NAME)
+        tmpPath = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmpPath, 'w') as f:
+            json.dump(index, f)
+        replaceFile(tmpPath, path)
+
+    def stamp(self, audioPath):
+        """
+        :return: the file's path, size and mtime, which its content hash is remembered against.
+        """
+        st = os.stat(audioPath)
+        return '%s|%d|%r' % (os.path.abspath(audioPath), st.st_size, st.st_mtime)
+
+    def contentHash(self, audioPath, stamp=None):
+        """
+        Hashes the audio file's content. The hash is remembered against the file's stamp so an unchanged file isn't
+        read again just to find its key.
+        """
+        stamp = stamp or self.stamp(audioPath)
+        index = self._loadIndex()
+        if stamp not in index:
+            index[stamp] = hashFile(audioPath)
+            self._saveIndex(index)
+        return index[stamp]
+
+    def key(self, audioPath, params):
+        digest = hashlib.sha1()
+        digest.update(self.contentHash(audioPath).encode('ascii'))
+        digest.update(json.dumps([ANALYSIS_VERSION, params], sort_keys=True).encode('ascii'))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        """
+        :return: a dict with beats, tempo, onset_envelope and meta, or None on a miss.
+        """
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        with numpy.load(path) as data:
+            entry = {
+                'beats': data['beats'],
+                'tempo': float(data['tempo']),
+                'onset_envelope': data['onset_envelope'],
+                'meta': json.loads(str(data['meta'])),
+            }
+        # Mark it as recently used.
+        os.utime(path, None)
+        return entry
+
+    def put(self, key, beats, tempo, onsetEnvelope, meta, stamp=None):
+        """
+        :param stamp: the stamp of the audio analysed, remembered against meta's content hash. A prune in another
+            process may have forgotten it while the audio was being analysed.
+        """
+        self._makeDirectory()
+        path = self.path(key)
+        tmpPath = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmpPath, 'wb') as f:
+            numpy.savez(f,
+                        beats=numpy.asarray(beats, dtype=numpy.float64),
+                        tempo=numpy.float64(tempo),
+                        onset_envelope=numpy.asarray(onsetEnvelope, dtype=numpy.float32),
+                        meta=numpy.array(json.dumps(meta)))
+        replaceFile(tmpPath, path)
+        if stamp is not None:
+            index = self._loadIndex()
+            if index.get(stamp) != meta['content']:
+                index[stamp] = meta['content']
+                self._saveIndex(index)
+        # Never evict what was just written, even when it alone is bigger than the cache.
+        self.prune(keep=(key,))
+
+    def entries(self):
+        """
+        :return: (key, size in bytes, last used time, meta) for every entry, most recently used first.
+        """
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.directory, name)
+            st = os.stat(path)
+            try:
+                with numpy.load(path) as data:
+                    meta = json.loads(str(data['meta']))
+            except (IOError, ValueError, KeyError):
+                meta = {}
+            entries.append((name[:-len('.npz')], st.st_size, st.st_mtime, meta))
+        entries.sort(key=lambda x: x[2], reverse=True)
+        return entries
+
+    def prune(self, maxBytes=None, keep=()):
+        """
+        Removes the least recently used entries until the cache fits in maxBytes, then forgets the content hashes of
+        audio that no longer has any entries.
+        :param keep: keys that are never removed.
+        :return: the keys that were removed.
+        """
+        maxBytes = self.maxBytes if maxBytes is None else maxBytes
+        total = 0
+        removed = []
+        contents = set()
+        for key, size, lastUsed, meta in self.entries():
+            total += size
+            if total > maxBytes and key not in keep:
+                os.remove(self.path(key))
+                removed.append(key)
+            else:
+                contents.add(meta.get('content'))
+        if removed:
+            LOG.info('Evicted %d beat cache entries from %s', len(removed), self.directory)
+
+        index = self._loadIndex()
+        stale = [stamp for stamp, content in index.items() if content not in contents]
+        if stale:
+            for stamp in stale:
+                del index[stamp]
+            self._saveIndex(index)
+        return removed
+
+    def analysis(self, audioPath, **params):
+        """
+        Gets the beat analysis of an audio file, running it only if this file hasn't been analysed with these
+        parameters before.
+        """
+        params = analysisParams(**params)
+        stamp = self.stamp(audioPath)
+        content = self.contentHash(audioPath, stamp=stamp)
+        key = self.key(audioPath, params)
+        entry = self.get(key)
+        if entry is not None:
+            LOG.debug('Beat cache hit for %s', audioPath)
+            return entry
+
+        LOG.info('Analysing beats in %s', audioPath)
+        beats, tempo, onsetEnvelope = analyzeAudio(audioPath, params)
+        meta = {
+            'audio': os.path.abspath(audioPath),
+            'content': content,
+            'params': params,
+            'created': time.time(),
+        }
+        self.put(key, beats, tempo, onsetEnvelope, meta, stamp=stamp)
+        return {'beats': beats, 'tempo': float(tempo), 'onset_envelope': onsetEnvelope, 'meta': meta}
@@ -0,0 +1,67 @@
+__author__ = 'bjarrett'
+
+import os
+import numpy
+
+from zoic_api.logger import LOG
+
+
+def sourceKey(sourcePath, *extra):
+    """
+    Builds the key a sidecar cache is validated against: the size and mtime of the source file plus anything
+    else that changes what was parsed out of it (requested columns, parameters...).
+    :param sourcePath: the file the cache was built from.
+    :param extra: additional strings to fold into the key.
+    :return: a string key.
+    """
+    st = os.stat(sourcePath)
+    parts = [str(st.st_size), repr(st.st_mtime)]
+    parts.extend(str(x) for x in extra)
+    return '|'.join(parts)
+
+
+def sidecarPath(sourcePath, tag):
+    return '%s.%s.npz' % (sourcePath, tag)
+
+
+def replaceFile(src, dst):
+    # os.rename will not overwrite an existing file on windows.
+    if os.name == 'nt' and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+def loadSidecar(sourcePath, tag, key):
+    """
+    Loads the arrays cached next to sourcePath if the cache is still valid for key.
+    :return: a dict of name -> numpy array, or None on a miss.
+    """
+    path = sidecarPath(sourcePath, tag)
+    if not os.path.exists(path):
+        return None
+    try:
+        with numpy.load(path) as data:
+            if str(data['__key__']) != key:
+                LOG.debug('Stale cache %s', path)
+                return None
+            return dict((name, data[name]) for name in data.files if name != '__key__')
+    except (IOError, OSError, ValueError, KeyError) as e:
+        LOG.debug('Unreadable cache %s: %s', path, e)
+        return None
+
+
+def saveSidecar(sourcePath, tag, key, arrays):
+    """
+    Writes arrays next to sourcePath. The file is written under a temporary name and renamed into place so a
+    half written cache is never picked up. Failing to write the cache is not an error.
+    """
+    path = sidecarPath(sourcePath, tag)
+    tmpPath = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(tmpPath, 'wb') as f:
+            numpy.savez(f, __key__=numpy.array(key), **arrays)
+        replaceFile(tmpPath, path)
+    except (IOError, OSError) as e:
+        LOG.debug('Could not write cache %s: %s', path, e)
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
@@ -0,0 +1,180 @@
+__author__ = 'bjarrett'
+
+import os
+import zlib
+import numpy
+
+from zoic_api.logger import LOG
+from moodlib.cache import replaceFile
+
+# Bump this when what a checkpoint holds or how beats are fingerprinted changes.
+CHECKPOINT_VERSION = 1
+
+
+def _crc(parts, crc=0):
+    for part in parts:
+        if isinstance(part, numpy.ndarray):
+            data = numpy.ascontiguousarray(part).tobytes()
+        else:
+            data = repr(part).encode('utf-8')
+        crc = zlib.crc32(data, crc)
+    return crc & 0xffffffff
+
+
+def sceneFingerprints(timeline, clips, features):
+    """
+    :param features: the scorer's clip feature matrix.
+    :return: a crc for each scene of everything about it a beat can depend on: where the scene starts and ends,
+    and the name, footage and ratings of each of its clips in order.
+    """
+    fingerprints = []
+    for sceneIndex, sceneClips in enumerate(timeline.sceneClips):
+        parts = [timeline.starts[sceneIndex], timeline.ends[sceneIndex], features[sceneClips]]
+        for clipIndex in sceneClips.tolist():
+            clip = clips[clipIndex]
+            parts.extend([clip.name, clip.startTc.toFrames(), clip.duration])
+        fingerprints.append(_crc(parts))
+    return fingerprints
+
+
+def beatFingerprints(beatFrames, beatFirsts, beatLasts, beatScenes, sceneCrcs, signals):
+    """
+    A crc per beat of the inputs the beat's decision depends on beyond the state earlier beats left: its frame,
+    its section, its scene and the signal values over its own section. A section stretched back over earlier beats
+    is covered by those beats' fingerprints.
+    :param sceneCrcs: see sceneFingerprints.
+    :param signals: a dict of signal name -> SignalWindowIndex.
+    :return: a uint32 array.
+    """
+    names = sorted(signals)
+    bounds = [signals[name].indices(beatFirsts, beatLasts + 1) for name in names]
+    fingerprints = numpy.empty(len(beatFrames), dtype=numpy.uint32)
+    for beatIndex in range(len(beatFrames)):
+        sceneIndex = beatScenes[beatIndex]
+        crc = _crc([beatFrames[beatIndex], beatFirsts[beatIndex], beatLasts[beatIndex],
+                    sceneCrcs[sceneIndex] if sceneIndex >= 0 else -1])
+        for name, (lo, hi) in zip(names, bounds):
+            crc = zlib.crc32(signals[name].values[lo[beatIndex]:hi[beatIndex]].tobytes(), crc)
+        fingerprints[beatIndex] = crc & 0xffffffff
+    return fingerprints
+
+
+class CutCheckpoint(object):
+    """
+    The greedy cut loop's state after every beat, a fingerprint of what each beat depended on, and the cuts that
+    were made, so a run over inputs that have only partly changed can pick up from the first beat that differs.
+    Clips are recorded by name since adding a clip to the description moves the index of others.
+
+    The footage each clip has left isn't stored per beat, it is rebuilt by replaying the cuts before the beat the
+    run picks up from.
+    """
+    ARRAYS = ('fingerprints', 'clipNames', 'lastClips', 'lastCuts', 'sameClipBeatCounters', 'sectionStarts',
+              'cutBeats', 'cutClips', 'cutClipStarts', 'cutClipEnds', 'cutStarts', 'cutEnds')
+
+    def __init__(self, key, seed, arrays):
+        """
+        :param key: the settings every beat depends on, a checkpoint made with other settings is never resumed.
+        :param seed: the seed the run's randomness was derived from.
+        """
+        super(CutCheckpoint, self).__init__()
+        self.key = key
+        self.seed = seed
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def load(cls, path):
+        """
+        :return: the checkpoint at path, or None if there isn't a usable one.
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with numpy.load(path) as data:
+                if int(data['version']) != CHECKPOINT_VERSION:
+                    return None
+                return cls(str(data['key']), int(data['seed']), dict((x, data[x]) for x in cls.ARRAYS))
+        except (IOError, OSError, KeyError, ValueError) as e:
+            LOG.warning('Ignoring the unreadable checkpoint %s: %s', path, e)
+            return None
+
+    def save(self, path):
+        tmpPath = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmpPath, 'wb') as f:
+            numpy.savez(f, version=numpy.array(CHECKPOINT_VERSION), key=numpy.array(self.key),
+                        seed=numpy.array(self.seed), **dict((x, getattr(self, x)) for x in self.ARRAYS))
+        replaceFile(tmpPath, path)
+
+    def resumeBeat(self, key, fingerprints):
+        """
+        :return: the first beat whose inputs differ from the checkpoint's, the number of beats if none do.
+        """
+        if key != self.key:
+            return 0
+        count = min(len(fingerprints), len(self.fingerprints))
+        changed = numpy.flatnonzero(fingerprints[:count] != self.fingerprints[:count])
+        return int(changed[0]) if len(changed) else count
+
+
+class CheckpointRecorder(object):
+    """
+    Collects the loop state after each beat and the cuts made while cutting, for a CutCheckpoint.
+    """
+    def __init__(self, beatCount, clips):
+        super(CheckpointRecorder, self).__init__()
+        self.clips = clips
+        self.lastClips = numpy.empty(beatCount, dtype=numpy.int64)
+        self.lastCuts = numpy.empty(beatCount, dtype=numpy.int64)
+        self.sameClipBeatCounters = numpy.empty(beatCount, dtype=numpy.int64)
+        self.sectionStarts = numpy.empty(beatCount, dtype=numpy.int64)
+        # (beat, clip index, clip start, clip end, timeline start, timeline end) of each cut, in frames.
+        self.cuts = []
+
+    def resume(self, checkpoint, beatIndex, clipIds):
+        """
+        Takes the state after each beat before beatIndex, and the cuts made on them, from an earlier checkpoint.
+        :param clipIds: a dict of clip name -> index into this run's clips.
+        :return: those cuts, see cut.
+        """
+        remap = numpy.array([clipIds.get(x, -1) for x in checkpoint.clipNames.tolist()] + [-1], dtype=numpy.int64)
+        self.lastClips[:beatIndex] = remap[checkpoint.lastClips[:beatIndex]]
+        self.lastCuts[:beatIndex] = checkpoint.lastCuts[:beatIndex]
+        self.sameClipBeatCounters[:beatIndex] = checkpoint.sameClipBeatCounters[:beatIndex]
+        self.sectionStarts[:beatIndex] = checkpoint.sectionStarts[:beatIndex]
+        kept = checkpoint.cutBeats < beatIndex
+        self.cuts = list(zip(checkpoint.cutBeats[kept].tolist(), remap[checkpoint.cutClips[kept]].tolist(),
+                             checkpoint.cutClipStarts[kept].tolist(), checkpoint.cutClipEnds[kept].tolist(),
+                             checkpoint.cutStarts[kept].tolist(), checkpoint.cutEnds[kept].tolist()))
+        return list(self.cuts)
+
+    def beat(self, beatIndex, decider):
+        self.lastClips[beatIndex] = decider.lastClipIndex
+        self.lastCuts[beatIndex] = decider.lastCut
+        self.sameClipBeatCounters[beatIndex] = decider.sameClipBeatCounter
+        self.sectionStarts[beatIndex] = decider.sectionStart
+
+    def cut(self, beatIndex, clipIndex, cut):
+        self.cuts.append((beatIndex, clipIndex, cut.clipStart.toFrames(), cut.clipEnd.toFrames(),
+                          cut.timeLineStart.toFrames(), cut.timeLineEnd.toFrames()))
+
+    def checkpoint(self, key, seed, fingerprints):
+        # Only the names of clips that were used are kept, states and cuts index into them.
+        used = sorted(set(x[1] for x in self.cuts).union(x for x in self.lastClips.tolist() if x >= 0))
+        remap = numpy.empty(len(self.clips) + 1, dtype=numpy.int64)
+        remap[-1] = -1
+        remap[used] = numpy.arange(len(used))
+        cuts = numpy.array(self.cuts, dtype=numpy.int64).reshape(len(self.cuts), 6)
+        return CutCheckpoint(key, seed, {
+            'fingerprints': fingerprints,
+            'clipNames': numpy.array([self.clips[x].name for x in used], dtype=numpy.unicode_),
+            'lastClips': remap[self.lastClips],
+            'lastCuts': self.lastCuts,
+            'sameClipBeatCounters': self.sameClipBeatCounters,
+            'sectionStarts': self.sectionStarts,
+            'cutBeats': cuts[:, 0],
+            'cutClips': remap[cuts[:, 1]],
+            'cutClipStarts': cuts[:, 2],
+            'cutClipEnds': cuts[:, 3],
+            'cutStarts': cuts[:, 4],
+            'cutEnds': cuts[:, 5],
+        })
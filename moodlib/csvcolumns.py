@@ -0,0 +1,136 @@
+__author__ = 'bjarrett'
+
+import csv
+import numpy
+
+# Roughly how many bytes of lines are parsed at a time.
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def readCsvHeader(path):
+    with open(path, 'r') as f:
+        return [x.strip() for x in next(csv.reader(f))]
+
+
+def parseFloats(cells, dtype):
+    """
+    Converts a list of strings to a float array, empty strings become NaN.
+    """
+    values = numpy.array(cells)
+    try:
+        return numpy.where(values == '', 'nan', values).astype(dtype)
+    except ValueError:
+        # Whitespace or other oddities, do these the slow way.
+        out = numpy.empty(len(cells), dtype=dtype)
+        for i, cell in enumerate(cells):
+            cell = cell.strip()
+            out[i] = float(cell) if cell else numpy.nan
+        return out
+
+
+def toSeconds(cells):
+    """
+    Converts a column of timestamps into float seconds. Numeric columns are taken as they are, anything else is
+    parsed as a date time string like '2016-05-10 18:16:59'.
+    """
+    try:
+        return parseFloats(cells, numpy.float64)
+    except ValueError:
+        pass
+    stamps = numpy.array([x.strip() for x in cells], dtype='datetime64[ms]')
+    return stamps.astype(numpy.int64) / 1000.
+
+
+def _splitBlock(lines, width):
+    """
+    Splits a block of lines into one flat list of cells. Every row must have width cells, which lets each
+    column be picked out with a single slice.
+    :return: the cells, or None if the block can't be split this way.
+    """
+    block = ''.join(lines).rstrip('\r\n')
+    if '"' in block:
+        return None
+    if '\r' in block:
+        block = block.replace('\r', '')
+    rows = block.count('\n') + 1
+    cells = block.replace('\n', ',').split(',')
+    if len(cells) != rows * width:
+        return None
+    return cells
+
+
+def _splitRows(lines, width):
+    # Fallback for blocks with quoting or ragged rows.
+    cells = []
+    for row in csv.reader(lines):
+        if not row:
+            continue
+        row = row[:width] + [''] * (width - len(row))
+        cells.extend(row)
+    return cells
+
+
+def iterCsvColumns(path, columns, timeColumn=None, dtype=numpy.float32, blockSize=BLOCK_SIZE):
+    """
+    Reads only the named columns of a csv file a block of lines at a time, so a file of any size is read in the
+    memory of one block. Empty cells become NaN.
+    :param path: the csv file.
+    :param columns: the names of the numeric columns to read.
+    :param timeColumn: an optional column converted to float64 seconds.
+    :param dtype: the dtype of the numeric columns.
+    :param blockSize: roughly how many bytes of lines to parse at a time.
+    :return: a generator of dicts of column name -> array for each block, the time column included.
+    """
+    headers = readCsvHeader(path)
+    width = len(headers)
+    wanted = list(columns)
+    if timeColumn is not None:
+        wanted.append(timeColumn)
+    for name in wanted:
+        if name not in headers:
+            raise ValueError('Column %s is not in %s' % (name, path))
+    indices = dict((name, headers.index(name)) for name in wanted)
+
+    with open(path, 'r') as f:
+        f.readline()
+        while True:
+            lines = f.readlines(blockSize)
+            if not lines:
+                break
+            cells = _splitBlock(lines, width)
+            if cells is None:
+                cells = _splitRows(lines, width)
+            block = {}
+            for name in wanted:
+                column = cells[indices[name]::width]
+                if name == timeColumn:
+                    block[name] = toSeconds(column)
+                else:
+                    block[name] = parseFloats(column, dtype)
+            yield block
+
+
+def readCsvColumns(path, columns, timeColumn=None, dtype=numpy.float32):
+    """
+    Reads only the named columns of a csv file into numpy arrays. Empty cells become NaN.
+    :param path: the csv file.
+    :param columns: the names of the numeric columns to read.
+    :param timeColumn: an optional column converted to float64 seconds.
+    :param dtype: the dtype of the numeric columns.
+    :return: a dict of column name -> array, the time column included.
+    """
+    wanted = list(columns)
+    if timeColumn is not None:
+        wanted.append(timeColumn)
+    chunks = dict((name, []) for name in wanted)
+    for block in iterCsvColumns(path, columns, timeColumn=timeColumn, dtype=dtype):
+        for name in wanted:
+            chunks[name].append(block[name])
+
+    result = {}
+    for name in wanted:
+        if chunks[name]:
+            result[name] = numpy.concatenate(chunks[name])
+        else:
+            result[name] = numpy.zeros(0, dtype=numpy.float64 if name == timeColumn else dtype)
+    return result
@@ -0,0 +1,159 @@
+__author__ = 'bjarrett'
+
+import collections
+import numpy
+
+from edllib import TimeCode
+from moodlib.footage import FootageIndex
+
+Cut = collections.namedtuple('Cut', ['clip', 'clipStart', 'clipEnd', 'timeLineStart', 'timeLineEnd'])
+
+
+def chooseClip(scorer, targets, candidates, lastClip, reusedCounter, base=None):
+    """
+    Determines ideal camera angle and shot content based on source data:
+    1) Sums all targetEmotions to compute emotional intensity of shot as deviation from neutral camera angle (MS-MWS)
+    2) Compares targetMellow vs targetConcentrate to choose which direction to select on camera angle spectrum (XCU-CU-MS-MWS-WS-XWS)
+    3) OPTION: We can implement targetValence as control over frames per second (slow motion)
+    4) TODO: Integrate Watson JSON data to incorporate lyrical emotional data
+
+    :param scorer: the ClipScorer holding every clip's attributes.
+    :param targets: the target value of each of the scorer's metrics.
+    :param candidates: the indices of the clips that can be chosen.
+    :param lastClip: the index of the clip currently playing, -1 for none.
+    :param reusedCounter: how many beats lastClip has been held for.
+    :param base: the candidates' base scores against targets if they are already known.
+    :return: the candidate indices ordered from best to worst.
+    """
+    # Compute the score for each, the best goes first.
+    return scorer.rank(targets, candidates, lastClip=lastClip, reusedCounter=reusedCounter, base=base)
+
+
+class CutDecider(object):
+    """
+    The state carried from beat to beat while cutting: which clip is playing, where the last cut was and how long
+    the clip has been held. Each call to decide makes the choice for one beat, so cuts can be made as beats go by
+    as well as over a whole song at once.
+    """
+    SLATE_FRAMES = 20
+    SAME_CLIP_BEAT_LIMIT = 20
+
+    def __init__(self, clips, timeline, scorer, frameRate, slateFrames=SLATE_FRAMES,
+                 sameClipBeatLimit=SAME_CLIP_BEAT_LIMIT, footage=None, markClips=True):
+        """
+        :param clips: the list of clips.
+        :param timeline: the SceneTimeline for the clips.
+        :param scorer: the ClipScorer for the clips.
+        :param frameRate: the frame rate of the timeline.
+        :param footage: a FootageIndex to start from, which is copied rather than used up. By default one is made
+            from the clips.
+        :param markClips: whether to set lastUsedEnd on the clips used. Leave it off when several edits share the
+            clips, the footage used is always tracked in the FootageIndex.
+        """
+        super(CutDecider, self).__init__()
+        self.clips = clips
+        self.timeline = timeline
+        self.scorer = scorer
+        self.frameRate = frameRate
+        self.sameClipBeatLimit = sameClipBeatLimit
+        self.markClips = markClips
+        if footage is None:
+            self.footage = FootageIndex(clips, timeline.sceneClips, slateFrames=slateFrames)
+        else:
+            self.footage = footage.copy()
+
+        # Where the section being averaged for the next beat starts, in seconds.
+        self.sectionStart = 0
+        self.lastClipIndex = -1
+        self.lastCut = 1
+        self.sameClipBeatCounter = 0
+        # The clip picked on the last beat, whether or not it was a cut.
+        self.chosenIndex = -1
+
+        # How many beats were decided, how many of those held the playing clip or cut away from it, and how many
+        # times the playing clip had to be left out because it had been held too long.
+        self.decisions = 0
+        self.holds = 0
+        self.cuts = 0
+        self.holdLimitHits = 0
+
+    def restore(self, lastClipIndex, lastCut, sameClipBeatCounter, sectionStart):
+        """
+        Puts the state back to how an earlier run left it after some beat, see CutCheckpoint. The footage used up to
+        then has to be marked on self.footage separately.
+        """
+        self.lastClipIndex = lastClipIndex
+        self.chosenIndex = lastClipIndex
+        self.lastCut = lastCut
+        self.sameClipBeatCounter = sameClipBeatCounter
+        self.sectionStart = sectionStart
+
+    def candidates(self, sceneIndex, length):
+        """
+        Only clips with enough footage left for this cut can be chosen. The clip that is already playing can still
+        be held for this beat as long as it hasn't been held too long.
+        """
+        candidates = self.footage.available(sceneIndex, length)
+        holdable = self.sameClipBeatCounter <= self.sameClipBeatLimit
+        inScene = self.lastClipIndex in self.timeline.sceneClips[sceneIndex]
+        if holdable and inScene:
+            if self.lastClipIndex not in candidates:
+                candidates = numpy.append(candidates, self.lastClipIndex)
+        else:
+            if inScene:
+                self.holdLimitHits += 1
+            candidates = candidates[candidates != self.lastClipIndex]
+        return candidates
+
+    def decide(self, beatFrame, sceneIndex, averages, sectionEnd, sceneScores=None):
+        """
+        Decides what happens on one beat.
+        :param beatFrame: the timeline frame of the beat.
+        :param sceneIndex: the scene the beat falls in.
+        :param averages: a dict of signal name -> average over the section since sectionStart, which can be None
+            when sceneScores are given.
+        :param sectionEnd: where the section ends, in seconds. The next section starts here if this beat is a cut.
+        :param sceneScores: the base scores of the scene's clips against averages, see BeatScores.beat, if they are
+            already known.
+        :return: a Cut, or None if the playing clip is held through the beat.
+        """
+        # Length in frames.
+        length = beatFrame - self.lastCut
+        candidates = self.candidates(sceneIndex, length)
+        if not len(candidates):
+            raise ValueError('Uh oh, no possible clips for this cut.')
+
+        if sceneScores is None:
+            targets = self.scorer.targets(averages)
+            base = None
+        else:
+            targets = None
+            base = sceneScores[self.timeline.clipPositions[sceneIndex][candidates]]
+        clipIndex = chooseClip(self.scorer, targets, candidates, self.lastClipIndex, self.sameClipBeatCounter,
+                               base=base)[0]
+        self.chosenIndex = clipIndex
+        self.decisions += 1
+        if clipIndex == self.lastClipIndex:
+            self.sameClipBeatCounter += 1
+            self.holds += 1
+            return None
+        self.sameClipBeatCounter = 0
+        self.cuts += 1
+
+        clip = self.clips[clipIndex]
+        clipStartFrame = self.footage.nextStarts[clipIndex]
+        clipEndFrame = clipStartFrame + length
+        self.footage.use(clipIndex, clipEndFrame)
+        clipEnd = TimeCode.fromFrame(clipEndFrame, frameRate=self.frameRate)
+        if self.markClips:
+            clip.lastUsedEnd = clipEnd
+
+        cut = Cut(clip,
+                  clipStart=TimeCode.fromFrame(clipStartFrame, frameRate=self.frameRate),
+                  clipEnd=clipEnd,
+                  timeLineStart=TimeCode.fromFrame(self.lastCut, frameRate=self.frameRate),
+                  timeLineEnd=TimeCode.fromFrame(beatFrame, frameRate=self.frameRate))
+        self.lastCut = beatFrame
+        self.sectionStart = sectionEnd
+        self.lastClipIndex = clipIndex
+        return cut
@@ -0,0 +1,36 @@
+__author__ = 'bjarrett'
+
+import numpy
+
+from moodlib.cache import sourceKey, loadSidecar, saveSidecar
+from moodlib.csvcolumns import readCsvColumns
+
+EEG_TIME_COLUMN = 'TimeStamp'
+EEG_COLUMNS = ('Mellow', 'Concentration')
+
+
+def readEegColumns(eegPath, columns=EEG_COLUMNS, useCache=True):
+    """
+    Reads the given columns out of a Muse csv.
+    The parsed arrays are cached next to the csv, so reading the same session again skips the csv entirely.
+    :param eegPath: path to the Muse csv.
+    :param columns: the names of the columns to read.
+    :param useCache: whether to read and write the sidecar cache.
+    :return: seconds since the first sample as float64 and a dict of column name -> float32 array.
+    """
+    columns = list(columns)
+    key = sourceKey(eegPath, *columns)
+    data = loadSidecar(eegPath, 'eeg', key) if useCache else None
+    if data is None:
+        data = readCsvColumns(eegPath, columns, timeColumn=EEG_TIME_COLUMN)
+        if useCache:
+            saveSidecar(eegPath, 'eeg', key, data)
+
+    timeStamps = data[EEG_TIME_COLUMN]
+    seconds = timeStamps - timeStamps[0] if len(timeStamps) else timeStamps
+    return seconds, dict((name, data[name]) for name in columns)
+
+
+def readEegData(eegPath, useCache=True):
+    seconds, columns = readEegColumns(eegPath, EEG_COLUMNS, useCache=useCache)
+    return seconds, columns['Mellow'], columns['Concentration']
@@ -0,0 +1,193 @@
+__author__ = 'bjarrett'
+
+import os
+import numpy
+
+from moodlib.cache import sourceKey, loadSidecar, saveSidecar
+from moodlib.csvcolumns import readCsvHeader, readCsvColumns, parseFloats
+
+EMOTION_METRICS = ('joy', 'disgust', 'sadness', 'anger', 'surprise', 'contempt', 'fear', 'valence')
+
+# Affdex csv exports name the time column differently depending on the exporter.
+CSV_TIME_COLUMNS = ('timestamp', 'TimeStamp(msec)')
+JSON_TIME_METRIC = 'time stamp (msec)'
+
+# How much of a metrics json is read at a time.
+CHUNK_SIZE = 1024 * 1024
+
+
+def emotionColumn(metric, headers):
+    """
+    Finds the Affdex csv column for a metric name. The emotions are exported as e.g. joyct_emotion_nonlinear_causal
+    while valence is valencect_nonlinear_causal.
+    """
+    for column in (metric + 'ct_emotion_nonlinear_causal', metric + 'ct_nonlinear_causal', metric):
+        if column in headers:
+            return column
+    raise ValueError('No column for emotion metric %s' % metric)
+
+
+def readEmotionCsv(filepath, metrics):
+    """
+    :return: the raw millisecond timestamps and a dict of metric -> float32 array.
+    """
+    headers = readCsvHeader(filepath)
+    timeColumns = [x for x in CSV_TIME_COLUMNS if x in headers]
+    if not timeColumns:
+        raise ValueError('No timestamp column in %s' % filepath)
+    columns = dict((metric, emotionColumn(metric, headers)) for metric in metrics)
+    data = readCsvColumns(filepath, columns.values(), timeColumn=timeColumns[0])
+    return data[timeColumns[0]], dict((metric, data[column]) for metric, column in columns.items())
+
+
+class _JsonScanner(object):
+    """
+    Walks a json document a chunk at a time. This only understands as much json as the Affdex metrics
+    files need: an object of metric name -> flat array of numbers.
+    """
+    def __init__(self, f, chunkSize=CHUNK_SIZE):
+        super(_JsonScanner, self).__init__()
+        self.f = f
+        self.chunkSize = chunkSize
+        self.buf = ''
+        self.pos = 0
+
+    def fill(self):
+        chunk = self.f.read(self.chunkSize)
+        if not chunk:
+            raise ValueError('Unexpected end of json')
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def seek(self, text):
+        while True:
+            index = self.buf.find(text, self.pos)
+            if index >= 0:
+                self.pos = index + len(text)
+                return
+            # Keep enough of the tail around in case text straddles two chunks.
+            self.pos = max(self.pos, len(self.buf) - len(text))
+            self.fill()
+
+    def nextChar(self):
+        while True:
+            while self.pos < len(self.buf):
+                c = self.buf[self.pos]
+                self.pos += 1
+                if not c.isspace():
+                    return c
+            self.fill()
+
+    def expect(self, char):
+        c = self.nextChar()
+        if c != char:
+            raise ValueError('Expected %r in json but found %r' % (char, c))
+
+    def readUntil(self, char):
+        while True:
+            index = self.buf.find(char, self.pos)
+            if index >= 0:
+                text = self.buf[self.pos:index]
+                self.pos = index + 1
+                return text
+            self.fill()
+
+    def skipPast(self, char):
+        while True:
+            index = self.buf.find(char, self.pos)
+            if index >= 0:
+                self.pos = index + 1
+                return
+            self.pos = len(self.buf)
+            self.fill()
+
+    def readNumbers(self, dtype):
+        """
+        Reads the rest of a flat array of numbers, the opening bracket has already been read.
+        """
+        chunks = []
+        while True:
+            end = self.buf.find(']', self.pos)
+            if end >= 0:
+                last = end
+            else:
+                last = self.buf.rfind(',', self.pos)
+            if last > self.pos:
+                cells = [x.strip() for x in self.buf[self.pos:last].split(',')]
+                # Affdex writes "TF" where face tracking failed, treat that and nulls as missing.
+                cells = ['' if x == 'null' or x.startswith('"') else x for x in cells]
+                chunks.append(parseFloats(cells, dtype))
+            if end >= 0:
+                self.pos = end + 1
+                break
+            if last > self.pos:
+                self.pos = last + 1
+            self.fill()
+        if not chunks:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.concatenate(chunks)
+
+
+def readEmotionJson(filepath, metrics):
+    """
+    Reads an Affdex metrics json, e.g. {"metrics": {"joy": [...], ...}, "metric_map": {...}}.
+    Only the requested metrics are parsed, everything else is skipped over without being kept in memory.
+    :return: the raw millisecond timestamps and a dict of metric -> float32 array.
+    """
+    wanted = set(metrics)
+    wanted.add(JSON_TIME_METRIC)
+    found = {}
+    with open(filepath, 'r') as f:
+        scanner = _JsonScanner(f)
+        scanner.seek('"metrics"')
+        scanner.expect(':')
+        scanner.expect('{')
+        while True:
+            c = scanner.nextChar()
+            if c == '}':
+                break
+            if c == ',':
+                continue
+            if c != '"':
+                raise ValueError('Unexpected %r in %s' % (c, filepath))
+            name = scanner.readUntil('"')
+            scanner.expect(':')
+            scanner.expect('[')
+            if name in wanted:
+                dtype = numpy.float64 if name == JSON_TIME_METRIC else numpy.float32
+                found[name] = scanner.readNumbers(dtype)
+            else:
+                scanner.skipPast(']')
+
+    missing = wanted.difference(found)
+    if missing:
+        raise ValueError('Metrics %s are not in %s' % (', '.join(sorted(missing)), filepath))
+    timeStamps = found.pop(JSON_TIME_METRIC)
+    return timeStamps, found
+
+
+def readEmotionData(filepath, metrics=EMOTION_METRICS, useCache=True):
+    """
+    Reads the selected emotion metrics out of either an Affdex metrics csv or json.
+    The parsed arrays are cached next to the source file for reruns.
+    :param filepath: an Affdex .csv or .json export.
+    :param metrics: the emotion names to read, e.g. joy or valence.
+    :param useCache: whether to read and write the sidecar cache.
+    :return: seconds since the first sample as float64 and a dict of metric -> float32 array.
+    """
+    metrics = list(metrics)
+    key = sourceKey(filepath, *metrics)
+    data = loadSidecar(filepath, 'emotion', key) if useCache else None
+    if data is None:
+        if os.path.splitext(filepath)[1].lower() == '.json':
+            timeStamps, metricsDict = readEmotionJson(filepath, metrics)
+        else:
+            timeStamps, metricsDict = readEmotionCsv(filepath, metrics)
+        data = dict(metricsDict)
+        data['__time__'] = timeStamps
+        if useCache:
+            saveSidecar(filepath, 'emotion', key, data)
+
+    timeStamps = data['__time__']
+    seconds = (timeStamps - timeStamps[0]) / 1000. if len(timeStamps) else timeStamps
+    return seconds, dict((metric, data[metric]) for metric in metrics)
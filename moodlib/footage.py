@@ -0,0 +1,98 @@
+__author__ = 'bjarrett'
+
+import copy
+import numpy
+
+
+class FootageIndex(object):
+    """
+    Tracks how much unused footage every clip has left and keeps each scene's clips sorted by it, so the clips
+    that can still cover a cut of a given length are found with a binary search rather than by trying them in turn.
+    """
+    def __init__(self, clips, sceneClips, slateFrames=0):
+        """
+        :param clips: the list of clips. A clip's lastUsedEnd, if set, is where its unused footage starts.
+        :param sceneClips: an array of clip indices for each scene.
+        :param slateFrames: frames skipped at the head of a clip that hasn't been used yet.
+        """
+        super(FootageIndex, self).__init__()
+        self.clips = clips
+        self.sceneClips = sceneClips
+        self.starts = numpy.array([x.startTc.toFrames() for x in clips], dtype=numpy.int64)
+        self.ends = self.starts + numpy.array([x.duration for x in clips], dtype=numpy.int64)
+        self.nextStarts = numpy.array([self.starts[i] + slateFrames if x.lastUsedEnd is None
+                                       else x.lastUsedEnd.toFrames() for i, x in enumerate(clips)],
+                                      dtype=numpy.int64)
+
+        # For each scene its clip indices sorted by remaining footage then index, and alongside them sort keys
+        # that pack the two into one integer. use() replaces these arrays rather than changing them, so what
+        # available() returned is never changed under the caller.
+        self._clipScenes = [[] for x in clips]
+        self._sceneOrder = []
+        self._sceneKeys = []
+        for sceneIndex, clipIndices in enumerate(sceneClips):
+            clipIndices = numpy.asarray(clipIndices, dtype=numpy.int64)
+            for clipIndex in clipIndices:
+                self._clipScenes[clipIndex].append(sceneIndex)
+            keys = self._key(self.remaining(clipIndices), clipIndices)
+            order = numpy.argsort(keys)
+            self._sceneOrder.append(clipIndices[order])
+            self._sceneKeys.append(keys[order])
+
+        # How many cuts had to be chosen without some of the scene's clips because they had run out of footage,
+        # and how many clips were left out in total.
+        self.fallbacks = 0
+        self.exhaustedClips = 0
+
+    def copy(self):
+        """
+        :return: an index with this one's footage used so far, which can go on to use footage on its own.
+        """
+        other = copy.copy(self)
+        other.nextStarts = self.nextStarts.copy()
+        other._sceneOrder = list(self._sceneOrder)
+        other._sceneKeys = list(self._sceneKeys)
+        other.fallbacks = 0
+        other.exhaustedClips = 0
+        return other
+
+    def _key(self, remaining, clipIndex):
+        # Orders by remaining footage, then by clip index.
+        return remaining * len(self.clips) + clipIndex
+
+    def remaining(self, clipIndex):
+        return self.ends[clipIndex] - self.nextStarts[clipIndex]
+
+    def available(self, sceneIndex, length):
+        """
+        :return: the indices of the scene's clips with at least length frames left, and also counts the cut as a
+        fallback when any were left out.
+        """
+        # Anything at or past this position has enough footage.
+        position = numpy.searchsorted(self._sceneKeys[sceneIndex], self._key(length, 0))
+        if position:
+            self.fallbacks += 1
+            self.exhaustedClips += position
+        return self._sceneOrder[sceneIndex][position:]
+
+    def use(self, clipIndex, endFrame):
+        """
+        Marks a clip's footage up to endFrame as used.
+        """
+        oldKey = self._key(self.remaining(clipIndex), clipIndex)
+        self.nextStarts[clipIndex] = endFrame
+        newKey = self._key(self.remaining(clipIndex), clipIndex)
+        for sceneIndex in self._clipScenes[clipIndex]:
+            order = self._sceneOrder[sceneIndex]
+            keys = self._sceneKeys[sceneIndex]
+            old = keys.searchsorted(oldKey)
+            new = keys.searchsorted(newKey)
+            self._sceneOrder[sceneIndex] = _moved(order, old, new, clipIndex)
+            self._sceneKeys[sceneIndex] = _moved(keys, old, new, newKey)
+
+
+def _moved(values, old, new, value):
+    # A copy of values with the entry at old taken out and value put in where new was before that.
+    if new <= old:
+        return numpy.concatenate([values[:new], [value], values[new:old], values[old + 1:]])
+    return numpy.concatenate([values[:old], values[old + 1:new], [value], values[new:]])
@@ -0,0 +1,251 @@
+__author__ = 'bjarrett'
+
+import json
+import numpy
+from fractions import Fraction
+
+from zoic_api.logger import LOG
+from edllib import Clip, TimeCode, TimeCodeArray
+from edllib.edl import exactRate
+from moodlib.cache import sourceKey, loadSidecar, saveSidecar
+from moodlib.emotions import EMOTION_METRICS
+
+# Bump this when the snapshot layout changes so old snapshots are rebuilt.
+LIBRARY_VERSION = 2
+
+
+class MoodyClip(Clip):
+    def __init__(self, name):
+        super(MoodyClip, self).__init__(name)
+        self.concentrate = 0
+        self.mellow = 0
+        self.tags = set()
+        self.emotions = {}
+        self.lastUsedEnd = None
+
+
+def _csr(groups):
+    """
+    Packs lists of integers into offsets and one flat array, group i being flat[offsets[i]:offsets[i + 1]].
+    """
+    lengths = numpy.array([len(x) for x in groups], dtype=numpy.int64)
+    offsets = numpy.concatenate([[0], numpy.cumsum(lengths)]).astype(numpy.int64)
+    flat = numpy.array([x for group in groups for x in group], dtype=numpy.int64)
+    return offsets, flat
+
+
+def _projectFrames(startTcs, durations, clipRate, dropFrame, frameRate):
+    """
+    Converts clips recorded at their own frame rate to the project's. Start timecodes keep their label, hours to
+    seconds as they read with the frame scaled to the project rate, so the source timecodes in an EDL still match
+    the clip's own. Durations keep their length in seconds.
+    :return: start frames and durations at frameRate.
+    """
+    if clipRate == frameRate and not dropFrame:
+        return TimeCodeArray.fromStrings(startTcs, frameRate=frameRate).frames, durations
+    hours, minutes, seconds, frames = TimeCodeArray.fromStrings(startTcs, frameRate=clipRate,
+                                                                dropFrame=dropFrame).fields()
+    base = int(round(frameRate))
+    startFrames = ((hours * 60 + minutes) * 60 + seconds) * base + frames * base // int(round(clipRate))
+    scale = float(frameRate / clipRate)
+    return startFrames, numpy.floor(durations * scale + 0.5).astype(numpy.int64)
+
+
+def _invertCsr(offsets, flat, count):
+    """
+    Turns a group -> members index into a member -> groups index with count members.
+    """
+    groups = numpy.repeat(numpy.arange(len(offsets) - 1, dtype=numpy.int64), numpy.diff(offsets))
+    order = numpy.argsort(flat, kind='mergesort')
+    lengths = numpy.bincount(flat, minlength=count)
+    return numpy.concatenate([[0], numpy.cumsum(lengths)]).astype(numpy.int64), groups[order]
+
+
+class ClipLibrary(object):
+    """
+    A footage description held as arrays. Clip names are interned to integer ids, the position of the clip in the
+    arrays, and the per clip attributes are kept one array each. Tags and scenes are kept as index arrays: the clips
+    with tag t are tagClips[tagOffsets[t]:tagOffsets[t + 1]], and likewise for the clips in a scene and the tags of
+    a clip.
+
+    Loading checks every scene reference once and saves a snapshot of the arrays next to the json, which is used
+    instead of the json until the json changes.
+    """
+    ARRAYS = ('names', 'startFrames', 'durations', 'mellow', 'concentrate', 'emotions', 'tagNames', 'clipTagOffsets',
+              'clipTags', 'tagOffsets', 'tagClips', 'sceneLabels', 'sceneEndTimes', 'sceneOffsets', 'sceneClips')
+
+    def __init__(self, arrays, frameRate):
+        super(ClipLibrary, self).__init__()
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        self.frameRate = frameRate
+        self._ids = None
+        self._tagIds = None
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def load(cls, clipDescriptionPath, frameRate, useCache=True):
+        """
+        :param clipDescriptionPath: a footage description json.
+        :param frameRate: the frame rate the clip timecodes are in.
+        :param useCache: whether to read and write the snapshot.
+        """
+        key = sourceKey(clipDescriptionPath, LIBRARY_VERSION, frameRate)
+        arrays = loadSidecar(clipDescriptionPath, 'library', key) if useCache else None
+        if arrays is None:
+            with open(clipDescriptionPath, 'rb') as f:
+                description = json.load(f)
+            arrays = cls.parse(description, frameRate)
+            if useCache:
+                saveSidecar(clipDescriptionPath, 'library', key, arrays)
+        else:
+            LOG.debug('Loaded the clip library snapshot of %s', clipDescriptionPath)
+        return cls(arrays, frameRate)
+
+    @classmethod
+    def parse(cls, description, frameRate):
+        """
+        Builds the arrays from a parsed footage description, {"clips": {name: {...}}, "scenes": [...]}.
+        :return: a dict of name -> array.
+        """
+        clipInfos = description.get('clips')
+        scenes = description.get('scenes')
+        if not isinstance(clipInfos, dict) or not isinstance(scenes, list):
+            raise ValueError('A clip description needs a clips object and a scenes list')
+
+        names = sorted(clipInfos)
+        ids = dict((name, i) for i, name in enumerate(names))
+        infos = [clipInfos[name] for name in names]
+        for name, info in zip(names, infos):
+            missing = [x for x in ('start_tc', 'duration', 'mellow', 'concentrate') if x not in info]
+            if missing:
+                raise ValueError('Clip %s has no %s' % (name, ', '.join(missing)))
+
+        durations = numpy.array([x['duration'] for x in infos], dtype=numpy.int64)
+        if numpy.any(durations < 0):
+            raise ValueError('Clip %s has a negative duration' % names[numpy.flatnonzero(durations < 0)[0]])
+        # Scanned clips say the rate they were recorded at, their timecodes and durations are in its frames. Convert
+        # each group of clips at one rate and drop frame at a time.
+        groups = {}
+        for i, info in enumerate(infos):
+            if info.get('frame_rate'):
+                key = (exactRate(Fraction(info['frame_rate'])), ';' in info['start_tc'])
+            else:
+                key = (exactRate(frameRate), False)
+            groups.setdefault(key, []).append(i)
+        startFrames = numpy.zeros(len(infos), dtype=numpy.int64)
+        for (clipRate, dropFrame), members in groups.items():
+            members = numpy.array(members, dtype=numpy.int64)
+            try:
+                startFrames[members], durations[members] = _projectFrames(
+                    [infos[x]['start_tc'] for x in members], durations[members], clipRate, dropFrame,
+                    exactRate(frameRate))
+            except ValueError:
+                bad = [names[x] for x in members if len(infos[x]['start_tc'].replace(';', ':').split(':')) != 4]
+                if not bad:
+                    raise
+                raise ValueError('Clips have start timecodes that are not HH:MM:SS:FF: %s' % ', '.join(bad[:10]))
+        emotions = numpy.array([[info.get(metric, numpy.nan) for metric in EMOTION_METRICS] for info in infos],
+                               dtype=numpy.float64).reshape(len(infos), len(EMOTION_METRICS))
+
+        tagNames = sorted(set(tag for info in infos for tag in info.get('tags', [])))
+        tagIds = dict((tag, i) for i, tag in enumerate(tagNames))
+        clipTagOffsets, clipTags = _csr([sorted(set(tagIds[x] for x in info.get('tags', []))) for info in infos])
+        tagOffsets, tagClips = _invertCsr(clipTagOffsets, clipTags, len(tagNames))
+
+        sceneGroups = []
+        for scene in scenes:
+            missing = [x for x in scene['clips'] if x not in ids]
+            if missing:
+                raise ValueError('Scene %s uses unknown clips: %s' % (scene.get('label'), ', '.join(missing)))
+            sceneGroups.append([ids[x] for x in scene['clips']])
+        sceneOffsets, sceneClips = _csr(sceneGroups)
+
+        return {
+            'names': numpy.array(names, dtype=numpy.unicode_),
+            'startFrames': startFrames,
+            'durations': durations,
+            'mellow': numpy.array([x['mellow'] for x in infos], dtype=numpy.float64),
+            'concentrate': numpy.array([x['concentrate'] for x in infos], dtype=numpy.float64),
+            'emotions': emotions,
+            'tagNames': numpy.array(tagNames, dtype=numpy.unicode_),
+            'clipTagOffsets': clipTagOffsets,
+            'clipTags': clipTags,
+            'tagOffsets': tagOffsets,
+            'tagClips': tagClips,
+            'sceneLabels': numpy.array([x.get('label', '') for x in scenes], dtype=numpy.unicode_),
+            'sceneEndTimes': numpy.array([x['end_time'] for x in scenes], dtype=numpy.unicode_),
+            'sceneOffsets': sceneOffsets,
+            'sceneClips': sceneClips,
+        }
+
+    def clipId(self, name):
+        if self._ids is None:
+            self._ids = dict((x, i) for i, x in enumerate(self.names.tolist()))
+        if name not in self._ids:
+            raise ValueError('Unknown clip %s' % name)
+        return self._ids[name]
+
+    def clipsWithTag(self, tag):
+        """
+        :return: the ids of the clips with tag, empty for a tag no clip has.
+        """
+        if self._tagIds is None:
+            self._tagIds = dict((x, i) for i, x in enumerate(self.tagNames.tolist()))
+        tagId = self._tagIds.get(tag)
+        if tagId is None:
+            return numpy.zeros(0, dtype=numpy.int64)
+        return self.tagClips[self.tagOffsets[tagId]:self.tagOffsets[tagId + 1]]
+
+    def clipTagNames(self, clipId):
+        return self.tagNames[self.clipTags[self.clipTagOffsets[clipId]:self.clipTagOffsets[clipId + 1]]].tolist()
+
+    def sceneClipIds(self, sceneIndex):
+        return self.sceneClips[self.sceneOffsets[sceneIndex]:self.sceneOffsets[sceneIndex + 1]]
+
+    def sceneClipLists(self):
+        """
+        :return: an array of clip ids for each scene.
+        """
+        return [self.sceneClipIds(i) for i in range(len(self.sceneLabels))]
+
+    def scenes(self):
+        """
+        :return: the scenes as the dicts of the clip description.
+        """
+        names = self.names.tolist()
+        return [{'label': label, 'end_time': endTime, 'clips': [names[x] for x in self.sceneClipIds(i)]}
+                for i, (label, endTime) in enumerate(zip(self.sceneLabels.tolist(), self.sceneEndTimes.tolist()))]
+
+    def clips(self, clipClass=MoodyClip):
+        """
+        Builds a clip object for every clip, in id order.
+        :param clipClass: a Clip subclass taking the name, with mellow, concentrate, tags and emotions attributes.
+        """
+        clips = []
+        startFrames = self.startFrames.tolist()
+        durations = self.durations.tolist()
+        mellow = self.mellow.tolist()
+        concentrate = self.concentrate.tolist()
+        for i, name in enumerate(self.names.tolist()):
+            clip = clipClass(name)
+            clip.startTc = TimeCode.fromFrame(startFrames[i], frameRate=self.frameRate)
+            clip.duration = durations[i]
+            clip.mellow = mellow[i]
+            clip.concentrate = concentrate[i]
+            clip.tags = set()
+            clip.emotions = {}
+            clips.append(clip)
+
+        # Fill tags and emotions a tag or metric at a time, only touching the clips that have them.
+        for tagId, tag in enumerate(self.tagNames.tolist()):
+            for clipId in self.tagClips[self.tagOffsets[tagId]:self.tagOffsets[tagId + 1]].tolist():
+                clips[clipId].tags.add(tag)
+        for column, metric in enumerate(EMOTION_METRICS):
+            values = self.emotions[:, column]
+            clipIds = numpy.flatnonzero(~numpy.isnan(values))
+            for clipId, value in zip(clipIds.tolist(), values[clipIds].tolist()):
+                clips[clipId].emotions[metric] = value
+        return clips
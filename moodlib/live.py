@@ -0,0 +1,650 @@
+__author__ = 'bjarrett'
+
+import bisect
+import collections
+import csv
+import json
+import math
+import socket
+import struct
+import threading
+import time
+import numpy
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from zoic_api.logger import LOG
+from edllib import TimeCodeArray
+from moodlib.align import resample, DEFAULT_GRID_RATE, DEFAULT_MAX_GAP
+from moodlib.csvcolumns import parseFloats, toSeconds
+from moodlib.cuts import CutDecider
+from moodlib.eeg import readEegData, EEG_TIME_COLUMN
+from moodlib.emotions import readEmotionData, emotionColumn, EMOTION_METRICS, CSV_TIME_COLUMNS
+from moodlib.scenes import SceneTimeline
+from moodlib.scoring import ClipScorer
+
+# The signal names samples are filed under, the same names createCuts averages.
+EEG_SIGNALS = (('Mellow', 'mellow'), ('Concentration', 'concentrate'))
+
+# OSC addresses muse-io sends the experimental mellow and concentration values on. Affdex metrics are expected on
+# /affdex/<metric>, e.g. /affdex/joy.
+OSC_SIGNALS = {
+    '/muse/elements/experimental/mellow': 'mellow',
+    '/muse/elements/experimental/concentration': 'concentrate',
+}
+OSC_AFFDEX_PREFIX = '/affdex/'
+
+# How long blocking waits are, so sources and the session notice being stopped.
+POLL_SECONDS = 0.1
+
+# Put on the queue by a source when it has nothing more to send.
+_DONE = object()
+
+
+class SessionClock(object):
+    """
+    Seconds since the session started. A replay can run the clock faster than real time with speed.
+    """
+    def __init__(self, speed=1.0):
+        super(SessionClock, self).__init__()
+        if speed <= 0:
+            raise ValueError('The clock speed must be positive')
+        self.speed = float(speed)
+        self.start = time.time()
+
+    def reset(self):
+        self.start = time.time()
+
+    def now(self):
+        return (time.time() - self.start) * self.speed
+
+    def wallUntil(self, sessionTime):
+        """
+        :return: the real seconds until the clock reaches sessionTime, negative once it has passed.
+        """
+        return (sessionTime - self.now()) / self.speed
+
+
+class LiveSource(threading.Thread):
+    """
+    A thread feeding (signal name, session time, value) samples into a live session's queue. Subclasses implement
+    produce, which should return once stopped is set.
+    """
+    def __init__(self):
+        super(LiveSource, self).__init__()
+        self.daemon = True
+        self.queue = None
+        self.clock = None
+        self.stopped = threading.Event()
+        self.error = None
+        # Session time before which every sample has been put on the queue, and whether everything has been.
+        self._sentUntil = 0.
+        self.finished = False
+
+    def sentUntil(self):
+        """
+        :return: the session time every sample before has been put on the queue by.
+        """
+        return float('inf') if self.finished else self._sentUntil
+
+    def attach(self, sampleQueue, clock):
+        self.queue = sampleQueue
+        self.clock = clock
+
+    def push(self, name, sampleTime, value):
+        self.queue.put((name, sampleTime, value))
+
+    def run(self):
+        try:
+            self.produce()
+        except Exception as e:
+            self.error = e
+            LOG.exception('Live source %s failed', self.name)
+        finally:
+            self.finished = True
+            self.queue.put(_DONE)
+
+    def produce(self):
+        raise NotImplementedError()
+
+    def stop(self):
+        self.stopped.set()
+
+
+def decodeOsc(packet):
+    """
+    Decodes an OSC packet into (address, arguments) messages. Bundles are flattened and their time tags ignored,
+    samples are timed by when they arrive. Only int, float and string arguments are understood.
+    """
+    def readString(data, pos):
+        end = data.index(b'\0', pos)
+        return data[pos:end].decode('ascii'), (end + 4) & ~3
+
+    if packet.startswith(b'#bundle\0'):
+        messages = []
+        pos = 16
+        while pos + 4 <= len(packet):
+            size, = struct.unpack('>i', packet[pos:pos + 4])
+            messages.extend(decodeOsc(packet[pos + 4:pos + 4 + size]))
+            pos += 4 + size
+        return messages
+
+    address, pos = readString(packet, 0)
+    if pos >= len(packet):
+        return [(address, [])]
+    tags, pos = readString(packet, pos)
+    args = []
+    for tag in tags[1:]:
+        if tag == 'f':
+            args.append(struct.unpack('>f', packet[pos:pos + 4])[0])
+            pos += 4
+        elif tag == 'd':
+            args.append(struct.unpack('>d', packet[pos:pos + 8])[0])
+            pos += 8
+        elif tag == 'i':
+            args.append(struct.unpack('>i', packet[pos:pos + 4])[0])
+            pos += 4
+        elif tag == 's':
+            value, pos = readString(packet, pos)
+            args.append(value)
+        else:
+            raise ValueError('Unsupported OSC argument type %s' % tag)
+    return [(address, args)]
+
+
+class UdpSource(LiveSource):
+    """
+    Listens for OSC messages from muse-io and an Affdex bridge on a local UDP port.
+    """
+    def __init__(self, port, host='127.0.0.1'):
+        super(UdpSource, self).__init__()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.socket.settimeout(POLL_SECONDS)
+        self.ignored = 0
+
+    def produce(self):
+        try:
+            while not self.stopped.is_set():
+                # Packets are timed by when they arrive, so anything that arrives from here on is later than this.
+                self._sentUntil = self.clock.now()
+                try:
+                    packet, address = self.socket.recvfrom(65536)
+                except socket.timeout:
+                    continue
+                arrived = self.clock.now()
+                try:
+                    messages = decodeOsc(packet)
+                except (ValueError, struct.error):
+                    self.ignored += 1
+                    continue
+                for address, args in messages:
+                    name = OSC_SIGNALS.get(address)
+                    if name is None and address.startswith(OSC_AFFDEX_PREFIX):
+                        name = address[len(OSC_AFFDEX_PREFIX):]
+                    if name is None or not args:
+                        self.ignored += 1
+                        continue
+                    self.push(name, arrived, float(args[0]))
+        finally:
+            self.socket.close()
+
+
+class TailSource(LiveSource):
+    """
+    Follows a Muse or Affdex csv as it is being written, like tail -f. Rows are timed from the file's first row, so
+    the recording should start with the session.
+    """
+    def __init__(self, path, kind):
+        """
+        :param path: the csv being written.
+        :param kind: 'eeg' for a Muse csv or 'emotion' for an Affdex csv.
+        """
+        super(TailSource, self).__init__()
+        if kind not in ('eeg', 'emotion'):
+            raise ValueError('Unknown csv kind %s' % kind)
+        self.path = path
+        self.kind = kind
+        self.firstTime = None
+
+    def _lines(self, f):
+        """
+        Yields complete lines as they are written, waiting at the end of the file for more.
+        """
+        partial = ''
+        while not self.stopped.is_set():
+            checked = self.clock.now()
+            line = f.readline()
+            if not line:
+                # Rows are written as the session goes, so every row timed before checked has been read.
+                if not partial:
+                    self._sentUntil = max(self._sentUntil, checked)
+                self.stopped.wait(POLL_SECONDS)
+                continue
+            partial += line
+            if partial.endswith('\n'):
+                yield partial
+                partial = ''
+
+    def _columns(self, headers):
+        """
+        :return: the time column and a list of (column index, signal name).
+        """
+        if self.kind == 'eeg':
+            if EEG_TIME_COLUMN not in headers:
+                raise ValueError('No %s column in %s' % (EEG_TIME_COLUMN, self.path))
+            return headers.index(EEG_TIME_COLUMN), [(headers.index(column), name) for column, name in EEG_SIGNALS]
+        timeColumns = [x for x in CSV_TIME_COLUMNS if x in headers]
+        if not timeColumns:
+            raise ValueError('No timestamp column in %s' % self.path)
+        columns = [(headers.index(emotionColumn(metric, headers)), metric) for metric in EMOTION_METRICS]
+        return headers.index(timeColumns[0]), columns
+
+    def _seconds(self, cell):
+        seconds = float(toSeconds([cell])[0])
+        # Affdex times are in milliseconds.
+        return seconds / 1000. if self.kind == 'emotion' else seconds
+
+    def produce(self):
+        while not self.stopped.is_set() and not self._exists():
+            self.stopped.wait(POLL_SECONDS)
+        with open(self.path, 'r') as f:
+            lines = self._lines(f)
+            header = next(lines, None)
+            if header is None:
+                return
+            timeColumn, columns = self._columns([x.strip() for x in next(csv.reader([header]))])
+            for line in lines:
+                row = next(csv.reader([line]), None)
+                if not row or len(row) <= max([timeColumn] + [x[0] for x in columns]):
+                    continue
+                seconds = self._seconds(row[timeColumn])
+                if self.firstTime is None:
+                    self.firstTime = seconds
+                values = parseFloats([row[index] for index, name in columns], numpy.float64)
+                for (index, name), value in zip(columns, values):
+                    self.push(name, seconds - self.firstTime, value)
+                self._sentUntil = max(self._sentUntil, seconds - self.firstTime)
+
+    def _exists(self):
+        try:
+            open(self.path, 'r').close()
+            return True
+        except IOError:
+            return False
+
+
+class ReplaySource(LiveSource):
+    """
+    Plays back a recorded Muse csv and/or Affdex export, sending each sample when the session clock reaches its
+    timestamp. Stands in for a live feed when testing offline.
+    """
+    def __init__(self, eegPath=None, emotionPath=None):
+        super(ReplaySource, self).__init__()
+        if eegPath is None and emotionPath is None:
+            raise ValueError('Nothing to replay')
+        times = []
+        names = []
+        values = []
+        if eegPath is not None:
+            seconds, mellow, concentration = readEegData(eegPath)
+            for name, column in (('mellow', mellow), ('concentrate', concentration)):
+                times.append(seconds)
+                names.extend([name] * len(seconds))
+                values.append(column)
+        if emotionPath is not None:
+            seconds, emotions = readEmotionData(emotionPath, EMOTION_METRICS)
+            for name, column in emotions.items():
+                times.append(seconds)
+                names.extend([name] * len(seconds))
+                values.append(column)
+        times = numpy.concatenate(times)
+        self.order = numpy.argsort(times, kind='mergesort')
+        self.times = times
+        self.names = names
+        self.values = numpy.concatenate(values).astype(numpy.float64)
+
+    def produce(self):
+        for i in self.order:
+            sampleTime = self.times[i]
+            # The samples are sent in time order, so everything before this one has been.
+            self._sentUntil = sampleTime
+            wait = self.clock.wallUntil(sampleTime)
+            if wait > 0 and self.stopped.wait(wait):
+                return
+            if self.stopped.is_set():
+                return
+            self.push(self.names[i], sampleTime, self.values[i])
+
+
+class RollingSignal(object):
+    """
+    One signal as its samples arrive, resampled onto the same fixed grid a batch cut aligns signals onto (see
+    AlignedSignals.fixed), with running sums over the grid in the same order so a window mean comes out exactly as
+    it does there. A grid point is only filled in once the sample after it has arrived, or once every sample up to
+    maxGap past the one before it has been sent, so it is known to be in a gap. Samples and sums no longer needed
+    are thrown away now and then to bound memory.
+    """
+    def __init__(self, rate=DEFAULT_GRID_RATE, maxGap=DEFAULT_MAX_GAP):
+        super(RollingSignal, self).__init__()
+        self.rate = rate
+        self.maxGap = maxGap
+        # The non NaN samples that arrived, NaN samples are dropped by resample anyway.
+        self.times = []
+        self.values = []
+        # Running sums over the grid points filled in so far, the first being for grid point _firstPoint.
+        self._firstPoint = 0
+        self._sums = [0.]
+        self._counts = [0]
+        # Samples that arrived older than the newest one, which can't go back into the grid.
+        self.outOfOrder = 0
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def filled(self):
+        """
+        How many grid points have been filled in.
+        """
+        return self._firstPoint + len(self._sums) - 1
+
+    def point(self, sampleTime):
+        """
+        :return: the index of the first grid point at or after sampleTime, as SignalWindowIndex finds it.
+        """
+        return max(0, int(math.ceil(sampleTime * self.rate - 1e-9)))
+
+    def append(self, sampleTime, value):
+        if numpy.isnan(value) or numpy.isnan(sampleTime):
+            return
+        if self.times and sampleTime < self.times[-1]:
+            self.outOfOrder += 1
+            return
+        self.times.append(sampleTime)
+        self.values.append(value)
+
+    def fill(self, end, sentUntil):
+        """
+        Fills in the grid points before end that can be worked out yet.
+        :param end: the grid point to fill in up to.
+        :param sentUntil: the session time every sample before has arrived by, see LiveSource.sentUntil.
+        :return: whether every point before end is filled in.
+        """
+        if self.filled >= end:
+            return True
+        # Points up to the newest sample are between two samples. Once nothing more arrived within maxGap of it, the
+        # points after it up to sentUntil are in a gap whatever comes next.
+        limit = 0
+        if self.times:
+            limit = self.point(self.times[-1])
+            if limit / float(self.rate) <= self.times[-1]:
+                limit += 1
+        if not self.times or sentUntil > self.times[-1] + self.maxGap:
+            limit = max(limit, self.point(sentUntil)) if sentUntil < float('inf') else end
+        limit = min(limit, end)
+        if limit > self.filled:
+            grid = numpy.arange(self.filled, limit, dtype=numpy.float64) / self.rate
+            # Only the samples either side of the new points matter.
+            lo = max(0, bisect.bisect_right(self.times, grid[0]) - 1)
+            hi = bisect.bisect_left(self.times, grid[-1]) + 1
+            values = resample(self.times[lo:hi], self.values[lo:hi], grid, maxGap=self.maxGap)
+            for value in values.tolist():
+                valid = value == value
+                self._sums.append(self._sums[-1] + (value if valid else 0.))
+                self._counts.append(self._counts[-1] + valid)
+        return self.filled >= end
+
+    def mean(self, start, end):
+        """
+        The mean of the non NaN grid values in [start, end), NaN if there are none. The grid must be filled in up to
+        end.
+        """
+        lo = self.point(start) - self._firstPoint
+        hi = max(lo, self.point(end) - self._firstPoint)
+        if lo < 0 or hi >= len(self._sums):
+            raise ValueError('The grid is not filled in over %g to %g seconds' % (start, end))
+        count = self._counts[hi] - self._counts[lo]
+        if not count:
+            return numpy.nan
+        return (self._sums[hi] - self._sums[lo]) / count
+
+    def discardBefore(self, sampleTime):
+        # The sums are kept from the point windows can next start at, the samples from the one before the next
+        # point to fill in.
+        dropSums = self.point(sampleTime) - self._firstPoint
+        dropSamples = bisect.bisect_right(self.times, self.filled / float(self.rate)) - 1
+        # Only trim once a good part of a list can go, so trimming stays cheap overall.
+        if dropSums >= 1024 and dropSums * 2 >= len(self._sums):
+            del self._sums[:dropSums]
+            del self._counts[:dropSums]
+            self._firstPoint += dropSums
+        if dropSamples >= 1024 and dropSamples * 2 >= len(self.times):
+            del self.times[:dropSamples]
+            del self.values[:dropSamples]
+
+
+class LiveMetrics(object):
+    """
+    How a live session is keeping up: how many samples are waiting in the queue when each beat is decided and how
+    long after its beat each decision was made.
+    """
+    def __init__(self):
+        super(LiveMetrics, self).__init__()
+        self.samples = collections.Counter()
+        self.lateSamples = 0
+        self.decisions = 0
+        self.queueDepth = 0
+        self.maxQueueDepth = 0
+        self.lastLatency = 0.
+        self.maxLatency = 0.
+        self.totalLatency = 0.
+
+    def decided(self, queueDepth, latency):
+        self.decisions += 1
+        self.queueDepth = queueDepth
+        self.maxQueueDepth = max(self.maxQueueDepth, queueDepth)
+        self.lastLatency = latency
+        self.maxLatency = max(self.maxLatency, latency)
+        self.totalLatency += latency
+
+    def summary(self):
+        return {
+            'decisions': self.decisions,
+            'samples': dict(self.samples),
+            'late_samples': self.lateSamples,
+            'queue_depth': self.queueDepth,
+            'max_queue_depth': self.maxQueueDepth,
+            'last_latency': self.lastLatency,
+            'max_latency': self.maxLatency,
+            'mean_latency': self.totalLatency / self.decisions if self.decisions else 0.,
+        }
+
+
+class EdlSink(object):
+    """
+    Writes each cut to an EDLWriter and flushes it straight away so the file is always current.
+    """
+    def __init__(self, writer):
+        super(EdlSink, self).__init__()
+        self.writer = writer
+
+    def emit(self, cut, message):
+        self.writer.addCut(cut.clip,
+                           clipStart=cut.clipStart,
+                           clipEnd=cut.clipEnd,
+                           timeLineStart=cut.timeLineStart,
+                           timeLineEnd=cut.timeLineEnd)
+        self.writer.flush()
+
+
+class JsonSink(object):
+    """
+    Writes each cut as a line of json to a stream.
+    """
+    def __init__(self, stream):
+        super(JsonSink, self).__init__()
+        self.stream = stream
+
+    def emit(self, cut, message):
+        self.stream.write(json.dumps(message, sort_keys=True) + '\n')
+        self.stream.flush()
+
+
+class LiveSession(object):
+    """
+    Makes cuts as the viewer's EEG and emotion samples arrive. Sources feed samples into a queue from their own
+    threads; the session files them into rolling signals and decides each beat as soon as the section it averages
+    over has closed, plus grace seconds for stragglers. A beat's decision is made
+    (round(beat) + 1 - beat) + grace seconds of session time after the beat, or sooner once every source is done,
+    and then only once every signal's grid is filled in over the section, which can take up to the signals' maxGap
+    longer when a signal has gone quiet. With a seed every beat draws its randomness as a batch cut with the same
+    seed does, so replaying a recording makes the same edit as generate.
+    """
+    def __init__(self, scenes, clips, beats, frameRate, seed=None, grace=0.25, clock=None):
+        super(LiveSession, self).__init__()
+        self.clips = clips
+        self.seed = seed
+        self.grace = grace
+        self.clock = clock or SessionClock()
+        self.queue = queue.Queue()
+        self.sources = []
+        self.signals = collections.defaultdict(RollingSignal)
+        self.metrics = LiveMetrics()
+
+        self.beats = numpy.asarray(beats, dtype=numpy.float64)
+        self.beatFrames = TimeCodeArray.fromSeconds(self.beats, frameRate=frameRate).frames
+        self.beatLasts = numpy.floor(self.beats + 0.5).astype(numpy.int64)
+        self.timeline = SceneTimeline(scenes, clips, frameRate=frameRate)
+        self.beatScenes = self.timeline.sceneIndices(self.beats)
+        self.decider = CutDecider(clips, self.timeline, ClipScorer(clips, seed=seed), frameRate=frameRate)
+
+        self._running = 0
+        # Samples before this have had their beat decided already.
+        self._closedBefore = 0
+
+    def addSource(self, source):
+        source.attach(self.queue, self.clock)
+        self.sources.append(source)
+
+    def _handle(self, item):
+        if item is _DONE:
+            self._running -= 1
+            return
+        name, sampleTime, value = item
+        self.metrics.samples[name] += 1
+        if sampleTime < self._closedBefore:
+            self.metrics.lateSamples += 1
+        self.signals[name].append(sampleTime, value)
+
+    def _drainUntil(self, deadline):
+        """
+        Files samples from the queue until the clock passes deadline and the queue is empty, or every source is done.
+        """
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                if not self._running:
+                    return
+                wait = self.clock.wallUntil(deadline)
+                if wait <= 0:
+                    return
+                try:
+                    item = self.queue.get(timeout=min(wait, POLL_SECONDS))
+                except queue.Empty:
+                    continue
+            self._handle(item)
+
+    def _fillUntil(self, end):
+        """
+        Files samples until every signal's grid is filled in before end seconds.
+        """
+        while True:
+            # Everything sent before reading this is on the queue, so file the queue before filling in.
+            sentUntil = min([x.sentUntil() for x in self.sources] or [float('inf')])
+            while True:
+                try:
+                    self._handle(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if all(x.fill(x.point(end), sentUntil) for x in self.signals.values()):
+                return
+            try:
+                self._handle(self.queue.get(timeout=POLL_SECONDS))
+            except queue.Empty:
+                pass
+
+    def decideBeat(self, beatIndex):
+        """
+        :return: the cut made on the beat and its json message, or None if the clip playing is held.
+        """
+        beatTime = self.beats[beatIndex]
+        if self.seed is not None:
+            self.decider.scorer.seedBeat(self.seed, beatIndex)
+        first = self.decider.sectionStart
+        last = int(self.beatLasts[beatIndex])
+        averages = dict((name, signal.mean(first, last + 1)) for name, signal in self.signals.items())
+
+        sceneIndex = self.beatScenes[beatIndex]
+        if sceneIndex < 0:
+            raise ValueError('There is no scene for the beat at %.2f seconds' % beatTime)
+        cut = self.decider.decide(self.beatFrames[beatIndex], sceneIndex, averages, sectionEnd=last)
+
+        latency = max(0., self.clock.now() - beatTime) / self.clock.speed
+        self.metrics.decided(self.queue.qsize(), latency)
+        self._closedBefore = last + 1
+        for signal in self.signals.values():
+            signal.discardBefore(self.decider.sectionStart)
+        LOG.debug('Beat %d at %.2f: %s, queue depth %d, latency %.3fs', beatIndex, beatTime,
+                  self.clips[self.decider.chosenIndex].name, self.metrics.queueDepth, latency)
+        if cut is None:
+            return None
+
+        message = {
+            'beat': beatIndex,
+            'time': float(beatTime),
+            'clip': cut.clip.name,
+            'clip_start': str(cut.clipStart),
+            'clip_end': str(cut.clipEnd),
+            'record_start': str(cut.timeLineStart),
+            'record_end': str(cut.timeLineEnd),
+            'latency': latency,
+            'queue_depth': self.metrics.queueDepth,
+        }
+        return cut, message
+
+    def run(self, sinks):
+        """
+        Starts the sources and cuts every beat, handing each cut to the sinks as it is made.
+        :return: the session's metrics summary.
+        """
+        self.clock.reset()
+        self._running = len(self.sources)
+        for source in self.sources:
+            source.start()
+        try:
+            for beatIndex, beatTime in enumerate(self.beats):
+                windowEnd = self.beatLasts[beatIndex] + 1
+                self._drainUntil(max(beatTime, windowEnd) + self.grace)
+                self._fillUntil(windowEnd)
+                decision = self.decideBeat(beatIndex)
+                if decision is None:
+                    continue
+                cut, message = decision
+                for sink in sinks:
+                    sink.emit(cut, message)
+        finally:
+            for source in self.sources:
+                source.stop()
+            for source in self.sources:
+                source.join(POLL_SECONDS * 10)
+
+        summary = self.metrics.summary()
+        LOG.info('Live session made %d decisions from %d samples, max queue depth %d, latency mean %.3fs max %.3fs',
+                 summary['decisions'], sum(summary['samples'].values()), summary['max_queue_depth'],
+                 summary['mean_latency'], summary['max_latency'])
+        return summary
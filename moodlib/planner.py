@@ -0,0 +1,257 @@
+__author__ = 'bjarrett'
+
+import numpy
+
+from edllib import TimeCode
+from moodlib.cuts import Cut, CutDecider
+from moodlib.footage import FootageIndex
+from moodlib.scoring import BeatScores
+
+# Scores at or below this are as bad as each other, it keeps -log finite.
+MIN_SCORE = 1e-6
+
+
+class CutPlanner(object):
+    """
+    Plans the cuts for a whole song at once instead of beat by beat. Each beat is given to one clip and the
+    assignment minimises the summed cost over the song with a Viterbi pass:
+
+    - playing a clip on a beat costs -log of its score against that beat's targets, plus its share of the clip's
+      footage, so short clips aren't leaned on;
+    - holding a clip costs the same log penalty the greedy scorer applies, growing with how long it has been held,
+      and a clip can't be held past sameClipBeatLimit beats or past the end of its footage;
+    - cutting costs cutCost, except on the first beat of a scene where cuts are free and holding costs
+      sceneHoldCost instead.
+
+    A state is a (clip, beats held) pair. Cutting to a clip can come from any other clip, so the best way in is
+    the best state overall unless that state is the same clip, in which case it is the best state of any other
+    clip; keeping the top two makes each beat linear in the number of states. With beam set only that many of the
+    cheapest states are carried from beat to beat, which is faster and usually close to optimal.
+
+    Footage used by earlier runs of a clip isn't part of the state. Instead the plan is made over a few passes and
+    after each one every clip the plan used more footage from than it has is charged a little more per frame,
+    which pushes the next pass onto other clips. The pass that overdraws the least footage is kept, and the rest of
+    the song is planned again from any run that would take more footage than its clip has left by then, with the
+    footage that is left. So no run of the final plan is longer than its clip's remaining footage.
+    """
+    def __init__(self, clips, timeline, scorer, frameRate, slateFrames=CutDecider.SLATE_FRAMES,
+                 sameClipBeatLimit=CutDecider.SAME_CLIP_BEAT_LIMIT, beam=None, cutCost=0.1, sceneHoldCost=1.0,
+                 footageWeight=1.0, passes=3, footage=None, markClips=True):
+        """
+        :param clips: the list of clips.
+        :param timeline: the SceneTimeline for the clips.
+        :param scorer: the ClipScorer for the clips, its jitter is applied to the scores once up front.
+        :param frameRate: the frame rate of the timeline.
+        :param beam: how many states to carry between beats, None for all of them.
+        :param passes: how many times to plan, repricing overdrawn clips in between.
+        :param footage: a FootageIndex of the footage left to plan with, by default made from the clips.
+        :param markClips: whether to set lastUsedEnd on the clips used, see CutDecider.
+        """
+        super(CutPlanner, self).__init__()
+        if beam is not None and beam < 2:
+            raise ValueError('The beam must be at least 2 wide')
+        self.clips = clips
+        self.timeline = timeline
+        self.scorer = scorer
+        self.frameRate = frameRate
+        self.slateFrames = slateFrames
+        self.sameClipBeatLimit = sameClipBeatLimit
+        self.beam = beam
+        self.cutCost = cutCost
+        self.sceneHoldCost = sceneHoldCost
+        self.footageWeight = footageWeight
+        self.passes = passes
+        self.markClips = markClips
+        self.footage = footage or FootageIndex(clips, timeline.sceneClips, slateFrames=slateFrames)
+
+        # How many times the rest of the song had to be planned again because a run's clip had run out of footage.
+        self.replans = 0
+        # The total cost of the last plan, and how many frames more than they have the pass it was made from took
+        # from clips before it was replanned.
+        self.cost = None
+        self.overdrawn = None
+        # The clip each beat ended up on once the plan was turned into cuts.
+        self.beatClips = None
+
+    def _emissions(self, beatScores):
+        """
+        :return: for each beat, the cost of each of its scene's clips, ordered like the scene's clip array.
+        """
+        emissions = [None] * len(beatScores.beatScenes)
+        for sceneIndex, beatIndices, scores in beatScores.blocks():
+            scores = self.scorer.jitter(scores)
+            costs = -numpy.log(numpy.maximum(scores, MIN_SCORE))
+            for row, beatIndex in enumerate(beatIndices):
+                emissions[beatIndex] = costs[row]
+        return emissions
+
+    def plan(self, beatFrames, beatScenes, targets, beatScores=None):
+        """
+        :param beatFrames: the timeline frame of each beat.
+        :param beatScenes: the scene index of each beat.
+        :param targets: a (beats, metrics) array of targets, see ClipScorer.targets.
+        :param beatScores: the BeatScores for the targets if they have already been worked out.
+        :return: the clip index playing on each beat.
+        """
+        beatFrames = numpy.asarray(beatFrames, dtype=numpy.int64)
+        beatScenes = numpy.asarray(beatScenes, dtype=numpy.int64)
+        if numpy.any(beatScenes < 0):
+            raise ValueError('There is no scene for the beat at frame %d' % beatFrames[beatScenes < 0][0])
+        # Beat b's footage runs from the previous beat, or the first frame, up to its own frame.
+        segmentStarts = numpy.concatenate([[1], beatFrames[:-1]])
+        lengths = beatFrames - segmentStarts
+
+        usable = self.footage.ends - self.footage.nextStarts
+        if beatScores is None:
+            beatScores = BeatScores(self.scorer, self.timeline, beatScenes, targets)
+        emissions = self._emissions(beatScores)
+
+        # The extra cost per frame of each clip, raised on clips a pass overdraws.
+        prices = numpy.zeros(len(self.clips), dtype=numpy.float64)
+        best = None
+        for i in range(max(1, self.passes)):
+            plan, pathCosts = self._plan(beatFrames, beatScenes, segmentStarts, lengths, usable, emissions, prices)
+            used = numpy.bincount(plan, weights=lengths, minlength=len(self.clips))
+            overdrawn = numpy.maximum(used - usable, 0)
+            if best is None or overdrawn.sum() < best[2]:
+                best = (plan, pathCosts, overdrawn.sum(), prices.copy())
+            if not overdrawn.any():
+                break
+            prices += self.footageWeight * overdrawn / numpy.maximum(usable, 1) / max(lengths.mean(), 1)
+        plan, pathCosts, self.overdrawn, prices = best
+
+        # Take the footage for each run in turn, planning the rest of the song again with what is left whenever a
+        # run needs more than its clip still has.
+        self.replans = 0
+        remaining = usable.copy()
+        first = 0
+        while first < len(plan):
+            clipIndex = plan[first]
+            last = first
+            while last + 1 < len(plan) and plan[last + 1] == clipIndex:
+                last += 1
+            length = beatFrames[last] - segmentStarts[first]
+            if length > remaining[clipIndex]:
+                previousClip = plan[first - 1] if first else -1
+                plan[first:], tailCosts = self._plan(beatFrames, beatScenes, segmentStarts, lengths, remaining,
+                                                     emissions, prices, start=first, excludeClip=previousClip)
+                pathCosts[first:] = tailCosts + (pathCosts[first - 1] if first else 0.)
+                self.replans += 1
+                continue
+            remaining[clipIndex] -= length
+            first = last + 1
+        self.cost = float(pathCosts[-1]) if len(pathCosts) else 0.
+        return plan
+
+    def _plan(self, beatFrames, beatScenes, segmentStarts, lengths, usable, emissions, prices, start=0,
+              excludeClip=-1):
+        """
+        One Viterbi pass over the beats from start on.
+        :param excludeClip: a clip the first beat can't be given to, the one playing on the beat before start.
+        :return: the clip index playing on each of those beats and the plan's cost up to each of them.
+        """
+        beatCount = len(beatFrames)
+        holdCosts = -numpy.log(self.scorer.reusePenalty(numpy.arange(self.sameClipBeatLimit + 2)))
+
+        history = []
+        stateClips = stateRuns = values = None
+        for beatIndex in range(start, beatCount):
+            sceneClips = self.timeline.sceneClips[beatScenes[beatIndex]]
+            costs = (emissions[beatIndex] + lengths[beatIndex] *
+                     (self.footageWeight / numpy.maximum(usable[sceneClips], 1) + prices[sceneClips]))
+            costs = numpy.where(usable[sceneClips] >= lengths[beatIndex], costs, numpy.inf)
+
+            if beatIndex == start:
+                # Picking up after an earlier beat is a cut away from the clip that was playing on it.
+                costs = numpy.where(sceneClips == excludeClip, numpy.inf, costs)
+                if start and beatScenes[start] == beatScenes[start - 1]:
+                    costs = costs + self.cutCost
+                newClips = sceneClips
+                newRuns = numpy.zeros(len(sceneClips), dtype=numpy.int64)
+                newValues = costs
+                parents = numpy.empty(len(sceneClips), dtype=numpy.int64)
+                parents.fill(-1)
+            else:
+                boundary = beatScenes[beatIndex] != beatScenes[beatIndex - 1]
+
+                # Hold each state's clip for another beat.
+                position = self.timeline.clipPositions[beatScenes[beatIndex]][stateClips]
+                heldRuns = stateRuns + 1
+                runStarts = segmentStarts[numpy.maximum(beatIndex - heldRuns, 0)]
+                holdable = ((position >= 0) & (heldRuns <= self.sameClipBeatLimit) &
+                            (beatFrames[beatIndex] - runStarts <= usable[stateClips]))
+                holdFrom = numpy.flatnonzero(holdable)
+                holdValues = (values[holdFrom] + holdCosts[heldRuns[holdFrom]] + costs[position[holdFrom]] +
+                              (self.sceneHoldCost if boundary else 0.))
+
+                # Cut to each of the scene's clips from the best state of any other clip.
+                best = numpy.argmin(values)
+                others = numpy.flatnonzero(stateClips != stateClips[best])
+                second = others[numpy.argmin(values[others])] if len(others) else -1
+                cutFrom = numpy.where(sceneClips == stateClips[best], second, best)
+                cutValues = numpy.where(cutFrom >= 0, values[cutFrom], numpy.inf) + costs
+                if not boundary:
+                    cutValues += self.cutCost
+
+                newClips = numpy.concatenate([stateClips[holdFrom], sceneClips])
+                newRuns = numpy.concatenate([heldRuns[holdFrom], numpy.zeros(len(sceneClips), dtype=numpy.int64)])
+                newValues = numpy.concatenate([holdValues, cutValues])
+                parents = numpy.concatenate([holdFrom, cutFrom])
+
+            keep = numpy.isfinite(newValues)
+            if self.beam is not None and keep.sum() > self.beam:
+                keep = numpy.argpartition(numpy.where(keep, newValues, numpy.inf), self.beam - 1)[:self.beam]
+            else:
+                keep = numpy.flatnonzero(keep)
+            if not len(keep):
+                raise ValueError('No clip can cover the beat at frame %d' % beatFrames[beatIndex])
+            stateClips = newClips[keep]
+            stateRuns = newRuns[keep]
+            values = newValues[keep]
+            history.append((stateClips, parents[keep], values))
+
+        # Walk back from the cheapest final state.
+        state = numpy.argmin(values)
+        plan = numpy.empty(beatCount - start, dtype=numpy.int64)
+        pathCosts = numpy.empty(beatCount - start, dtype=numpy.float64)
+        for i in range(beatCount - start - 1, -1, -1):
+            clipIndices, parents, beatValues = history[i]
+            plan[i] = clipIndices[state]
+            pathCosts[i] = beatValues[state]
+            state = parents[state]
+        return plan, pathCosts
+
+    def cuts(self, beatFrames, beatScenes, targets, plan):
+        """
+        Turns a plan into cuts, one per run of beats on the same clip, taking footage from each clip in turn.
+        :param plan: a plan from plan(), which never takes more footage from a clip than it has.
+        :return: a list of Cuts.
+        """
+        beatFrames = numpy.asarray(beatFrames, dtype=numpy.int64)
+        footage = self.footage.copy()
+        segmentStarts = numpy.concatenate([[1], beatFrames[:-1]])
+        runStarts = numpy.flatnonzero(numpy.concatenate([[True], plan[1:] != plan[:-1]]))
+        runEnds = numpy.concatenate([runStarts[1:], [len(plan)]]) - 1
+
+        cuts = []
+        self.beatClips = numpy.array(plan, dtype=numpy.int64)
+        for first, last in zip(runStarts, runEnds):
+            clipIndex = plan[first]
+            timeLineStart = segmentStarts[first]
+            length = beatFrames[last] - timeLineStart
+            if footage.remaining(clipIndex) < length:
+                raise ValueError('The plan takes %d frames from %s, which only has %d left' %
+                                 (length, self.clips[clipIndex].name, footage.remaining(clipIndex)))
+
+            clip = self.clips[clipIndex]
+            clipStartFrame = footage.nextStarts[clipIndex]
+            footage.use(clipIndex, clipStartFrame + length)
+            clipEnd = TimeCode.fromFrame(clipStartFrame + length, frameRate=self.frameRate)
+            if self.markClips:
+                clip.lastUsedEnd = clipEnd
+            cuts.append(Cut(clip,
+                            clipStart=TimeCode.fromFrame(clipStartFrame, frameRate=self.frameRate),
+                            clipEnd=clipEnd,
+                            timeLineStart=TimeCode.fromFrame(timeLineStart, frameRate=self.frameRate),
+                            timeLineEnd=TimeCode.fromFrame(beatFrames[last], frameRate=self.frameRate)))
+        return cuts
@@ -0,0 +1,140 @@
+__author__ = 'bjarrett'
+
+import numpy
+
+from edllib import TimeCodeArray, EDLIndex
+
+DECIMATIONS = ('minmax', 'lttb')
+
+
+def minMaxDecimate(x, y, buckets):
+    """
+    Splits the x range into buckets of equal width and keeps the lowest and highest y of each, so every spike
+    survives however many samples share a pixel. NaNs are ignored and empty buckets are left out.
+    :return: x and y arrays of at most 2 * buckets points, a min and a max at the middle of each bucket.
+    """
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    valid = ~numpy.isnan(y)
+    x, y = x[valid], y[valid]
+    if len(x) <= 2 * buckets:
+        return x, y
+    edges = numpy.linspace(x[0], x[-1], buckets + 1)
+    bucketIndex = numpy.clip(numpy.searchsorted(edges, x, side='right') - 1, 0, buckets - 1)
+    starts = numpy.flatnonzero(numpy.concatenate([[True], bucketIndex[1:] != bucketIndex[:-1]]))
+    lows = numpy.minimum.reduceat(y, starts)
+    highs = numpy.maximum.reduceat(y, starts)
+    centres = (edges[bucketIndex[starts]] + edges[bucketIndex[starts] + 1]) / 2.
+    return numpy.repeat(centres, 2), numpy.column_stack([lows, highs]).ravel()
+
+
+def lttbDecimate(x, y, threshold):
+    """
+    Largest triangle three buckets: keeps threshold of the points, picking from each bucket the point that makes
+    the biggest triangle with the point kept before it and the average of the next bucket. It keeps the shape of
+    the line better than min/max for the same number of points, and only returns real samples.
+    :return: x and y arrays of at most threshold points.
+    """
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    valid = ~numpy.isnan(y)
+    x, y = x[valid], y[valid]
+    count = len(x)
+    if threshold >= count or threshold < 3:
+        return x, y
+
+    # The first and last points are always kept, the rest are split into threshold - 2 buckets.
+    edges = (numpy.arange(threshold - 1) * (count - 2) / float(threshold - 2)).astype(numpy.int64) + 1
+    edges[-1] = count - 1
+    kept = numpy.empty(threshold, dtype=numpy.int64)
+    kept[0] = 0
+    kept[-1] = count - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        nextEnd = edges[i + 2] if i + 2 < len(edges) else count
+        nextX = x[end:nextEnd].mean()
+        nextY = y[end:nextEnd].mean()
+        areas = numpy.abs((x[previous] - nextX) * (y[start:end] - y[previous]) -
+                          (x[previous] - x[start:end]) * (nextY - y[previous]))
+        previous = start + int(numpy.argmax(areas))
+        kept[i + 1] = previous
+    return x[kept], y[kept]
+
+
+def decimate(x, y, width, method='minmax'):
+    """
+    Thins a series out to about as many points as there are pixels across the plot.
+    """
+    if method == 'minmax':
+        return minMaxDecimate(x, y, width)
+    if method == 'lttb':
+        return lttbDecimate(x, y, 2 * width)
+    raise ValueError('Unknown decimation %s, use one of %s' % (method, ', '.join(DECIMATIONS)))
+
+
+def readCutTimes(edlPath, frameRate):
+    """
+    :return: the record in time in seconds of every event in an EDL.
+    """
+    edl = EDLIndex.read(edlPath, frameRate=frameRate)
+    return TimeCodeArray(edl.recordIns, frameRate=edl.frameRate, dropFrame=edl.dropFrame).toSeconds()
+
+
+def renderGraph(eeg, outputPath=None, emotions=None, beats=None, scenes=None, cuts=None, width=1600, height=600,
+                method='minmax'):
+    """
+    Plots a session's EEG, and emotions if given, with the beats, scene boundaries and cuts laid over the top.
+    Every series is decimated to the plot's pixel width first, so drawing costs the same however long the session.
+    :param eeg: (seconds, mellow, concentration) arrays.
+    :param outputPath: a .png or .svg to render to without a display, None to show a window.
+    :param emotions: (seconds, dict of emotion -> array).
+    :param beats: beat times in seconds.
+    :param scenes: (end times in seconds, labels) of the scenes.
+    :param cuts: the times of the cuts in seconds.
+    """
+    import matplotlib
+    if outputPath is not None:
+        # No display on render nodes.
+        matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+
+    dpi = 100.
+    rows = 2 if emotions is not None else 1
+    figure, axes = plt.subplots(rows, 1, sharex=True, squeeze=False, figsize=(width / dpi, height / dpi), dpi=dpi)
+    axes = axes[:, 0]
+
+    seconds, mellow, concentration = eeg
+    for values, colour, label in ((mellow, 'y', 'Mellow'), (concentration, 'b', 'Concentration')):
+        axes[0].plot(*decimate(seconds, values, width, method), color=colour, label=label, linewidth=0.8)
+    axes[0].set_ylabel('Amount')
+
+    if emotions is not None:
+        emotionSeconds, emotionData = emotions
+        for name in sorted(emotionData):
+            axes[1].plot(*decimate(emotionSeconds, emotionData[name], width, method), label=name.title(),
+                         linewidth=0.8)
+        axes[1].set_ylabel('Emotion')
+
+    for ax in axes:
+        if beats is not None and len(beats):
+            # A rug along the bottom rather than full height lines, so thousands of beats don't hide the data.
+            ax.vlines(beats, 0., 0.04, transform=ax.get_xaxis_transform(), color='0.5', linewidth=0.5)
+        if cuts is not None and len(cuts):
+            ax.vlines(cuts, 0.96, 1., transform=ax.get_xaxis_transform(), color='r', linewidth=0.5)
+        if scenes is not None:
+            for end in scenes[0][:-1]:
+                ax.axvline(end, color='k', linestyle='--', linewidth=1.)
+        ax.legend(loc='upper right', fontsize='small')
+    if scenes is not None:
+        starts = numpy.concatenate([[0.], scenes[0][:-1]])
+        for start, label in zip(starts, scenes[1]):
+            axes[0].text(start, 1.01, label, transform=axes[0].get_xaxis_transform(), fontsize='small',
+                         va='bottom')
+    axes[-1].set_xlabel('Seconds')
+
+    if outputPath is None:
+        plt.show()
+    else:
+        figure.savefig(outputPath, dpi=dpi)
+    plt.close(figure)
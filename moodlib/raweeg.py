@@ -0,0 +1,260 @@
+__author__ = 'bjarrett'
+
+import json
+import multiprocessing
+import os
+import numpy
+from numpy.lib.stride_tricks import as_strided
+
+from zoic_api.logger import LOG
+from moodlib.cache import sourceKey, loadSidecar, saveSidecar, replaceFile
+from moodlib.csvcolumns import iterCsvColumns, BLOCK_SIZE
+from moodlib.eeg import EEG_TIME_COLUMN
+
+RAW_CHANNELS = ('RAW_TP9', 'RAW_FP1', 'RAW_FP2', 'RAW_TP10')
+# The frequency bands the Muse reports, in Hz, each taking the bins from its low edge up to its high edge.
+BANDS = (('delta', 1., 4.), ('theta', 4., 8.), ('alpha', 7.5, 13.), ('beta', 13., 30.), ('gamma', 30., 44.))
+BAND_NAMES = tuple(x[0] for x in BANDS)
+
+# Band power is worked out over windows this many seconds long, starting every DEFAULT_HOP seconds.
+DEFAULT_WINDOW = 2.0
+DEFAULT_HOP = 0.5
+# How many windows a chunk holds. A chunk takes about 36 bytes for each sample of each of its windows while it is
+# worked on, 75M for 1024 two second windows of four channels at 256Hz.
+DEFAULT_CHUNK_WINDOWS = 1024
+
+# Bump this when how the csv is converted or the features are worked out changes.
+RAW_VERSION = 1
+
+
+def rawPaths(eegPath):
+    """
+    :return: the paths of the converted samples, their times and the json describing them, next to the csv.
+    """
+    return '%s.raw.f32' % eegPath, '%s.raw-times.f64' % eegPath, '%s.raw.json' % eegPath
+
+
+def _loadInfo(infoPath):
+    if not os.path.exists(infoPath):
+        return None
+    try:
+        with open(infoPath, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError) as e:
+        LOG.debug('Unreadable raw EEG description %s: %s', infoPath, e)
+        return None
+
+
+def convertRawEeg(eegPath, channels=RAW_CHANNELS, blockSize=BLOCK_SIZE):
+    """
+    Converts the raw channels of a Muse csv to flat binary files next to it: float32 samples, a row of channels
+    each, and float64 seconds since the first sample. The csv is read a block at a time so converting takes the
+    memory of one block however big the file. Rows missing any of the channels, the band and marker rows the Muse
+    interleaves with the raw ones, are left out.
+    :return: how many samples were converted.
+    """
+    samplesPath, timesPath, infoPath = rawPaths(eegPath)
+    key = sourceKey(eegPath, RAW_VERSION, *channels)
+    tmpSamplesPath = '%s.%d.tmp' % (samplesPath, os.getpid())
+    tmpTimesPath = '%s.%d.tmp' % (timesPath, os.getpid())
+
+    count = 0
+    start = None
+    try:
+        with open(tmpSamplesPath, 'wb') as samplesFile, open(tmpTimesPath, 'wb') as timesFile:
+            for block in iterCsvColumns(eegPath, channels, timeColumn=EEG_TIME_COLUMN, blockSize=blockSize):
+                samples = numpy.column_stack([block[x] for x in channels])
+                times = block[EEG_TIME_COLUMN]
+                keep = ~(numpy.isnan(samples).any(axis=1) | numpy.isnan(times))
+                samples, times = samples[keep], times[keep]
+                if not len(times):
+                    continue
+                if start is None:
+                    start = times[0]
+                samplesFile.write(numpy.ascontiguousarray(samples, dtype=numpy.float32).tobytes())
+                timesFile.write(numpy.ascontiguousarray(times - start, dtype=numpy.float64).tobytes())
+                count += len(times)
+        replaceFile(tmpSamplesPath, samplesPath)
+        replaceFile(tmpTimesPath, timesPath)
+    finally:
+        for path in (tmpSamplesPath, tmpTimesPath):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # The description goes last, so samples from a conversion that didn't finish are never used.
+    tmpInfoPath = '%s.%d.tmp' % (infoPath, os.getpid())
+    with open(tmpInfoPath, 'w') as f:
+        json.dump({'key': key, 'count': count, 'channels': list(channels)}, f)
+    replaceFile(tmpInfoPath, infoPath)
+    return count
+
+
+def _mapSamples(samplesPath, count, channelCount):
+    if not count:
+        return numpy.zeros((0, channelCount), dtype=numpy.float32)
+    return numpy.memmap(samplesPath, dtype=numpy.float32, mode='r', shape=(count, channelCount))
+
+
+def _mapTimes(timesPath, count):
+    if not count:
+        return numpy.zeros(0, dtype=numpy.float64)
+    return numpy.memmap(timesPath, dtype=numpy.float64, mode='r', shape=(count,))
+
+
+def bandBins(windowSamples, sampleRate, bands=BANDS):
+    """
+    :return: the (first, last + 1) spectrum bin of each band for windows of windowSamples.
+    """
+    frequencies = numpy.fft.rfftfreq(windowSamples, 1. / sampleRate)
+    return [(int(numpy.searchsorted(frequencies, low)), int(numpy.searchsorted(frequencies, high)))
+            for name, low, high in bands]
+
+
+def windowBandPowers(samples, windowSamples, hopSamples, bins):
+    """
+    The power in each band of every window over some samples, averaged over the channels. Each window has its mean
+    taken off and a Hann taper applied before its spectrum is worked out.
+    :param samples: a (samples, channels) array.
+    :param bins: see bandBins.
+    :return: a (windows, bands) float64 array.
+    """
+    samples = numpy.ascontiguousarray(samples)
+    if len(samples) < windowSamples:
+        return numpy.zeros((0, len(bins)), dtype=numpy.float64)
+    count = 1 + (len(samples) - windowSamples) // hopSamples
+    rowStride, channelStride = samples.strides
+    windows = as_strided(samples, shape=(count, windowSamples, samples.shape[1]),
+                         strides=(hopSamples * rowStride, rowStride, channelStride))
+    windows = windows.astype(numpy.float64)
+    windows -= windows.mean(axis=1, keepdims=True)
+    windows *= numpy.hanning(windowSamples)[:, numpy.newaxis]
+    spectrum = numpy.fft.rfft(windows, axis=1)
+    del windows
+    power = spectrum.real ** 2 + spectrum.imag ** 2
+    del spectrum
+    return numpy.stack([power[:, first:last].sum(axis=1).mean(axis=1) for first, last in bins], axis=-1)
+
+
+def _chunkBandPowers(task):
+    """
+    Works out the band powers of one chunk of windows, reading only its samples from the converted file. A module
+    function of plain arguments so a process pool can run it.
+    """
+    samplesPath, count, channelCount, firstWindow, windowCount, windowSamples, hopSamples, bins = task
+    samples = _mapSamples(samplesPath, count, channelCount)
+    first = firstWindow * hopSamples
+    last = (firstWindow + windowCount - 1) * hopSamples + windowSamples
+    return windowBandPowers(samples[first:last], windowSamples, hopSamples, bins)
+
+
+class RawEeg(object):
+    """
+    The raw channels of a Muse csv, converted once to binary files next to the csv and memory mapped from then on,
+    so only the samples being worked on are ever read into memory. Band power is worked out over fixed size chunks
+    of windows, either in turn or over a pool of processes that each map the samples for themselves.
+    """
+    def __init__(self, samplesPath, timesPath, count, channels):
+        super(RawEeg, self).__init__()
+        self.samplesPath = samplesPath
+        self.count = count
+        self.channels = tuple(channels)
+        self.samples = _mapSamples(samplesPath, count, len(self.channels))
+        self.seconds = _mapTimes(timesPath, count)
+
+    def __len__(self):
+        return self.count
+
+    @classmethod
+    def open(cls, eegPath, channels=RAW_CHANNELS, blockSize=BLOCK_SIZE):
+        """
+        Maps the converted channels of a Muse csv, converting it first if it has never been or has changed since.
+        """
+        samplesPath, timesPath, infoPath = rawPaths(eegPath)
+        info = _loadInfo(infoPath)
+        if info is None or info.get('key') != sourceKey(eegPath, RAW_VERSION, *channels):
+            LOG.info('Converting the raw EEG in %s', eegPath)
+            count = convertRawEeg(eegPath, channels=channels, blockSize=blockSize)
+        else:
+            count = info['count']
+        return cls(samplesPath, timesPath, count, channels)
+
+    def sampleRate(self):
+        """
+        :return: the rate the samples came in at, worked out from their times.
+        """
+        if self.count < 2 or self.seconds[-1] <= self.seconds[0]:
+            raise ValueError('There are not enough raw EEG samples to tell their rate')
+        return (self.count - 1) / float(self.seconds[-1] - self.seconds[0])
+
+    def bandPowers(self, sampleRate=None, window=DEFAULT_WINDOW, hop=DEFAULT_HOP,
+                   chunkWindows=DEFAULT_CHUNK_WINDOWS, workers=None):
+        """
+        :param sampleRate: the rate the headband sampled at, worked out from the times when None.
+        :param window: how many seconds each band power is taken over.
+        :param hop: how many seconds apart windows start.
+        :param chunkWindows: how many windows are worked on at a time, which bounds the memory used.
+        :param workers: how many processes to work on chunks with, in this one when None or 1.
+        :return: the time of the middle of each window in seconds and a (windows, bands) array of band powers.
+        """
+        sampleRate = sampleRate or self.sampleRate()
+        if sampleRate < 2 * BANDS[-1][2]:
+            raise ValueError('Raw EEG sampled at %.1fHz is too slow to hold the %s band' % (sampleRate, BANDS[-1][0]))
+        windowSamples = int(round(window * sampleRate))
+        hopSamples = max(1, int(round(hop * sampleRate)))
+        bins = bandBins(windowSamples, sampleRate)
+        windowCount = 1 + (self.count - windowSamples) // hopSamples if self.count >= windowSamples else 0
+
+        tasks = [(self.samplesPath, self.count, len(self.channels), first, min(chunkWindows, windowCount - first),
+                  windowSamples, hopSamples, bins) for first in range(0, windowCount, chunkWindows)]
+        LOG.debug('Band power of %d windows in %d chunks at %.1fHz', windowCount, len(tasks), sampleRate)
+        if workers is not None and workers > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(workers, len(tasks)))
+            try:
+                chunks = pool.map(_chunkBandPowers, tasks)
+            except BaseException:
+                pool.terminate()
+                raise
+            else:
+                pool.close()
+            finally:
+                pool.join()
+        else:
+            chunks = [_chunkBandPowers(x) for x in tasks]
+
+        powers = numpy.concatenate(chunks) if chunks else numpy.zeros((0, len(BANDS)), dtype=numpy.float64)
+        middles = numpy.arange(windowCount, dtype=numpy.int64) * hopSamples + windowSamples // 2
+        return numpy.asarray(self.seconds[middles], dtype=numpy.float64), powers
+
+
+def mellowConcentration(powers):
+    """
+    Derives scores on the headband's own -1 to 1 scale from band powers: mellow rises as alpha outweighs beta, the
+    relaxed state, and concentration as beta outweighs alpha and theta together, the usual engagement index.
+    :param powers: a (windows, bands) array in BANDS order.
+    :return: mellow and concentration float32 arrays, NaN for windows with no power at all.
+    """
+    theta, alpha, beta = [powers[:, BAND_NAMES.index(x)] for x in ('theta', 'alpha', 'beta')]
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        mellow = (alpha - beta) / (alpha + beta)
+        concentration = (beta - alpha - theta) / (beta + alpha + theta)
+    return mellow.astype(numpy.float32), concentration.astype(numpy.float32)
+
+
+def readRawEegData(eegPath, sampleRate=None, window=DEFAULT_WINDOW, hop=DEFAULT_HOP,
+                   chunkWindows=DEFAULT_CHUNK_WINDOWS, workers=None, useCache=True):
+    """
+    Works mellow and concentration out from the raw channels of a Muse csv instead of taking the headband's scores,
+    a sample every hop seconds. The features are cached next to the csv like readEegColumns does.
+    :return: seconds since the first sample, mellow and concentration, as readEegData does.
+    """
+    key = sourceKey(eegPath, RAW_VERSION, sampleRate, window, hop)
+    data = loadSidecar(eegPath, 'rawfeatures', key) if useCache else None
+    if data is None:
+        raw = RawEeg.open(eegPath)
+        seconds, powers = raw.bandPowers(sampleRate=sampleRate, window=window, hop=hop, chunkWindows=chunkWindows,
+                                         workers=workers)
+        mellow, concentration = mellowConcentration(powers)
+        data = {'seconds': seconds, 'powers': powers, 'mellow': mellow, 'concentration': concentration}
+        if useCache:
+            saveSidecar(eegPath, 'rawfeatures', key, data)
+    return data['seconds'], data['mellow'], data['concentration']
@@ -0,0 +1,271 @@
+__author__ = 'bjarrett'
+
+import json
+import multiprocessing
+import os
+import subprocess
+from fractions import Fraction
+from multiprocessing.pool import ThreadPool
+
+from zoic_api.logger import LOG
+from moodlib.cache import replaceFile
+
+MEDIA_EXTENSIONS = ('.mov', '.mp4', '.m4v', '.mxf', '.avi', '.mkv')
+
+# Clip name substring -> tag, as used for the previz footage.
+DEFAULT_TAGS = {
+    'girl': 'girl',
+    'guy': 'guy',
+    'sun': 'sun',
+    'moon': 'moon',
+    '_cu': 'cu',
+    '_med': 'ms',
+    '_full': 'fs',
+    '_wide': 'ws',
+    '_superwide': 'xws',
+    '_high': 'overhead',
+    '_pov': 'pov',
+}
+
+# Bump this when what is recorded per clip changes so every clip is probed again.
+INDEX_VERSION = 1
+
+
+def clipTags(name, patterns=DEFAULT_TAGS):
+    lowered = name.lower()
+    return sorted(set(tag for pattern, tag in patterns.items() if pattern in lowered))
+
+
+def _rate(text):
+    numerator, _, denominator = (text or '0/1').partition('/')
+    denominator = int(denominator or 1)
+    return Fraction(int(numerator), denominator) if denominator else Fraction(0)
+
+
+def probeClip(path, ffprobe='ffprobe'):
+    """
+    Reads a clip's start timecode, frame rate and length in frames with ffprobe.
+    :return: a dict with start_tc, duration and frame_rate.
+    """
+    output = subprocess.check_output([ffprobe, '-v', 'error', '-print_format', 'json', '-show_streams',
+                                      '-show_format', path])
+    info = json.loads(output.decode('utf-8'))
+    streams = info.get('streams', [])
+    video = [x for x in streams if x.get('codec_type') == 'video']
+    if not video:
+        raise ValueError('%s has no video stream' % path)
+    video = video[0]
+
+    frameRate = _rate(video.get('r_frame_rate')) or _rate(video.get('avg_frame_rate'))
+    if frameRate <= 0:
+        raise ValueError('%s has no frame rate' % path)
+
+    if video.get('nb_frames', '').isdigit():
+        duration = int(video['nb_frames'])
+    else:
+        seconds = video.get('duration') or info.get('format', {}).get('duration')
+        if seconds is None:
+            raise ValueError('%s has no duration' % path)
+        duration = int(round(float(seconds) * frameRate))
+
+    # QuickTime keeps the timecode on its own tmcd stream, other containers on the video stream or the format.
+    startTc = None
+    for tags in [x.get('tags', {}) for x in streams] + [info.get('format', {}).get('tags', {})]:
+        if tags.get('timecode'):
+            startTc = tags['timecode']
+            break
+
+    return {
+        'start_tc': startTc or '00:00:00:00',
+        'duration': duration,
+        'frame_rate': '%d/%d' % (frameRate.numerator, frameRate.denominator),
+    }
+
+
+def walkFootage(roots, extensions=MEDIA_EXTENSIONS):
+    """
+    :return: a dict of absolute path -> (size, mtime) for every media file under the roots.
+    """
+    found = {}
+    for root in roots:
+        for directory, subdirectories, files in os.walk(root):
+            # Skip hidden directories such as .git or render caches.
+            subdirectories[:] = [x for x in subdirectories if not x.startswith('.')]
+            for name in files:
+                if os.path.splitext(name)[1].lower() not in extensions:
+                    continue
+                path = os.path.abspath(os.path.join(directory, name))
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found[path] = (st.st_size, st.st_mtime)
+    return found
+
+
+class FootageScanner(object):
+    """
+    Probes every clip under some directories, remembering each clip's size and mtime in an index so a rescan only
+    probes files that are new or have changed. Probing runs on a pool of threads since it is nearly all waiting on
+    ffprobe.
+    """
+    def __init__(self, indexPath, workers=None, ffprobe='ffprobe', probe=None):
+        """
+        :param indexPath: the json index of what was found last time.
+        :param workers: how many clips to probe at once, 4 per core by default.
+        :param probe: a function of a path to its clip info, ffprobe by default.
+        """
+        super(FootageScanner, self).__init__()
+        self.indexPath = indexPath
+        self.workers = workers or 4 * multiprocessing.cpu_count()
+        self.probe = probe or (lambda path: probeClip(path, ffprobe=ffprobe))
+        # How many files were probed, reused from the index, dropped because they are gone, or failed to probe.
+        self.probed = 0
+        self.reused = 0
+        self.removed = 0
+        self.failed = 0
+        self.failedPaths = []
+
+    def _loadIndex(self):
+        if not os.path.exists(self.indexPath):
+            return {}
+        try:
+            with open(self.indexPath, 'r') as f:
+                index = json.load(f)
+        except ValueError:
+            LOG.warning('Ignoring the unreadable scan index %s', self.indexPath)
+            return {}
+        if index.get('version') != INDEX_VERSION:
+            return {}
+        return index.get('files', {})
+
+    def _saveIndex(self, files):
+        tmpPath = '%s.%d.tmp' % (self.indexPath, os.getpid())
+        with open(tmpPath, 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'files': files}, f)
+        replaceFile(tmpPath, self.indexPath)
+
+    def _probe(self, path):
+        try:
+            return path, self.probe(path), None
+        except Exception as e:
+            return path, None, e
+
+    def scan(self, roots):
+        """
+        :return: a dict of absolute path -> clip info for every clip that could be probed, and the paths of the clips
+        that were found but could not be probed.
+        """
+        index = self._loadIndex()
+        found = walkFootage(roots)
+        self.removed = len(set(index).difference(found))
+
+        files = {}
+        toProbe = []
+        for path, (size, mtime) in found.items():
+            entry = index.get(path)
+            if entry is not None and entry['size'] == size and entry['mtime'] == mtime:
+                files[path] = entry
+            else:
+                toProbe.append(path)
+        self.reused = len(files)
+
+        if toProbe:
+            LOG.info('Probing %d new or changed clips on %d threads', len(toProbe), self.workers)
+            pool = ThreadPool(min(self.workers, len(toProbe)))
+            try:
+                for path, info, error in pool.imap_unordered(self._probe, sorted(toProbe)):
+                    if error is not None:
+                        LOG.warning('Could not probe %s: %s', path, error)
+                        self.failed += 1
+                        self.failedPaths.append(path)
+                        continue
+                    size, mtime = found[path]
+                    info = dict(info)
+                    info['size'] = size
+                    info['mtime'] = mtime
+                    files[path] = info
+                    self.probed += 1
+            finally:
+                pool.close()
+                pool.join()
+
+        self._saveIndex(files)
+        LOG.info('Scanned %d clips: %d probed, %d unchanged, %d removed, %d failed', len(found), self.probed,
+                 self.reused, self.removed, self.failed)
+        return files, sorted(self.failedPaths)
+
+
+def updateDescription(descriptionPath, files, failed=(), tagPatterns=DEFAULT_TAGS):
+    """
+    Writes a footage description for the scanned clips. Values already in an existing description, such as the
+    mellow and concentrate ratings, extra tags and the scenes, are kept. A clip is only dropped, from the clips and
+    the scenes, when the file it was scanned from is gone: clips that failed to probe or that have no path keep
+    their entries as they were.
+    :param files: a dict of path -> clip info from FootageScanner.scan.
+    :param failed: the paths FootageScanner.scan could not probe.
+    :return: the description written.
+    """
+    description = {'clips': {}, 'scenes': []}
+    if os.path.exists(descriptionPath):
+        with open(descriptionPath, 'r') as f:
+            description = json.load(f)
+    oldClips = description.get('clips', {})
+
+    clips = {}
+    for path in sorted(files):
+        name = os.path.basename(path)
+        if name in clips:
+            LOG.warning('Skipping %s, a clip called %s was already found at %s', path, name, clips[name]['path'])
+            continue
+        info = files[path]
+        clip = dict(oldClips.get(name, {}))
+        clip.setdefault('mellow', 0.0)
+        clip.setdefault('concentrate', 0.0)
+        clip['tags'] = sorted(set(clip.get('tags', [])).union(clipTags(name, tagPatterns)))
+        clip['start_tc'] = info['start_tc']
+        clip['duration'] = info['duration']
+        clip['frame_rate'] = info['frame_rate']
+        clip['path'] = path
+        clips[name] = clip
+
+    failedNames = set(os.path.basename(x) for x in failed)
+    for name, clip in oldClips.items():
+        if name in clips:
+            continue
+        if name in failedNames:
+            LOG.warning('Keeping %s as it was, it could not be probed', name)
+        elif clip.get('path') and not os.path.exists(clip['path']):
+            continue
+        elif not clip.get('path'):
+            LOG.warning('Keeping %s, it was not found under the footage directories', name)
+        clips[name] = clip
+
+    scenes = description.get('scenes', [])
+    for scene in scenes:
+        scene['clips'] = [x for x in scene.get('clips', []) if x in clips]
+    if not scenes:
+        LOG.warning('%s has no scenes yet, add them before generating with it', descriptionPath)
+
+    description = {'clips': clips, 'scenes': scenes}
+    tmpPath = '%s.%d.tmp' % (descriptionPath, os.getpid())
+    with open(tmpPath, 'w') as f:
+        writeDescription(f, description)
+    replaceFile(tmpPath, descriptionPath)
+    return description
+
+
+def writeDescription(f, description):
+    """
+    Writes a footage description as json with one clip and one scene per line, so it stays easy to edit by hand
+    and diff. Each value still goes through the json encoder; keys within a clip aren't sorted as sort_keys would
+    stop Python 2 using its fast encoder.
+    """
+    def lines(items):
+        return ',\n'.join('    ' + x for x in items)
+    clips = description['clips']
+    f.write('{\n  "clips": {\n')
+    f.write(lines('%s: %s' % (json.dumps(name), json.dumps(clips[name])) for name in sorted(clips)))
+    f.write('\n  },\n  "scenes": [\n')
+    f.write(lines(json.dumps(scene) for scene in description['scenes']))
+    f.write('\n  ]\n}\n')
@@ -0,0 +1,64 @@
+__author__ = 'bjarrett'
+
+import numpy
+
+from edllib import TimeCode
+
+
+class SceneTimeline(object):
+    """
+    The scenes of a clip description laid out on the song's timeline. Scene boundaries are parsed once into a
+    sorted array so beats can be matched to scenes with a binary search, and each scene's clip names are resolved
+    once into index arrays into the clip list.
+    """
+    def __init__(self, scenes, clips, frameRate):
+        """
+        :param scenes: the scene dicts from a clip description, in timeline order.
+        :param clips: the list of Clip objects the scenes refer to by name.
+        :param frameRate: the frame rate the scene end times are in.
+        """
+        super(SceneTimeline, self).__init__()
+        self.scenes = scenes
+        self.clips = clips
+
+        self.ends = numpy.array([TimeCode.fromString(x['end_time'], frameRate=frameRate).toSeconds() for x in scenes],
+                                dtype=numpy.float64)
+        if numpy.any(numpy.diff(self.ends) <= 0):
+            raise ValueError('Scene end times must be increasing.')
+        self.starts = numpy.concatenate([[0.], self.ends[:-1]])
+
+        clipIndices = dict((clip.name, i) for i, clip in enumerate(clips))
+        self.sceneClips = []
+        for scene in scenes:
+            missing = [x for x in scene['clips'] if x not in clipIndices]
+            if missing:
+                raise ValueError('Scene %s uses unknown clips: %s' % (scene.get('label'), ', '.join(missing)))
+            self.sceneClips.append(numpy.array([clipIndices[x] for x in scene['clips']], dtype=numpy.int64))
+
+        # Where each clip sits in each scene's clip array, -1 for clips not in it.
+        self.clipPositions = []
+        for sceneClips in self.sceneClips:
+            position = numpy.empty(len(clips), dtype=numpy.int64)
+            position.fill(-1)
+            position[sceneClips] = numpy.arange(len(sceneClips))
+            self.clipPositions.append(position)
+
+    def __len__(self):
+        return len(self.scenes)
+
+    def sceneIndices(self, times):
+        """
+        :param times: an array of times in seconds.
+        :return: the index of the scene each time falls in, -1 for times past the last scene.
+        """
+        indices = numpy.searchsorted(self.ends, numpy.asarray(times, dtype=numpy.float64), side='right')
+        return numpy.where(indices < len(self.scenes), indices, -1)
+
+    def sceneIndex(self, time):
+        return int(self.sceneIndices(time))
+
+    def candidates(self, sceneIndex):
+        """
+        :return: the Clip objects that can be used in a scene.
+        """
+        return [self.clips[x] for x in self.sceneClips[sceneIndex]]
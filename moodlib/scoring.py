@@ -0,0 +1,222 @@
+__author__ = 'bjarrett'
+
+import copy
+import numpy
+
+# The attributes a clip can be matched on. Emotions are optional per clip.
+CLIP_METRICS = ('mellow', 'concentrate', 'joy', 'disgust', 'sadness', 'anger', 'surprise', 'contempt', 'fear')
+# How many beats BeatScores works out at a time.
+BLOCK_BEATS = 32
+
+
+def clipFeature(clip, metric):
+    value = getattr(clip, metric, None)
+    if value is None:
+        value = getattr(clip, 'emotions', {}).get(metric)
+    return numpy.nan if value is None else value
+
+
+class ClipScorer(object):
+    """
+    Scores clips against target metric values. The clip attributes are held as a dense matrix, one row per clip and
+    one column per metric (NaN where a clip has no value), so every candidate for a beat, or for a whole block of
+    beats, is scored in one go.
+    """
+    # A target this close to a clip's value scores as well as an exact match.
+    MIN_DIFF = 0.01
+
+    def __init__(self, clips, metrics=CLIP_METRICS, randomness=1.0, seed=None):
+        """
+        :param clips: the list of clips, candidates are given as indices into it.
+        :param metrics: the names of the metrics targets are given for.
+        :param randomness: how much each score is jittered (0 = no randomness, 1.0 = highly random).
+        :param seed: seeds the random jitter so runs can be reproduced.
+        """
+        super(ClipScorer, self).__init__()
+        self.clips = clips
+        self.metrics = list(metrics)
+        self.features = numpy.array([[clipFeature(clip, metric) for metric in self.metrics] for clip in clips],
+                                    dtype=numpy.float64).reshape(len(clips), len(self.metrics))
+
+        self.tagNames = sorted(set().union(*[clip.tags for clip in clips])) if clips else []
+        self.tags = numpy.zeros((len(clips), len(self.tagNames)), dtype=bool)
+        tagIndices = dict((tag, i) for i, tag in enumerate(self.tagNames))
+        for i, clip in enumerate(clips):
+            for tag in clip.tags:
+                self.tags[i, tagIndices[tag]] = True
+
+        self.randomness = randomness
+        self.random = numpy.random.RandomState(seed)
+
+    def variant(self, seed=None, randomness=None):
+        """
+        :return: a scorer sharing this one's clip matrices but with its own random jitter, for another take on the
+        same edit.
+        """
+        other = copy.copy(self)
+        other.randomness = self.randomness if randomness is None else randomness
+        other.random = numpy.random.RandomState(seed)
+        return other
+
+    def seedBeat(self, seed, beatIndex):
+        """
+        Reseeds the jitter from a run's seed and a beat, so the randomness on a beat doesn't depend on how much
+        earlier beats drew and a run can be picked up part way through the song.
+        """
+        self.random = numpy.random.RandomState([seed, beatIndex])
+
+    def targets(self, values):
+        """
+        :param values: a dict of metric -> target, or metric -> array of targets for a block of beats.
+        :return: the targets as an array ordered like self.metrics, NaN for metrics with no target.
+        """
+        columns = [numpy.asarray(values.get(metric, numpy.nan), dtype=numpy.float64) for metric in self.metrics]
+        return numpy.stack(numpy.broadcast_arrays(*columns), axis=-1)
+
+    def tagMask(self, tags):
+        """
+        :return: a bool per clip, True where the clip has any of the tags.
+        """
+        columns = [self.tagNames.index(x) for x in tags if x in self.tagNames]
+        return self.tags[:, columns].any(axis=1)
+
+    def baseScores(self, targets, candidates=None):
+        """
+        How closely each candidate matches the targets, without reuse penalties or randomness. A clip's score is the
+        mean over the metrics both it and the target have of 1 / |target - value|.
+        :param targets: an array of len(metrics) targets, or (beats, len(metrics)) for a block of beats.
+        :param candidates: the clip indices to score, all clips when None.
+        :return: an array of (candidates,) or (beats, candidates) scores.
+        """
+        features = self.features if candidates is None else self.features[candidates]
+        targets = numpy.asarray(targets, dtype=numpy.float64)
+        diffs = numpy.abs(targets[..., numpy.newaxis, :] - features)
+        valid = ~numpy.isnan(diffs)
+        closeness = 1. / numpy.maximum(numpy.where(valid, diffs, 1.), self.MIN_DIFF)
+        counts = valid.sum(axis=-1)
+        sums = numpy.where(valid, closeness, 0.).sum(axis=-1)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            return numpy.where(counts > 0, sums / numpy.maximum(counts, 1), 0.)
+
+    @staticmethod
+    def reusePenalty(reusedCounter):
+        return 1. / (numpy.log(reusedCounter + 1) + 1)
+
+    def jitter(self, scores, random=None):
+        """
+        Moves each score by up to randomness times its own size.
+        """
+        if self.randomness <= 0:
+            return scores
+        random = self.random if random is None else random
+        return scores + self.randomness * numpy.abs(scores) * random.uniform(-1., 1., size=numpy.shape(scores))
+
+    def score(self, targets, candidates, lastClip=-1, reusedCounter=0, base=None):
+        """
+        Scores candidates for one beat, penalising the clip that is already playing the longer it has been used.
+        :param targets: an array of len(metrics) targets.
+        :param candidates: an array of clip indices.
+        :param lastClip: the index of the clip currently playing, -1 for none.
+        :param reusedCounter: how many beats lastClip has been held for.
+        :param base: the candidates' base scores against targets if they are already known.
+        :return: a score per candidate.
+        """
+        candidates = numpy.asarray(candidates)
+        scores = self.baseScores(targets, candidates) if base is None else base
+        scores = numpy.where(candidates == lastClip, scores * self.reusePenalty(reusedCounter), scores)
+        return self.jitter(scores)
+
+    def rank(self, targets, candidates, lastClip=-1, reusedCounter=0, base=None):
+        """
+        :return: the candidate clip indices, best first.
+        """
+        candidates = numpy.asarray(candidates)
+        scores = self.score(targets, candidates, lastClip, reusedCounter, base=base)
+        return candidates[numpy.argsort(-scores, kind='mergesort')]
+
+
+class BeatScores(object):
+    """
+    The base scores of every clip in a beat's scene against that beat's own targets. They don't depend on any choice
+    made while cutting, so every variant of an edit can share them; only sections stretched over beats without a cut
+    need scoring again. They are worked out a block of beats at a time as the cut loop reaches them and only the
+    current block is held, unless keepScores asks for them to be kept for the next edit cut from the same inputs.
+    """
+    def __init__(self, scorer, timeline, beatScenes, targets, keepScores=0, blockBeats=BLOCK_BEATS):
+        """
+        :param scorer: the ClipScorer for the clips.
+        :param timeline: the SceneTimeline for the clips.
+        :param beatScenes: the scene index of each beat.
+        :param targets: a (beats, metrics) array of targets, see ClipScorer.targets.
+        :param keepScores: how many scores to keep once worked out, from the first beat on. Beats past that many are
+            worked out again each time they are asked for.
+        :param blockBeats: how many beats are scored at a time.
+        """
+        super(BeatScores, self).__init__()
+        self.scorer = scorer
+        self.timeline = timeline
+        self.beatScenes = numpy.asarray(beatScenes, dtype=numpy.int64)
+        self.targets = targets
+        self.keepScores = keepScores
+        self.blockBeats = blockBeats
+        self.keptScores = 0
+        self._kept = {}
+        self._blockStart = self._blockEnd = 0
+        self._blockRows = []
+
+    def _score(self, beatIndices):
+        """
+        :return: the scene scores of each beat, None for beats outside every scene.
+        """
+        rows = [None] * len(beatIndices)
+        scenes = self.beatScenes[beatIndices]
+        for sceneIndex in numpy.unique(scenes[scenes >= 0]):
+            positions = numpy.flatnonzero(scenes == sceneIndex)
+            scores = self.scorer.baseScores(self.targets[beatIndices[positions]],
+                                            self.timeline.sceneClips[sceneIndex])
+            for row, position in enumerate(positions):
+                rows[position] = scores[row]
+        return rows
+
+    def blocks(self):
+        """
+        Scores the whole song a scene at a time, blockBeats at a time so the working arrays stay small.
+        :return: a generator of (scene index, beat indices, (beats, scene clips) scores) for each scene with beats.
+        """
+        for sceneIndex, sceneClips in enumerate(self.timeline.sceneClips):
+            beatIndices = numpy.flatnonzero(self.beatScenes == sceneIndex)
+            if not len(beatIndices):
+                continue
+            scores = [self.scorer.baseScores(self.targets[beatIndices[i:i + self.blockBeats]], sceneClips)
+                      for i in range(0, len(beatIndices), self.blockBeats)]
+            yield sceneIndex, beatIndices, numpy.concatenate(scores)
+
+    def beat(self, beatIndex):
+        """
+        :return: the scores of the beat's scene's clips, ordered like the scene's clip array.
+        """
+        row = self._kept.get(beatIndex)
+        if row is not None:
+            return row
+        if not self._blockStart <= beatIndex < self._blockEnd:
+            self._blockStart = beatIndex
+            self._blockEnd = min(beatIndex + self.blockBeats, len(self.beatScenes))
+            self._blockRows = self._score(numpy.arange(self._blockStart, self._blockEnd))
+            for i, row in enumerate(self._blockRows):
+                if row is None or self._blockStart + i in self._kept:
+                    continue
+                if self.keptScores + len(row) > self.keepScores:
+                    break
+                # A copy, so a kept row doesn't hold on to the rest of its block.
+                self._kept[self._blockStart + i] = row.copy()
+                self.keptScores += len(row)
+        return self._blockRows[beatIndex - self._blockStart]
+
+    def candidates(self, beatIndex, candidates):
+        """
+        :return: the scores of some of the beat's scene's clips.
+        """
+        positions = self.timeline.clipPositions[self.beatScenes[beatIndex]][candidates]
+        if numpy.any(positions < 0):
+            raise ValueError('Not every candidate is in the scene of beat %d' % beatIndex)
+        return self.beat(beatIndex)[positions]
@@ -0,0 +1,195 @@
+__author__ = 'bjarrett'
+
+import collections
+import json
+import os
+import signal
+import stat
+import sys
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import UnixStreamServer
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import UnixStreamServer
+
+import numpy
+
+from zoic_api.logger import LOG
+
+DEFAULT_MAX_MEGABYTES = 2048
+
+
+def fileKey(*paths):
+    """
+    :return: a key for what is in some files right now, their absolute paths, sizes and mtimes, so a file that has
+    changed is loaded again.
+    """
+    key = []
+    for path in paths:
+        st = os.stat(path)
+        key.append((os.path.abspath(path), st.st_size, st.st_mtime))
+    return tuple(key)
+
+
+def estimateBytes(value, seen=None):
+    """
+    A rough count of the memory held by value: numpy arrays by their buffers, containers and objects by their own
+    size plus whatever they hold. Anything reachable more than once is counted once.
+    """
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, numpy.ndarray):
+        return value.nbytes
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimateBytes(k, seen) + estimateBytes(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimateBytes(x, seen) for x in value)
+    elif hasattr(value, '__dict__'):
+        size += estimateBytes(value.__dict__, seen)
+    return size
+
+
+class DatasetCache(object):
+    """
+    Loaded datasets kept in memory between requests. Once they hold more than maxBytes the least recently used are
+    dropped, though the one just loaded is always kept even if it is bigger than the whole budget.
+    """
+    def __init__(self, maxBytes=DEFAULT_MAX_MEGABYTES * 1024 * 1024):
+        super(DatasetCache, self).__init__()
+        self.maxBytes = maxBytes
+        # key -> (value, estimated bytes), least recently used first.
+        self._entries = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, load):
+        """
+        :param key: what identifies the dataset, see fileKey.
+        :param load: a function to load the dataset with if it isn't in memory.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.hits += 1
+            self._entries[key] = entry
+            return entry[0]
+
+        self.misses += 1
+        value = load()
+        size = estimateBytes(value)
+        self._entries[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.maxBytes and len(self._entries) > 1:
+            oldKey, (oldValue, oldSize) = self._entries.popitem(last=False)
+            self.bytes -= oldSize
+            self.evictions += 1
+            LOG.debug('Dropped %s to stay under %.0fM', oldKey[0], self.maxBytes / 1024. ** 2)
+        return value
+
+    def summary(self):
+        return {
+            'entries': len(self._entries),
+            'megabytes': self.bytes / 1024. ** 2,
+            'max_megabytes': self.maxBytes / 1024. ** 2,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    """
+    Passes each request's json body to the server's route for its method and path and replies with what that
+    returns as json. A ValueError or missing file is the caller's fault and answered with a 400.
+    """
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, body):
+        route = self.server.routes.get((self.command, self.path))
+        if route is None:
+            return self._reply(404, {'error': 'No %s %s' % (self.command, self.path)})
+        try:
+            reply = route(body)
+        except (ValueError, KeyError, IOError, OSError) as e:
+            LOG.warning('%s %s failed: %s', self.command, self.path, e)
+            return self._reply(400, {'error': '%s: %s' % (e.__class__.__name__, e)})
+        except Exception as e:
+            LOG.exception('%s %s failed', self.command, self.path)
+            return self._reply(500, {'error': '%s: %s' % (e.__class__.__name__, e)})
+        self._reply(200, reply)
+
+    def do_GET(self):
+        self._handle({})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+        except ValueError as e:
+            return self._reply(400, {'error': 'The body is not json: %s' % e})
+        self._handle(body)
+
+    def address_string(self):
+        # Unix socket clients have no address.
+        return str(self.client_address[0]) if self.client_address else 'local'
+
+    def log_message(self, format, *args):
+        LOG.debug(format, *args)
+
+
+class _UnixHTTPServer(UnixStreamServer):
+    pass
+
+
+class RequestServer(object):
+    """
+    Serves json requests over HTTP on a local Unix socket or a TCP port. Requests are handled one at a time, so
+    the routes can share what they keep in memory without locking.
+    """
+    def __init__(self, routes, socketPath=None, port=None, host='127.0.0.1'):
+        """
+        :param routes: a dict of (method, path) -> function of the request body to the reply.
+        :param socketPath: the Unix socket to listen on.
+        :param port: the TCP port to listen on instead.
+        """
+        super(RequestServer, self).__init__()
+        if (socketPath is None) == (port is None):
+            raise ValueError('Serve on one of a Unix socket or a port')
+        self.socketPath = socketPath
+        if socketPath is not None:
+            # A socket left behind by a server that died would stop the bind, anything else there is a mistake.
+            if os.path.exists(socketPath):
+                if not stat.S_ISSOCK(os.stat(socketPath).st_mode):
+                    raise ValueError('%s exists and is not a socket' % socketPath)
+                os.remove(socketPath)
+            self.server = _UnixHTTPServer(socketPath, _JsonHandler)
+            self.address = socketPath
+        else:
+            self.server = HTTPServer((host, port), _JsonHandler)
+            self.address = 'http://%s:%d' % (host, self.server.server_address[1])
+        self.server.routes = routes
+
+    def serveForever(self):
+        # Exit through the finally on a plain kill too, so the socket file is removed.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if self.socketPath is not None and os.path.exists(self.socketPath):
+                os.remove(self.socketPath)
@@ -0,0 +1,93 @@
+__author__ = 'bjarrett'
+
+import collections
+import contextlib
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows has no getrusage, peaks are reported as None there.
+    resource = None
+
+
+def peakMegabytes():
+    """
+    :return: the peak resident memory of this process so far in megabytes, or None where it can't be found.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes.
+    return peak / (1024. * 1024.) if sys.platform == 'darwin' else peak / 1024.
+
+
+def currentMegabytes():
+    """
+    :return: the resident memory of this process right now in megabytes, or None off Linux.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024. * 1024.)
+
+
+class RunStats(object):
+    """
+    Records how long each stage of a run took and how memory grew over it, plus named counters. Stages are kept in
+    the order they ran and a stage that runs more than once has its times added up.
+    """
+    def __init__(self):
+        super(RunStats, self).__init__()
+        self.stages = collections.OrderedDict()
+        self.counters = collections.Counter()
+        self.started = time.time()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        before = currentMegabytes()
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            after = currentMegabytes()
+            entry = self.stages.setdefault(name, {'seconds': 0., 'calls': 0, 'rss_growth_mb': 0.})
+            entry['seconds'] += elapsed
+            entry['calls'] += 1
+            if before is not None and after is not None:
+                entry['rss_growth_mb'] += after - before
+            entry['rss_mb'] = after
+            entry['peak_mb'] = peakMegabytes()
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def summary(self):
+        return {
+            'seconds': time.time() - self.started,
+            'peak_mb': peakMegabytes(),
+            'stages': self.stages,
+            'counters': dict(self.counters),
+        }
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=4)
+
+    def describe(self):
+        """
+        :return: a few lines summing up the stages and counters for a person to read.
+        """
+        lines = ['%-16s %9s %10s %9s' % ('stage', 'seconds', 'growth MB', 'peak MB')]
+        for name, entry in self.stages.items():
+            lines.append('%-16s %9.3f %10.1f %9s' % (name, entry['seconds'], entry['rss_growth_mb'],
+                                                    '%.1f' % entry['peak_mb'] if entry['peak_mb'] is not None else '-'))
+        for name, value in sorted(self.counters.items()):
+            lines.append('%-28s %d' % (name, value))
+        return '\n'.join(lines)
@@ -0,0 +1,128 @@
+__author__ = 'bjarrett'
+
+import numpy
+
+
+class SignalWindowIndex(object):
+    """
+    Precomputed running sums over one sampled signal, so the mean or variance over any [start, end) window of time
+    costs the same no matter how long the window is. NaN samples are skipped rather than spoiling the window.
+
+    Windows are given in seconds. Either sampleRate is given, in which case sample i is at startTime + i / sampleRate,
+    or times holds the (sorted) time of every sample.
+    """
+    def __init__(self, values, sampleRate=None, times=None, startTime=0.):
+        super(SignalWindowIndex, self).__init__()
+        if (sampleRate is None) == (times is None):
+            raise ValueError('Exactly one of sampleRate or times is needed')
+        values = numpy.asarray(values, dtype=numpy.float64)
+        if times is not None:
+            times = numpy.asarray(times, dtype=numpy.float64)
+            if len(times) != len(values):
+                raise ValueError('There are %d times for %d values' % (len(times), len(values)))
+
+        self.values = values
+        self.sampleRate = sampleRate
+        self.times = times
+        self.startTime = startTime
+
+        valid = ~numpy.isnan(values)
+        cleaned = numpy.where(valid, values, 0.)
+        self._sums = numpy.concatenate([[0.], numpy.cumsum(cleaned)])
+        self._squares = numpy.concatenate([[0.], numpy.cumsum(cleaned * cleaned)])
+        self._counts = numpy.concatenate([[0], numpy.cumsum(valid)])
+        self._minTable = None
+        self._maxTable = None
+
+    def __len__(self):
+        return len(self.values)
+
+    def indices(self, start, end):
+        """
+        :return: the [lo, hi) sample index range of each window.
+        """
+        start = numpy.asarray(start, dtype=numpy.float64)
+        end = numpy.asarray(end, dtype=numpy.float64)
+        if self.times is not None:
+            lo = numpy.searchsorted(self.times, start, side='left')
+            hi = numpy.searchsorted(self.times, end, side='left')
+        else:
+            # A tiny nudge so a window edge that lands on a sample doesn't round past it.
+            lo = numpy.ceil((start - self.startTime) * self.sampleRate - 1e-9).astype(numpy.int64)
+            hi = numpy.ceil((end - self.startTime) * self.sampleRate - 1e-9).astype(numpy.int64)
+            lo = numpy.clip(lo, 0, len(self.values))
+            hi = numpy.clip(hi, 0, len(self.values))
+        return lo, numpy.maximum(lo, hi)
+
+    @staticmethod
+    def _result(values):
+        if numpy.ndim(values) == 0:
+            return float(values)
+        return values
+
+    def count(self, start, end):
+        lo, hi = self.indices(start, end)
+        return self._counts[hi] - self._counts[lo]
+
+    def mean(self, start, end):
+        """
+        The mean of the non NaN samples in each [start, end) window, NaN where there are none.
+        start and end can be scalars or arrays of windows.
+        """
+        lo, hi = self.indices(start, end)
+        counts = self._counts[hi] - self._counts[lo]
+        sums = self._sums[hi] - self._sums[lo]
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            means = numpy.where(counts > 0, sums / counts, numpy.nan)
+        return self._result(means)
+
+    def variance(self, start, end):
+        lo, hi = self.indices(start, end)
+        counts = self._counts[hi] - self._counts[lo]
+        sums = self._sums[hi] - self._sums[lo]
+        squares = self._squares[hi] - self._squares[lo]
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+            variances = numpy.where(counts > 0, numpy.maximum(squares / counts - means * means, 0.), numpy.nan)
+        return self._result(variances)
+
+    def _sparseTable(self, fill, reduce):
+        # Row k holds the reduction of every run of 2**k samples, any window is then covered by two runs.
+        table = [numpy.where(numpy.isnan(self.values), fill, self.values)]
+        width = 1
+        while width * 2 <= len(self.values):
+            previous = table[-1]
+            row = numpy.full(len(self.values), fill)
+            row[:len(previous) - width] = reduce(previous[:-width], previous[width:])
+            table.append(row)
+            width *= 2
+        return numpy.array(table)
+
+    def _query(self, table, fill, reduce, start, end):
+        lo, hi = self.indices(start, end)
+        lengths = hi - lo
+        levels = numpy.zeros(numpy.shape(lengths), dtype=numpy.int64)
+        nonEmpty = lengths > 0
+        levels[nonEmpty] = numpy.floor(numpy.log2(lengths[nonEmpty])).astype(numpy.int64)
+        last = numpy.maximum(hi - (1 << levels), lo)
+        lo = numpy.minimum(lo, len(self.values) - 1)
+        last = numpy.minimum(last, len(self.values) - 1)
+        result = reduce(table[levels, lo], table[levels, last])
+        return self._result(numpy.where(nonEmpty & (result != fill), result, numpy.nan))
+
+    def min(self, start, end):
+        """
+        The smallest non NaN sample in each window. The lookup table for this is only built on first use.
+        """
+        if not len(self.values):
+            return self.mean(start, end)
+        if self._minTable is None:
+            self._minTable = self._sparseTable(numpy.inf, numpy.minimum)
+        return self._query(self._minTable, numpy.inf, numpy.minimum, start, end)
+
+    def max(self, start, end):
+        if not len(self.values):
+            return self.mean(start, end)
+        if self._maxTable is None:
+            self._maxTable = self._sparseTable(-numpy.inf, numpy.maximum)
+        return self._query(self._maxTable, -numpy.inf, numpy.maximum, start, end)